@@ -0,0 +1 @@
+"""Benchmarks for the SAM handler. Run them with `python -m benchmarks --help`."""
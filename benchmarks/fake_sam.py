@@ -0,0 +1,160 @@
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Union
+
+from botocore.exceptions import ClientError
+
+from sam_handler.cache import hash_path
+from sam_handler.template import dump_template, iter_local_artifacts, load_template
+
+
+def _parse_options(args: List[str]) -> Dict[str, Union[str, bool]]:
+    options = {}
+    index = 0
+    while index < len(args):
+        name = args[index][2:]
+        if index + 1 < len(args) and not args[index + 1].startswith("--"):
+            options[name] = args[index + 1]
+            index += 2
+        else:
+            options[name] = True
+            index += 1
+    return options
+
+
+class FakeSamBackend:
+    def __init__(self, command_latency: float = 0.0):
+        """A deterministic stand-in for SAM CLI, used in place of subprocess.run by SamInvoker.
+
+        `sam build` copies every local artifact into the build directory and writes the built
+        template, like SAM does for code that needs no dependencies to be installed. `sam package`
+        rewrites every artifact into an S3 URI derived from its contents, without uploading anything.
+
+        Args:
+            command_latency: The number of seconds every command takes on top of its actual work,
+                to simulate SAM CLI's startup time
+        """
+        self.command_latency = command_latency
+        self.commands: List[List[str]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, command, *, cwd, **kwargs) -> subprocess.CompletedProcess:
+        args = shlex.split(command) if isinstance(command, str) else list(command)
+        with self._lock:
+            self.commands.append(args)
+        if self.command_latency:
+            time.sleep(self.command_latency)
+
+        options = _parse_options(args[2:])
+        if args[1] == "build":
+            self._build(Path(cwd), options)
+        elif args[1] == "package":
+            self._package(options)
+        else:
+            raise subprocess.CalledProcessError(2, command)
+        return subprocess.CompletedProcess(args, 0)
+
+    def _build(self, cwd: Path, options: dict):
+        template_path = cwd.joinpath(options.get("template-file", "template.yaml"))
+        build_directory = cwd.joinpath(options.get("build-dir", ".aws-sam/build"))
+        template = load_template(template_path.read_text())
+
+        build_directory.mkdir(parents=True, exist_ok=True)
+        for artifact in iter_local_artifacts(template, template_path.parent):
+            destination = build_directory / artifact.logical_id
+            if artifact.path.is_dir():
+                shutil.copytree(artifact.path, destination, dirs_exist_ok=True)
+            else:
+                shutil.copy2(artifact.path, destination)
+            properties = template["Resources"][artifact.logical_id]["Properties"]
+            properties[artifact.property_name] = artifact.logical_id
+        (build_directory / "template.yaml").write_text(dump_template(template))
+
+    def _package(self, options: dict):
+        template_path = Path(options["template-file"])
+        template = load_template(template_path.read_text())
+        for artifact in iter_local_artifacts(template, template_path.parent):
+            properties = template["Resources"][artifact.logical_id]["Properties"]
+            properties[artifact.property_name] = (
+                f"s3://{options['s3-bucket']}/{options['s3-prefix']}/"
+                f"{hash_path(artifact.path)}"
+            )
+        Path(options["output-template-file"]).write_text(dump_template(template))
+
+
+class FakeConnectionManager:
+    """A stand-in for Sceptre's ConnectionManager, for a stack without a profile or role."""
+
+    region = "us-east-1"
+    profile = None
+    sceptre_role = None
+
+    def create_session_environment_variables(self) -> dict:
+        return {}
+
+
+class FakeS3Client:
+    """An in-memory stand-in for a boto3 S3 client.
+
+    Args:
+        store_contents: Whether to keep the contents of uploaded files, rather than only their keys
+    """
+
+    def __init__(self, store_contents: bool = True):
+        self.store_contents = store_contents
+        # Maps the bucket and key of each object to its contents
+        self.objects = {}
+        self.list_calls = 0
+        self.can_list = True
+        self._uploads = 0
+        # Maps the bucket and key of each object to the order it was uploaded in
+        self._upload_order = {}
+        self._lock = threading.Lock()
+
+    def upload_file(self, filename, bucket, key):
+        contents = Path(filename).read_bytes() if self.store_contents else b""
+        with self._lock:
+            self._uploads += 1
+            self.objects[(bucket, key)] = contents
+            self._upload_order[(bucket, key)] = self._uploads
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {}
+
+    def download_file(self, bucket, key, filename):
+        if (bucket, key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        Path(filename).write_bytes(self.objects[(bucket, key)])
+
+    def delete_object(self, Bucket, Key):
+        with self._lock:
+            del self.objects[(Bucket, Key)]
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        with self._lock:
+            self.list_calls += 1
+            if not self.can_list:
+                raise ClientError({"Error": {"Code": "AccessDenied"}}, "ListObjectsV2")
+            contents = [
+                {
+                    "Key": key,
+                    "Size": len(body),
+                    "LastModified": datetime.fromtimestamp(
+                        self._upload_order.get((bucket, key), 0), timezone.utc
+                    ),
+                }
+                for (bucket, key), body in self.objects.items()
+                if bucket == Bucket and key.startswith(Prefix)
+            ]
+        yield {"Contents": contents}
@@ -0,0 +1,129 @@
+import hashlib
+from pathlib import Path
+from typing import NamedTuple
+
+from sam_handler.template import dump_template
+
+JINJA_TEMPLATE = """\
+AWSTemplateFormatVersion: "2010-09-09"
+Transform: AWS::Serverless-2016-10-31
+Resources:
+{%- for layer in sceptre_user_data.layers %}
+  {{ layer }}:
+    Type: AWS::Serverless::LayerVersion
+    Properties:
+      ContentUri: layers/{{ layer }}
+      CompatibleRuntimes:
+        - {{ sceptre_user_data.runtime }}
+{%- endfor %}
+{%- for function in sceptre_user_data.functions %}
+  {{ function }}:
+    Type: AWS::Serverless::Function
+    Properties:
+      CodeUri: functions/{{ function }}
+      Handler: app.handler
+      Runtime: {{ sceptre_user_data.runtime }}
+      Layers:
+{%- for layer in sceptre_user_data.layers %}
+        - Ref: {{ layer }}
+{%- endfor %}
+{%- endfor %}
+"""
+
+RUNTIME = "python3.11"
+
+
+class ProjectSpec(NamedTuple):
+    """The shape of a synthetic SAM project."""
+
+    functions: int = 5
+    layers: int = 1
+    files_per_artifact: int = 5
+    file_size: int = 1024
+    jinja: bool = False
+
+    @property
+    def function_names(self):
+        return [f"Function{index}" for index in range(self.functions)]
+
+    @property
+    def layer_names(self):
+        return [f"Layer{index}" for index in range(self.layers)]
+
+    @property
+    def sceptre_user_data(self) -> dict:
+        """The user data the Jinja template is rendered with."""
+        return {
+            "runtime": RUNTIME,
+            "functions": self.function_names,
+            "layers": self.layer_names,
+        }
+
+
+def _file_contents(seed: str, size: int) -> bytes:
+    """Returns size bytes that only depend on the seed, so every generated project is identical."""
+    block = hashlib.sha256(seed.encode()).hexdigest().encode()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def _write_artifact(directory: Path, spec: ProjectSpec):
+    for index in range(spec.files_per_artifact):
+        path = directory / f"module{index}.py"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(
+            _file_contents(
+                f"{directory.parent.name}/{directory.name}/{index}", spec.file_size
+            )
+        )
+    (directory / "app.py").write_text("def handler(event, context):\n    return {}\n")
+
+
+def _plain_template(spec: ProjectSpec) -> dict:
+    resources = {}
+    for layer in spec.layer_names:
+        resources[layer] = {
+            "Type": "AWS::Serverless::LayerVersion",
+            "Properties": {
+                "ContentUri": f"layers/{layer}",
+                "CompatibleRuntimes": [RUNTIME],
+            },
+        }
+    for function in spec.function_names:
+        resources[function] = {
+            "Type": "AWS::Serverless::Function",
+            "Properties": {
+                "CodeUri": f"functions/{function}",
+                "Handler": "app.handler",
+                "Runtime": RUNTIME,
+                "Layers": [{"Ref": layer} for layer in spec.layer_names],
+            },
+        }
+    return {
+        "AWSTemplateFormatVersion": "2010-09-09",
+        "Transform": "AWS::Serverless-2016-10-31",
+        "Resources": resources,
+    }
+
+
+def generate_project(spec: ProjectSpec, directory: Path) -> Path:
+    """Generates a SAM project with the shape of the spec.
+
+    Args:
+        spec: The shape of the project
+        directory: The directory to generate the project in
+
+    Returns:
+        The path of the project's template, which is a Jinja template if spec.jinja is True
+    """
+    for function in spec.function_names:
+        _write_artifact(directory / "functions" / function, spec)
+    for layer in spec.layer_names:
+        _write_artifact(directory / "layers" / layer / "python", spec)
+
+    if spec.jinja:
+        template_path = directory / "template.j2"
+        template_path.write_text(JINJA_TEMPLATE)
+    else:
+        template_path = directory / "template.yaml"
+        template_path.write_text(dump_template(_plain_template(spec)))
+    return template_path
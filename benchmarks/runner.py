@@ -0,0 +1,325 @@
+import argparse
+import gc
+import hashlib
+import json
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import yaml
+from sceptre.template_handlers import helper
+
+from benchmarks.fake_sam import FakeConnectionManager, FakeS3Client, FakeSamBackend
+from benchmarks.project import ProjectSpec, generate_project
+from sam_handler.environment import SessionEnvironmentCache
+from sam_handler.handler import SAM, SamInvoker
+from sam_handler.registry import BuildRegistry
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+# How much slower (or bigger) than the baseline a result may be before it counts as a regression
+DEFAULT_THRESHOLD = 0.25
+
+# Latency is compared relative to the time of the calibration workload, so that a baseline recorded
+# on one machine can be compared with results from another. It is still noisier than peak memory,
+# so it's only compared on request, with its own (looser) threshold.
+DEFAULT_LATENCY_THRESHOLD = 0.5
+
+CALIBRATION_PROJECT = ProjectSpec(functions=10, files_per_artifact=10, file_size=4096)
+
+
+class Scenario(NamedTuple):
+    name: str
+    project: ProjectSpec
+    arguments: dict = {}
+    # Whether stacks share builds across iterations, like stacks in a single Sceptre run do
+    share_builds: bool = False
+
+
+SCENARIOS = [
+    Scenario("small-yaml", ProjectSpec()),
+    Scenario("small-jinja", ProjectSpec(jinja=True)),
+    Scenario(
+        "large-yaml",
+        ProjectSpec(functions=40, layers=5, files_per_artifact=20, file_size=4096),
+    ),
+    Scenario(
+        "large-jinja",
+        ProjectSpec(
+            functions=40, layers=5, files_per_artifact=20, file_size=4096, jinja=True
+        ),
+    ),
+    Scenario(
+        "large-native",
+        ProjectSpec(functions=40, layers=5, files_per_artifact=20, file_size=4096),
+        {"packager": "native"},
+    ),
+    Scenario(
+        "large-shared-build",
+        ProjectSpec(functions=40, layers=5, files_per_artifact=20, file_size=4096),
+        share_builds=True,
+    ),
+    Scenario(
+        "large-template-cache",
+        ProjectSpec(functions=40, layers=5, files_per_artifact=20, file_size=4096),
+        {"template_cache": True},
+    ),
+]
+
+
+def _percentile(latencies: List[float], percent: int) -> float:
+    if len(latencies) == 1:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+def calibrate(repeats: int = 5) -> float:
+    """Times a fixed workload that doesn't depend on the handler's code: reading, hashing and
+    copying a synthetic project's files and parsing and dumping its template, like handling does.
+    Scenario latencies divided by this time are comparable across machines.
+
+    Returns:
+        The fastest time of the workload, in seconds
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        template_path = generate_project(
+            CALIBRATION_PROJECT, Path(directory, "project")
+        )
+        files = sorted(
+            path for path in template_path.parent.rglob("*") if path.is_file()
+        )
+        copy_path = Path(directory, "copy")
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            for path in files:
+                contents = path.read_bytes()
+                hashlib.sha256(contents).hexdigest()
+                copy_path.write_bytes(contents)
+            for _ in range(10):
+                yaml.safe_dump(yaml.safe_load(template_path.read_text()))
+            timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+class ScenarioRunner:
+    def __init__(
+        self, scenario: Scenario, directory: Path, command_latency: float = 0.0
+    ):
+        """Runs SAM.handle repeatedly for a scenario, against a fake SAM backend.
+
+        Args:
+            scenario: The scenario to run
+            directory: The directory to generate the project and write the handler's output in
+            command_latency: The simulated latency of every SAM command, in seconds
+        """
+        self.scenario = scenario
+        self.directory = directory
+        self.backend = FakeSamBackend(command_latency)
+        # Only the keys of uploads are kept, so they don't count towards the peak memory.
+        self.s3_client = FakeS3Client(store_contents=False)
+        self.build_registry = BuildRegistry()
+        self.template_path = generate_project(scenario.project, directory / "project")
+        self._iteration = 0
+
+    def handle(self) -> str:
+        """Handles the scenario's template as a new stack."""
+        self._iteration += 1
+        if not self.scenario.share_builds:
+            self.build_registry = BuildRegistry()
+        handler = SAM(
+            f"benchmark/stack{self._iteration}",
+            arguments={
+                "path": str(self.template_path),
+                "artifact_bucket_name": "bucket",
+                "cache_dir": str(self.directory / "cache"),
+                **self.scenario.arguments,
+            },
+            sceptre_user_data=self.scenario.project.sceptre_user_data,
+            connection_manager=FakeConnectionManager(),
+            stack_group_config={},
+            invoker_class=partial(
+                SamInvoker,
+                run_subprocess=self.backend,
+                environment_cache=SessionEnvironmentCache(),
+            ),
+            get_temp_dir=lambda: str(self.directory / "temp"),
+            render_jinja_template=helper.render_jinja_template,
+            build_registry=self.build_registry,
+            get_s3_client=lambda *args, **kwargs: self.s3_client,
+        )
+        return handler.handle()
+
+
+def run_scenario(
+    scenario: Scenario,
+    iterations: int,
+    warmup: int = 2,
+    command_latency: float = 0.0,
+) -> Dict[str, float]:
+    """Runs a scenario and measures it.
+
+    Returns:
+        The scenario's throughput (handled templates per second), latency percentiles (in seconds)
+        and the peak memory allocated by a single handle (in bytes)
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        runner = ScenarioRunner(scenario, Path(directory), command_latency)
+        for _ in range(warmup):
+            runner.handle()
+
+        latencies = []
+        gc.collect()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            handle_started = time.perf_counter()
+            runner.handle()
+            latencies.append(time.perf_counter() - handle_started)
+        elapsed = time.perf_counter() - started
+
+        # Memory is traced separately, since tracemalloc slows everything down.
+        tracemalloc.start()
+        try:
+            runner.handle()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "throughput": iterations / elapsed,
+        "p50": _percentile(latencies, 50),
+        "p90": _percentile(latencies, 90),
+        "p99": _percentile(latencies, 99),
+        "peak_memory": peak_memory,
+    }
+
+
+def compare(
+    results: Dict[str, dict], baseline: Dict[str, dict], thresholds: Dict[str, float]
+) -> List[str]:
+    """Compares results against a baseline.
+
+    Args:
+        results: The results of each scenario
+        baseline: The baseline results of each scenario
+        thresholds: How much (as a fraction) each metric to compare may exceed the baseline by
+
+    Returns:
+        A description of every regression: a metric more than its threshold above the baseline's
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, threshold in thresholds.items():
+            if metric not in baseline[name]:
+                continue
+            ratio = result[metric] / baseline[name][metric]
+            if ratio > 1 + threshold:
+                regressions.append(
+                    f"{name}: {metric} is {ratio:.2f}x the baseline "
+                    f"({result[metric]:.4g} vs {baseline[name][metric]:.4g})"
+                )
+    return regressions
+
+
+def _format_results(results: Dict[str, dict], baseline: Dict[str, dict]) -> str:
+    lines = [
+        f"{'scenario':<22} {'handles/s':>10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+        f"{'peak KiB':>10} {'rel. p50 vs base':>17}"
+    ]
+    for name, result in results.items():
+        change = ""
+        if "relative_p50" in baseline.get(name, {}):
+            change = (
+                f"{result['relative_p50'] / baseline[name]['relative_p50'] - 1:+.1%}"
+            )
+        lines.append(
+            f"{name:<22} {result['throughput']:>10.1f} {result['p50'] * 1000:>9.2f} "
+            f"{result['p90'] * 1000:>9.2f} {result['p99'] * 1000:>9.2f} "
+            f"{result['peak_memory'] / 1024:>10.0f} {change:>17}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmarks the SAM handler against a fake SAM backend.",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=[scenario.name for scenario in SCENARIOS],
+        help="A scenario to run (can be repeated). Defaults to every scenario.",
+    )
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument(
+        "--command-latency",
+        type=float,
+        default=0.0,
+        help="The simulated latency of every SAM command, in seconds",
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing against it",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="How much the peak memory may exceed the baseline by, as a fraction",
+    )
+    parser.add_argument(
+        "--compare-latency",
+        action="store_true",
+        help="Also compare the median latency (relative to the calibration workload)",
+    )
+    parser.add_argument(
+        "--latency-threshold",
+        type=float,
+        default=DEFAULT_LATENCY_THRESHOLD,
+        help="How much the relative median latency may exceed the baseline by, as a fraction",
+    )
+    parser.add_argument("--output", type=Path, help="A file to write the results to")
+    args = parser.parse_args(argv)
+
+    names = args.scenario or [scenario.name for scenario in SCENARIOS]
+    unit = calibrate()
+    results = {}
+    for scenario in SCENARIOS:
+        if scenario.name in names:
+            result = run_scenario(
+                scenario, args.iterations, args.warmup, args.command_latency
+            )
+            result["relative_p50"] = result["p50"] / unit
+            results[scenario.name] = result
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+    if args.save_baseline:
+        baseline = (
+            json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        )
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(_format_results(results, {}))
+        return 0
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    print(_format_results(results, baseline))
+    thresholds = {"peak_memory": args.threshold}
+    if args.compare_latency:
+        thresholds["relative_p50"] = args.latency_threshold
+    regressions = compare(results, baseline, thresholds)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
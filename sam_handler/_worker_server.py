@@ -0,0 +1,121 @@
+"""The server side of the persistent SAM CLI worker (see sam_handler.worker).
+
+This script is run with the Python interpreter SAM CLI is installed into, which usually won't have
+sam_handler (or even Sceptre) installed, so it must only use the standard library and SAM CLI.
+
+Protocol: after importing SAM CLI, the server writes a {"ready": true} line (or {"error": ...} if
+it can't) to stdout. It then reads one JSON request per line from stdin, of the form
+{"args": [...], "cwd": "...", "env": {...}}, runs `sam <args>` in-process and replies with a
+{"exit_code": <int>} line. While the command runs, everything it prints (including the output of
+any subprocesses SAM starts) is forwarded as {"output": "..."} lines, each holding a chunk of at
+most MAX_CHUNK_LENGTH characters. Anything printed between commands goes to stderr.
+"""
+
+import json
+import os
+import sys
+import threading
+import traceback
+
+MAX_CHUNK_LENGTH = 8 * 1024
+# How long to wait for the rest of a command's output once it has returned. A process the command
+# left running in the background could keep the pipe open forever.
+FORWARDER_TIMEOUT = 5
+
+
+def _run_command(cli, request: dict) -> int:
+    import click
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    try:
+        import boto3
+
+        # Don't let a session created for a previous command leak its credentials into this one.
+        boto3.DEFAULT_SESSION = None
+    except ImportError:
+        pass
+
+    try:
+        cli.main(args=request["args"], prog_name="sam", standalone_mode=False)
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    except click.exceptions.ClickException as e:
+        e.show()
+        return e.exit_code
+    except (click.exceptions.Abort, KeyboardInterrupt):
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _run_forwarding_output(cli, request: dict, reply) -> int:
+    """Runs the command with stdout and stderr redirected to a pipe, whose output is replied as it
+    is read.
+    """
+    read_fd, write_fd = os.pipe()
+    is_done = threading.Event()
+
+    def forward():
+        with os.fdopen(read_fd, "rb") as pipe:
+            for chunk in iter(lambda: pipe.readline(MAX_CHUNK_LENGTH), b""):
+                # Output read after the reply was sent would be taken for the next command's.
+                if is_done.is_set():
+                    continue
+                reply({"output": chunk.decode(errors="replace")})
+
+    forwarder = threading.Thread(target=forward, daemon=True)
+    forwarder.start()
+    saved_fds = os.dup(1), os.dup(2)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(write_fd, 1)
+    os.dup2(write_fd, 2)
+    os.close(write_fd)
+    try:
+        return _run_command(cli, request)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved_fd in zip((1, 2), saved_fds):
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+        forwarder.join(FORWARDER_TIMEOUT)
+        is_done.set()
+
+
+def main():
+    # Keep the real stdout for the protocol and send everything else written to stdout (including
+    # the output of any subprocesses SAM starts) to stderr.
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    protocol_lock = threading.Lock()
+
+    def reply(message: dict):
+        with protocol_lock:
+            protocol.write(json.dumps(message) + "\n")
+            protocol.flush()
+
+    try:
+        from samcli.cli.main import cli
+    except Exception as e:
+        reply({"error": f"Could not import SAM CLI: {e}"})
+        return 1
+
+    reply({"ready": True})
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        exit_code = _run_forwarding_output(cli, json.loads(line), reply)
+        reply({"exit_code": exit_code})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
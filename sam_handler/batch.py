@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sam_handler.cache import hash_values
+from sam_handler.handler import SAM
+from sam_handler.limiter import get_available_memory
+from sam_handler.locking import FileLock
+from sam_handler.registry import ResultRegistry, result_registry
+
+# The memory a single SAM build is assumed to need when sizing the worker pool
+DEFAULT_MEMORY_PER_BUILD = 1024 * 1024 * 1024
+
+DURATIONS_FILE_NAME = "durations.json"
+
+logger = logging.getLogger(__name__)
+
+
+def get_default_max_workers(memory_per_build: int = DEFAULT_MEMORY_PER_BUILD) -> int:
+    """Returns how many stacks can be handled at once: one per CPU, as long as there is enough
+    memory for each of their builds.
+    """
+    max_workers = os.cpu_count() or 1
+    available_memory = get_available_memory()
+    if available_memory is not None:
+        max_workers = min(max_workers, available_memory // memory_per_build)
+    return max(1, max_workers)
+
+
+class DurationHistory:
+    def __init__(self, path: Path, lock_directory: Path):
+        """The durations of past handles of each stack, persisted so that the longest stacks can be
+        scheduled first.
+
+        Args:
+            path: The JSON file to keep the durations in
+            lock_directory: The directory of the lock guarding the file against concurrent updates
+        """
+        self.path = path
+        self.lock_directory = lock_directory
+        self._lock = threading.Lock()
+        self._durations = self._read()
+        self._recorded: Dict[str, float] = {}
+
+    def get(self, key: str) -> Optional[float]:
+        with self._lock:
+            return self._durations.get(key)
+
+    def record(self, key: str, duration: float):
+        with self._lock:
+            self._durations[key] = self._recorded[key] = duration
+
+    def save(self):
+        """Writes the recorded durations, keeping those other processes recorded in the meantime."""
+        with self._lock:
+            recorded = dict(self._recorded)
+        if not recorded:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with FileLock.for_resource(self.path, self.lock_directory):
+            durations = {**self._read(), **recorded}
+            temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            temp_path.write_text(json.dumps(durations, indent=2, sort_keys=True))
+            os.replace(temp_path, self.path)
+
+    def _read(self) -> Dict[str, float]:
+        try:
+            durations = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        return durations if isinstance(durations, dict) else {}
+
+
+class BatchResult(NamedTuple):
+    # The handled template of each stack, by stack name
+    templates: Dict[str, str]
+    # The error each failed stack raised, by stack name
+    errors: Dict[str, BaseException]
+
+
+class SamBatch:
+    def __init__(
+        self,
+        handlers: Iterable[SAM],
+        *,
+        max_workers: Optional[int] = None,
+        duration_history: Optional[DurationHistory] = None,
+        result_registry: ResultRegistry = result_registry,
+    ):
+        """Handles the templates of many SAM stacks concurrently, ahead of Sceptre, and primes the
+        results so that each stack's own handle() returns its template immediately.
+
+        Identically configured stacks are only handled once. Stacks that share a build are handled
+        after the first of them has built it, so they never hold a worker while waiting for it.
+        Builds run longest first, according to the durations recorded by earlier batches.
+
+        Args:
+            handlers: The handlers of the stacks to handle
+            max_workers: The maximum number of stacks to handle at once. Defaults to one per CPU,
+                bounded by the available memory.
+            duration_history: The durations of earlier handles. Defaults to the durations file in
+                the cache directory of the first handler.
+            result_registry: The registry to prime with the handled templates
+        """
+        self.handlers = self._deduplicate(handlers)
+        self.max_workers = max_workers or get_default_max_workers()
+        if duration_history is None and self.handlers:
+            first_handler = self.handlers[0]
+            duration_history = DurationHistory(
+                first_handler.cache_directory / DURATIONS_FILE_NAME,
+                first_handler.lock_directory,
+            )
+        self.duration_history = duration_history
+        self.result_registry = result_registry
+
+    def run(self) -> BatchResult:
+        """Handles every stack, priming the results of those that succeed.
+
+        A stack that fails isn't primed, so Sceptre handles it again and reports the error itself.
+        """
+        result = BatchResult({}, {})
+        groups = self._group_by_build()
+        if not groups:
+            return result
+
+        pending = len(self.handlers)
+        pending_lock = threading.Lock()
+        all_done = threading.Event()
+
+        with ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix="sam-batch"
+        ) as executor:
+
+            def submit(handler: SAM, followers: List[SAM]):
+                future = executor.submit(self._handle, handler, result)
+                future.add_done_callback(lambda _: on_done(followers))
+
+            def on_done(followers: List[SAM]):
+                nonlocal pending
+                # The followers reuse the leader's build, so they only start once it is done.
+                for follower in followers:
+                    submit(follower, [])
+                with pending_lock:
+                    pending -= 1
+                    if pending == 0:
+                        all_done.set()
+
+            for leader, *followers in groups:
+                submit(leader, followers)
+            # Followers are submitted as their leaders finish, so wait for them before the executor
+            # shuts down.
+            all_done.wait()
+
+        if self.duration_history is not None:
+            self.duration_history.save()
+        return result
+
+    def _handle(self, handler: SAM, result: BatchResult):
+        # Never reuse a result primed by an earlier batch; the stack's inputs may have changed.
+        self.result_registry.take(handler.handle_key)
+        started = time.perf_counter()
+        try:
+            template = handler.handle()
+        except Exception as e:
+            logger.warning(f"{handler.name}: handling failed in batch: {e}")
+            result.errors[handler.name] = e
+            return
+        if self.duration_history is not None:
+            self.duration_history.record(handler.name, time.perf_counter() - started)
+        result.templates[handler.name] = template
+        self.result_registry.prime(handler.handle_key, template)
+
+    def _deduplicate(self, handlers: Iterable[SAM]) -> List[SAM]:
+        unique_handlers = {}
+        for handler in handlers:
+            unique_handlers.setdefault(handler.handle_key, handler)
+        return list(unique_handlers.values())
+
+    def _group_by_build(self) -> List[List[SAM]]:
+        """Groups the handlers whose builds would be shared, longest first. Within each group, the
+        longest stack is first, since it is the one that builds.
+        """
+        groups: Dict[str, List[SAM]] = {}
+        for handler in self.handlers:
+            groups.setdefault(self._get_build_group(handler), []).append(handler)
+        for group in groups.values():
+            group.sort(key=self._get_expected_duration, reverse=True)
+        return sorted(
+            groups.values(),
+            key=lambda group: self._get_expected_duration(group[0]),
+            reverse=True,
+        )
+
+    def _get_build_group(self, handler: SAM) -> str:
+        # A Jinja template's rendering (and so its build) depends on the user data, too.
+        is_jinja = handler.sam_template_path.suffix in handler.jinja_template_extensions
+        return hash_values(
+            str(handler.sam_template_path),
+            handler.arguments.get("build_args", {}),
+            handler.sceptre_user_data if is_jinja else None,
+            handler.stack_group_config.get("j2_environment", {}) if is_jinja else None,
+        )
+
+    def _get_expected_duration(self, handler: SAM) -> float:
+        if self.duration_history is None:
+            return 0.0
+        duration = self.duration_history.get(handler.name)
+        # Stacks that were never handled may well be slow, so they aren't left for last.
+        return float("inf") if duration is None else duration
+
+
+def create_handlers(stacks: Iterable) -> List[SAM]:
+    """Creates the handlers of every Sceptre stack that uses the SAM handler, just like Sceptre
+    creates them for the stacks' templates.
+
+    Args:
+        stacks: The sceptre.stack.Stack objects (such as a SceptrePlan's command_stacks)
+
+    Returns:
+        The validated handlers. Stacks whose configuration can't be resolved yet (for instance, a
+        !stack_output of a stack that hasn't been launched) are skipped, so Sceptre handles them
+        later on its own.
+    """
+    handlers = []
+    for stack in stacks:
+        try:
+            # Reading these runs their resolvers
+            handler_config = stack.template_handler_config or {}
+            if handler_config.get("type") != "sam":
+                continue
+            sceptre_user_data = stack.sceptre_user_data
+        except Exception as e:
+            logger.debug(f"Skipping {stack.name}, which can't be resolved yet: {e}")
+            continue
+        handler = SAM(
+            name=stack.name,
+            arguments={k: v for k, v in handler_config.items() if k != "type"},
+            sceptre_user_data=sceptre_user_data,
+            connection_manager=stack.connection_manager,
+            stack_group_config=stack.stack_group_config,
+        )
+        handler.validate()
+        handlers.append(handler)
+    return handlers
+
+
+def handle_stacks(stacks: Iterable, **kwargs) -> BatchResult:
+    """Handles the templates of every Sceptre stack that uses the SAM handler, in a SamBatch.
+
+    The handlers are created just like Sceptre creates them for the stacks' templates, so each
+    stack's later handle() uses its primed template.
+
+    Args:
+        stacks: The sceptre.stack.Stack objects (such as a SceptrePlan's command_stacks)
+        **kwargs: The keyword arguments to pass to SamBatch
+
+    Returns:
+        The BatchResult
+    """
+    return SamBatch(create_handlers(stacks), **kwargs).run()
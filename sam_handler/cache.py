@@ -0,0 +1,323 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from sam_handler.locking import LOCK_DIRECTORY_NAME, FileLock
+
+# Directory names that never contain inputs to a SAM build, but which can change between builds.
+IGNORED_DIRECTORY_NAMES = frozenset({".aws-sam", ".git", "__pycache__"})
+
+# Bump this to invalidate every cache entry written by earlier versions of the handler.
+CACHE_VERSION = "1"
+
+
+def get_default_cache_dir() -> str:
+    """Returns the root directory for the handler's persistent caches, following the XDG base
+    directory specification.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "sceptre-sam-handler")
+
+
+def hash_path(path: Path, hasher=None) -> str:
+    """Computes a digest of the contents of a file or of every file under a directory.
+
+    Relative file paths are included in the digest, so renaming a file changes it. Directories in
+    IGNORED_DIRECTORY_NAMES are skipped.
+
+    Args:
+        path: The file or directory to hash
+        hasher: An existing hashlib object to update; a new sha256 is used if not passed
+
+    Returns:
+        The hex digest
+    """
+    hasher = hasher or hashlib.sha256()
+    if path.is_file():
+        _update_with_file(hasher, path)
+        return hasher.hexdigest()
+
+    for root, directories, files in os.walk(path):
+        directories[:] = sorted(
+            d for d in directories if d not in IGNORED_DIRECTORY_NAMES
+        )
+        for file_name in sorted(files):
+            file_path = Path(root, file_name)
+            hasher.update(file_path.relative_to(path).as_posix().encode())
+            _update_with_file(hasher, file_path)
+    return hasher.hexdigest()
+
+
+def _update_with_file(hasher, path: Path):
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+
+
+def hash_values(*values) -> str:
+    """Computes a stable digest of JSON-serializable values."""
+    serialized = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def get_size(path: Path) -> int:
+    """Returns the size of a file or the total size of the files under a directory, in bytes."""
+    if not path.is_dir():
+        return path.stat().st_size
+    total_size = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                total_size += Path(root, file_name).lstat().st_size
+            except FileNotFoundError:
+                continue
+    return total_size
+
+
+def remove_entry(entry: Path) -> bool:
+    """Removes a cache entry file or directory.
+
+    Returns:
+        Whether the entry was removed
+    """
+    if entry.is_dir():
+        shutil.rmtree(entry, ignore_errors=True)
+    else:
+        try:
+            entry.unlink()
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def prune_entries(
+    entries: Iterable[Path],
+    max_size: Optional[int] = None,
+    max_age: Optional[float] = None,
+    *,
+    remove: Callable[[Path], bool] = remove_entry,
+) -> int:
+    """Deletes the least recently used cache entries until the total size is within max_size and
+    removes every entry not used within max_age seconds.
+
+    An entry's last use is its modification time, so callers should touch entries when they read
+    them.
+
+    Args:
+        entries: The cache entry files (or directories) to consider
+        max_size: The maximum total size of the entries, in bytes
+        max_age: The maximum time since an entry was last used, in seconds
+        remove: The function removing an entry, which returns whether it could be removed (for
+            instance, because it isn't in use)
+
+    Returns:
+        The number of entries that were removed
+    """
+    stats = []
+    for entry in entries:
+        try:
+            stats.append((entry, entry.stat().st_mtime, get_size(entry)))
+        except FileNotFoundError:
+            continue
+
+    # Oldest first
+    stats.sort(key=lambda item: item[1])
+    total_size = sum(size for _, _, size in stats)
+    now = time.time()
+    removed = 0
+    for entry, modified_time, size in stats:
+        expired = max_age is not None and now - modified_time > max_age
+        oversized = max_size is not None and total_size > max_size
+        if not (expired or oversized) or not remove(entry):
+            continue
+        total_size -= size
+        removed += 1
+
+    return removed
+
+
+class TemplateCache:
+    DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, directory: Path, max_size: int = DEFAULT_MAX_SIZE):
+        """A persistent, content-addressed cache of packaged templates.
+
+        Entries are stored as individual files named by their key. When the cache grows past
+        max_size, the least recently used entries are evicted.
+
+        Args:
+            directory: The directory to store cache entries in
+            max_size: The maximum total size of the cache entries, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached template body for the key, or None if there is no such entry."""
+        entry = self._entry_path(key)
+        try:
+            body = entry.read_text()
+        except FileNotFoundError:
+            return None
+        # Mark the entry as recently used.
+        os.utime(entry)
+        return body
+
+    def put(self, key: str, template_body: str):
+        """Stores the template body under the key, evicting old entries if needed."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = self._entry_path(key)
+        # Write to a temporary file first so concurrent readers never see a partial entry.
+        temp_path = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        temp_path.write_text(template_body)
+        os.replace(temp_path, entry)
+        prune_entries(self._entries(), max_size=self.max_size)
+
+    def invalidate(self, key: str):
+        """Removes the entry for the key, if there is one."""
+        try:
+            self._entry_path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        for entry in self._entries():
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _entries(self) -> Iterable[Path]:
+        if not self.directory.exists():
+            return []
+        return list(self.directory.glob("*.yaml"))
+
+    def _entry_path(self, key: str) -> Path:
+        return self.directory / f"{key}.yaml"
+
+
+class SamBuildCache:
+    # The name of the build caches' directory within the handler's cache directory
+    DIRECTORY_NAME = "sam-build"
+    DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+    DEFAULT_MAX_AGE_DAYS = 30
+    # How often the build caches are pruned, in seconds; measuring them means walking every file.
+    PRUNE_INTERVAL = 60 * 60
+    PRUNE_MARKER_NAME = ".last-prune"
+
+    def __init__(
+        self,
+        directory: Path,
+        lock_directory: Path,
+        max_size: int = DEFAULT_MAX_SIZE,
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+    ):
+        """The SAM build caches (the `--cache-dir` of `sam build`) managed by the handler.
+
+        Each template gets its own, stable cache directory, so the cache survives across checkouts of
+        the project. Old caches are evicted once their total size exceeds max_size or when they
+        haven't been used in max_age_days.
+
+        Args:
+            directory: The directory to keep the build caches in
+            lock_directory: The directory of the locks guarding the build caches while SAM uses them
+            max_size: The maximum total size of the build caches, in bytes
+            max_age_days: The maximum time since a build cache was last used, in days
+        """
+        self.directory = directory
+        self.lock_directory = lock_directory
+        self.max_size = max_size
+        self.max_age_days = max_age_days
+
+    def get_directory(self, template_path: Path) -> Path:
+        """Returns the build cache directory of a template, marking it as recently used."""
+        directory = self.directory / hash_values(str(template_path.absolute()))
+        directory.mkdir(parents=True, exist_ok=True)
+        os.utime(directory)
+        return directory
+
+    def prune(self, force: bool = False) -> int:
+        """Evicts old build caches, unless that was done within PRUNE_INTERVAL (or force is True).
+        Caches that are in use are never evicted.
+
+        Returns:
+            The number of build caches that were evicted
+        """
+        marker = self.directory / self.PRUNE_MARKER_NAME
+        try:
+            if not force and time.time() - marker.stat().st_mtime < self.PRUNE_INTERVAL:
+                return 0
+        except FileNotFoundError:
+            pass
+        self.directory.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+
+        return prune_entries(
+            self._directories(),
+            self.max_size,
+            self.max_age_days * 24 * 60 * 60,
+            remove=self._remove_unless_in_use,
+        )
+
+    def clear(self) -> int:
+        """Evicts every build cache that isn't in use."""
+        return prune_entries(
+            self._directories(),
+            max_size=0,
+            remove=self._remove_unless_in_use,
+        )
+
+    def _directories(self) -> Iterable[Path]:
+        if not self.directory.exists():
+            return []
+        return [entry for entry in self.directory.iterdir() if entry.is_dir()]
+
+    def _remove_unless_in_use(self, directory: Path) -> bool:
+        lock = FileLock.for_resource(directory, self.lock_directory)
+        if not lock.acquire(timeout=0):
+            return False
+        try:
+            return remove_entry(directory)
+        finally:
+            lock.release()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sam_handler.cache",
+        description="Manages the sceptre-sam-handler persistent caches.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=get_default_cache_dir(),
+        help="The handler's cache directory (defaults to %(default)s)",
+    )
+    parser.add_argument(
+        "--clear", action="store_true", help="Remove every cached packaged template"
+    )
+    parser.add_argument(
+        "--clear-build-cache",
+        action="store_true",
+        help="Remove every SAM build cache that isn't in use",
+    )
+    args = parser.parse_args(argv)
+    if args.clear:
+        TemplateCache(Path(args.cache_dir, "templates")).clear()
+    if args.clear_build_cache:
+        SamBuildCache(
+            Path(args.cache_dir, SamBuildCache.DIRECTORY_NAME),
+            Path(tempfile.gettempdir(), LOCK_DIRECTORY_NAME),
+        ).clear()
+
+
+if __name__ == "__main__":
+    main()
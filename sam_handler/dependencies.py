@@ -0,0 +1,305 @@
+import fnmatch
+import os
+import posixpath
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from sam_handler.cache import (
+    hash_path,
+    hash_values,
+    prune_entries,
+)
+
+DEFAULT_ARCHITECTURE = "x86_64"
+
+# The dependency manifests of each runtime family. The resolved dependencies of a function only
+# depend on these (and on the runtime, architecture and build platform). Node.js isn't supported,
+# since SAM copies its sources with `npm pack`, whose file selection (the package's "files" field,
+# .npmignore and so on) isn't reproduced.
+DEPENDENCY_MANIFESTS = {
+    "python": ("requirements.txt",),
+}
+
+# Source files that SAM's default builders leave out of the build output, matched against file and
+# directory names at any depth. This mirrors aws-lambda-builders' PythonPipWorkflow.EXCLUDED_FILES
+# exactly, so the sources copied next to restored dependencies match what `sam build` copies.
+EXCLUDED_SOURCE_PATTERNS = {
+    "python": (
+        ".aws-sam",
+        ".chalice",
+        ".git",
+        ".gitignore",
+        # Compiled files
+        "*.pyc",
+        "__pycache__",
+        "*.so",
+        # Distribution / packaging
+        ".Python",
+        "*.egg-info",
+        "*.egg",
+        # Installer logs
+        "pip-log.txt",
+        "pip-delete-this-directory.txt",
+        # Unit test / coverage reports
+        "htmlcov",
+        ".tox",
+        ".nox",
+        ".coverage",
+        ".cache",
+        ".pytest_cache",
+        # pyenv
+        ".python-version",
+        # mypy, Pyre
+        ".mypy_cache",
+        ".dmypy.json",
+        ".pyre",
+        # environments
+        ".env",
+        ".venv",
+        "venv",
+        "venv.bak",
+        "env.bak",
+        "ENV",
+        "env",
+        # Editors
+        ".vscode",
+        ".idea",
+    ),
+}
+
+ENTRY_SUFFIX = ".tar.gz"
+
+
+def get_runtime_family(runtime: str) -> Optional[str]:
+    return next(
+        (family for family in DEPENDENCY_MANIFESTS if runtime.startswith(family)), None
+    )
+
+
+def get_dependency_key(
+    runtime: str, architecture: str, code_directory: Path, use_container: bool
+) -> Optional[str]:
+    """Returns the store key of a function's resolved dependencies.
+
+    Args:
+        runtime: The function's runtime (e.g. "python3.11")
+        architecture: The function's architecture (e.g. "arm64")
+        code_directory: The function's code directory, containing its dependency manifests
+        use_container: Whether dependencies are resolved in a build container rather than on this
+            machine
+
+    Returns:
+        The key, or None if the function's dependencies can't be stored (because its runtime isn't
+        supported or it has no dependency manifest)
+    """
+    family = get_runtime_family(runtime)
+    if family is None:
+        return None
+    manifests = [
+        code_directory / name
+        for name in DEPENDENCY_MANIFESTS[family]
+        if (code_directory / name).is_file()
+    ]
+    if not manifests:
+        return None
+    return hash_values(
+        runtime,
+        architecture,
+        # Dependencies with native code resolved on the host only work on the same platform.
+        "container" if use_container else sys.platform,
+        [(manifest.name, hash_path(manifest)) for manifest in manifests],
+    )
+
+
+def _is_excluded(name: str, patterns: Iterable[str]) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def list_dependency_paths(
+    runtime: str, code_directory: Path, built_directory: Path
+) -> List[str]:
+    """Lists the top-level entries of a function's build output that SAM installed as dependencies,
+    rather than copied from its source.
+    """
+    return sorted(
+        entry.name
+        for entry in built_directory.iterdir()
+        if not (code_directory / entry.name).exists()
+    )
+
+
+def copy_sources(runtime: str, code_directory: Path, destination: Path):
+    """Copies a function's sources into its build output, like SAM's default builders do."""
+    patterns = EXCLUDED_SOURCE_PATTERNS[get_runtime_family(runtime)]
+    shutil.copytree(
+        code_directory,
+        destination,
+        ignore=lambda _, names: [
+            name for name in names if _is_excluded(name, patterns)
+        ],
+        dirs_exist_ok=True,
+    )
+
+
+def _create_archive(source: Path, paths: List[str], archive_path: Path):
+    with tarfile.open(archive_path, "w:gz") as archive:
+        for path in paths:
+            archive.add(source / path, arcname=path)
+
+
+def _extract_archive(archive_path: Path, destination: Path):
+    with tarfile.open(archive_path, "r:gz") as archive:
+        for member in archive.getmembers():
+            # Never write outside the destination, whatever the archive contains
+            target = (destination / member.name).resolve()
+            if destination.resolve() not in (target, *target.parents):
+                raise tarfile.TarError(f"Unsafe path in archive: {member.name}")
+        if hasattr(tarfile, "data_filter"):
+            archive.extractall(destination, filter="data")
+        else:
+            archive.extractall(destination)
+
+
+class LocalDependencyStore:
+    DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+    def __init__(self, directory: Path, max_size: int = DEFAULT_MAX_SIZE):
+        """A store of resolved function dependencies in a local directory, which can be on a
+        filesystem shared by several machines.
+
+        Entries are archives named by their key. When the store grows past max_size, the least
+        recently used entries are evicted.
+
+        Args:
+            directory: The directory to store entries in
+            max_size: The maximum total size of the entries, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+    def contains(self, key: str) -> bool:
+        return self._entry_path(key).exists()
+
+    def restore(self, key: str, destination: Path) -> bool:
+        """Extracts the dependencies stored under the key into the destination directory.
+
+        Returns:
+            Whether there was an entry for the key
+        """
+        entry = self._entry_path(key)
+        try:
+            _extract_archive(entry, destination)
+        except FileNotFoundError:
+            return False
+        # Mark the entry as recently used.
+        os.utime(entry)
+        return True
+
+    def publish(self, key: str, source: Path, paths: List[str]):
+        """Stores the listed paths (relative to source) under the key, evicting old entries if
+        needed.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = self._entry_path(key)
+        # Write to a temporary file first so concurrent readers never see a partial entry.
+        temp_path = entry.with_name(
+            f"{entry.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        _create_archive(source, paths, temp_path)
+        os.replace(temp_path, entry)
+        prune_entries(self.directory.glob(f"*{ENTRY_SUFFIX}"), max_size=self.max_size)
+
+    def _entry_path(self, key: str) -> Path:
+        return self.directory / f"{key}{ENTRY_SUFFIX}"
+
+
+class S3DependencyStore:
+    DEFAULT_MAX_SIZE = LocalDependencyStore.DEFAULT_MAX_SIZE
+
+    def __init__(
+        self, s3_client, bucket: str, prefix: str, max_size: int = DEFAULT_MAX_SIZE
+    ):
+        """A store of resolved function dependencies in an S3 bucket (or an S3-compatible service).
+
+        When the store grows past max_size, the oldest entries are evicted.
+
+        Args:
+            s3_client: The boto3 S3 client to use
+            bucket: The bucket to store entries in
+            prefix: The key prefix to store entries under
+            max_size: The maximum total size of the entries, in bytes
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.max_size = max_size
+        # Entries are stored at the root of the bucket when there is no prefix.
+        self._key_prefix = f"{self.prefix}/" if self.prefix else ""
+
+    def contains(self, key: str) -> bool:
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    def restore(self, key: str, destination: Path) -> bool:
+        with tempfile.TemporaryDirectory() as directory:
+            archive_path = Path(directory, "entry" + ENTRY_SUFFIX)
+            try:
+                self.s3_client.download_file(
+                    self.bucket, self._object_key(key), str(archive_path)
+                )
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                    return False
+                raise
+            _extract_archive(archive_path, destination)
+        return True
+
+    def publish(self, key: str, source: Path, paths: List[str]):
+        with tempfile.TemporaryDirectory() as directory:
+            archive_path = Path(directory, "entry" + ENTRY_SUFFIX)
+            _create_archive(source, paths, archive_path)
+            self.s3_client.upload_file(
+                str(archive_path), self.bucket, self._object_key(key)
+            )
+        self._prune()
+
+    def _prune(self):
+        objects = []
+        for page in self.s3_client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=self._key_prefix
+        ):
+            # Other objects may share the prefix (or the whole bucket, without one).
+            objects.extend(
+                item
+                for item in page.get("Contents", [])
+                if item["Key"].endswith(ENTRY_SUFFIX)
+                and posixpath.dirname(item["Key"]) == self.prefix
+            )
+
+        # Oldest first
+        objects.sort(key=lambda item: item["LastModified"])
+        total_size = sum(item["Size"] for item in objects)
+        for item in objects:
+            if total_size <= self.max_size:
+                break
+            self.s3_client.delete_object(Bucket=self.bucket, Key=item["Key"])
+            total_size -= item["Size"]
+
+    def _object_key(self, key: str) -> str:
+        return f"{self._key_prefix}{key}{ENTRY_SUFFIX}"
+
+
+# Errors from a store that shouldn't fail the build; the dependencies are resolved by SAM instead.
+STORE_ERRORS = (OSError, tarfile.TarError, BotoCoreError, ClientError)
@@ -0,0 +1,92 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sceptre.connection_manager import ConnectionManager
+
+SessionKey = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class SessionEnvironmentCache:
+    # How long environment variables are reused when the credentials' expiration isn't known
+    DEFAULT_TTL = 15 * 60
+    # How long before the credentials expire the environment variables are refreshed
+    DEFAULT_REFRESH_MARGIN = 5 * 60
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL,
+        refresh_margin: float = DEFAULT_REFRESH_MARGIN,
+        *,
+        clock=time.time,
+    ):
+        """A thread-safe cache of the session environment variables passed to SAM.
+
+        Resolving a session's credentials can require an STS call (for instance, to assume the
+        sceptre_role), so the environment variables are shared by every invoker using the same
+        profile, region and role until shortly before the credentials expire.
+
+        Args:
+            ttl: How long to reuse environment variables when the credentials' expiration is not
+                known, in seconds
+            refresh_margin: How long before the credentials expire to refresh them, in seconds
+            clock: The function returning the current time, matching time.time
+        """
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._key_locks: Dict[SessionKey, threading.Lock] = {}
+        self._entries: Dict[SessionKey, Tuple[float, Dict[str, str]]] = {}
+
+    def get(self, connection_manager: ConnectionManager) -> Dict[str, str]:
+        """Returns the session environment variables for the ConnectionManager's profile, region
+        and role, creating them if they aren't cached or are about to expire.
+        """
+        key = self._get_key(connection_manager)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Only one thread resolves each session at a time; the others wait for its result.
+        with key_lock:
+            entry = self._entries.get(key)
+            if entry is None or self.clock() >= entry[0]:
+                environment_variables = (
+                    connection_manager.create_session_environment_variables()
+                )
+                entry = (
+                    self._get_refresh_time(connection_manager, key),
+                    environment_variables,
+                )
+                self._entries[key] = entry
+
+        return dict(entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get_key(self, connection_manager: ConnectionManager) -> SessionKey:
+        return (
+            getattr(connection_manager, "profile", None),
+            getattr(connection_manager, "region", None),
+            getattr(connection_manager, "sceptre_role", None),
+        )
+
+    def _get_refresh_time(
+        self, connection_manager: ConnectionManager, key: SessionKey
+    ) -> float:
+        refresh_time = self.clock() + self.ttl
+        # Sceptre records when the credentials of assumed-role sessions expire.
+        expirations = getattr(connection_manager, "_boto_session_expirations", None)
+        if isinstance(expirations, dict):
+            profile, region, sceptre_role = key
+            expiration = expirations.get((region, profile, sceptre_role))
+            if isinstance(expiration, datetime):
+                refresh_time = expiration.timestamp() - self.refresh_margin
+        return refresh_time
+
+
+# The cache shared by every SamInvoker in the process
+session_environment_cache = SessionEnvironmentCache()
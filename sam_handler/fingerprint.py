@@ -0,0 +1,286 @@
+import atexit
+import fnmatch
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sam_handler.cache import IGNORED_DIRECTORY_NAMES, hash_values
+from sam_handler.locking import FileLock
+
+# The name of the index file, in the cache directory
+INDEX_FILE_NAME = "fingerprints.json"
+INDEX_VERSION = "1"
+
+DEFAULT_IGNORE_PATTERNS = tuple(sorted(IGNORED_DIRECTORY_NAMES))
+
+# Files at least this large are hashed through a memory map, rather than read in chunks
+MMAP_THRESHOLD = 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+# A file modified this recently could be modified again without its size or modification time
+# changing (within the file system's timestamp granularity), so its digest isn't indexed yet.
+RACY_WINDOW_NS = 2 * 1000**3
+
+# Index entries of files that weren't seen for this long are dropped, in seconds
+MAX_ENTRY_AGE = 30 * 24 * 60 * 60
+# How often the time each entry was last seen is refreshed, in seconds
+SEEN_RESOLUTION = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+# A file's size, modification time (in nanoseconds) and inode
+FileStat = Tuple[int, int, int]
+
+
+class FingerprintResult(NamedTuple):
+    # The digest of the file or directory
+    digest: str
+    # The number of files found
+    scanned: int
+    # The number of files that were read, since they weren't indexed or their stat changed
+    rehashed: int
+
+
+def hash_file(path: Path, size: int) -> str:
+    """Computes the digest of a file's contents, memory-mapping it if it is large."""
+    hasher = hashlib.sha256()
+    with path.open("rb") as f:
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+        else:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def scan_files(
+    root: Path, ignore_patterns: Iterable[str] = DEFAULT_IGNORE_PATTERNS
+) -> List[Tuple[str, str, FileStat]]:
+    """Lists the files under the root (or the root itself, if it's a file) with their relative
+    path, absolute path and stat. Like os.walk, symbolic links to directories aren't followed.
+
+    Args:
+        root: The absolute path of the file or directory to scan
+        ignore_patterns: Glob patterns of file and directory names to skip
+
+    Returns:
+        The files, with an empty relative path if the root is a file itself
+    """
+    try:
+        stat = root.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    if not root.is_dir():
+        return [("", str(root), (stat.st_size, stat.st_mtime_ns, stat.st_ino))]
+
+    ignore_patterns = tuple(ignore_patterns)
+    files = []
+    pending = [str(root)]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if any(fnmatch.fnmatch(entry.name, p) for p in ignore_patterns):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file():
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    relative_path = Path(entry.path).relative_to(root).as_posix()
+                    files.append(
+                        (
+                            relative_path,
+                            entry.path,
+                            (stat.st_size, stat.st_mtime_ns, stat.st_ino),
+                        )
+                    )
+    return files
+
+
+def stat_fingerprint(
+    paths: Iterable[Path], ignore_patterns: Iterable[str] = DEFAULT_IGNORE_PATTERNS
+) -> str:
+    """Computes a digest of the size and modification time of each file (or of every file under
+    each directory), without reading any of them. It is much cheaper than a Fingerprinter's digest,
+    but only tells whether the files might have changed.
+
+    Args:
+        paths: The files and directories to fingerprint. Paths that don't exist are included as
+            such, so creating them changes the fingerprint.
+        ignore_patterns: Glob patterns of file and directory names to skip, like with
+            Fingerprinter.fingerprint
+
+    Returns:
+        The hex digest
+    """
+    ignore_patterns = tuple(ignore_patterns)
+    stats = []
+    for path in paths:
+        files = scan_files(Path(path).absolute(), ignore_patterns)
+        if not files and not path.exists():
+            stats.append((str(path), None, None))
+        stats.extend(
+            (file_path, size, modified_time)
+            for _, file_path, (size, modified_time, _) in sorted(files)
+        )
+    return hash_values(stats)
+
+
+class Fingerprinter:
+    DEFAULT_MAX_WORKERS = 8
+
+    def __init__(
+        self,
+        index_path: Optional[Path] = None,
+        lock_directory: Optional[Path] = None,
+        *,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
+        """Computes digests of files and directory trees, reading only the files whose size,
+        modification time or inode changed since they were last hashed.
+
+        The digest of each file is kept in an index, keyed by its path and stat, which is persisted
+        (when an index_path is given) so that later runs don't read unchanged files either. Files
+        that must be read are hashed concurrently.
+
+        Args:
+            index_path: The JSON file to persist the index in; if None, it's only kept in memory
+            lock_directory: The directory of the lock guarding the index file against concurrent
+                updates
+            max_workers: The maximum number of files to hash at once
+        """
+        self.index_path = index_path
+        self.lock_directory = lock_directory
+        self.max_workers = max_workers
+        self.scanned = 0
+        self.rehashed = 0
+        self._lock = threading.Lock()
+        # Maps the path of each file to its stat, digest and when it was last seen
+        self._index: Dict[str, list] = self._read()
+        self._is_dirty = False
+
+    def fingerprint(
+        self, path: Path, ignore_patterns: Iterable[str] = DEFAULT_IGNORE_PATTERNS
+    ) -> FingerprintResult:
+        """Computes the digest of a file's contents or of every file under a directory.
+
+        A file's digest is the sha256 of its contents, just like with hash_path. A directory's digest
+        covers the relative path and the digest of each file under it.
+
+        Args:
+            path: The file or directory to fingerprint
+            ignore_patterns: Glob patterns of file and directory names to skip, such as
+                "node_modules"
+
+        Returns:
+            The FingerprintResult
+        """
+        root = Path(path).absolute()
+        files = scan_files(root, tuple(ignore_patterns))
+        now = time.time()
+        digests: Dict[str, str] = {}
+        stale = []
+        with self._lock:
+            for relative_path, file_path, stat in files:
+                entry = self._index.get(file_path)
+                if entry is None or tuple(entry[:3]) != stat:
+                    stale.append((relative_path, file_path, stat))
+                    continue
+                digests[relative_path] = entry[3]
+                if now - entry[4] > SEEN_RESOLUTION:
+                    entry[4] = int(now)
+                    self._is_dirty = True
+
+        for (relative_path, file_path, stat), digest in zip(stale, self._hash(stale)):
+            digests[relative_path] = digest
+            if time.time_ns() - stat[1] > RACY_WINDOW_NS:
+                with self._lock:
+                    self._index[file_path] = [*stat, digest, int(now)]
+                    self._is_dirty = True
+
+        with self._lock:
+            self.scanned += len(files)
+            self.rehashed += len(stale)
+        if files and files[0][0] == "":
+            digest = digests[""]
+        else:
+            hasher = hashlib.sha256()
+            for relative_path in sorted(digests):
+                hasher.update(f"{relative_path}\0{digests[relative_path]}\n".encode())
+            digest = hasher.hexdigest()
+        return FingerprintResult(digest, len(files), len(stale))
+
+    def save(self):
+        """Writes the index, keeping the entries other processes indexed in the meantime."""
+        with self._lock:
+            if self.index_path is None or not self._is_dirty:
+                return
+            index = {path: list(entry) for path, entry in self._index.items()}
+            self._is_dirty = False
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with FileLock.for_resource(self.index_path, self.lock_directory):
+            index = {**self._read(), **index}
+            oldest = time.time() - MAX_ENTRY_AGE
+            files = {path: entry for path, entry in index.items() if entry[4] > oldest}
+            temp_path = self.index_path.with_name(
+                f"{self.index_path.name}.{os.getpid()}.tmp"
+            )
+            temp_path.write_text(json.dumps({"version": INDEX_VERSION, "files": files}))
+            os.replace(temp_path, self.index_path)
+
+    def _hash(self, files: List[Tuple[str, str, FileStat]]) -> List[str]:
+        def hash_entry(file: Tuple[str, str, FileStat]) -> str:
+            return hash_file(Path(file[1]), file[2][0])
+
+        if len(files) <= 1 or self.max_workers <= 1:
+            return [hash_entry(file) for file in files]
+        with ThreadPoolExecutor(
+            min(self.max_workers, len(files)), thread_name_prefix="sam-fingerprint"
+        ) as executor:
+            return list(executor.map(hash_entry, files))
+
+    def _read(self) -> Dict[str, list]:
+        if self.index_path is None:
+            return {}
+        try:
+            data = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return {}
+        return data.get("files") or {}
+
+
+_fingerprinters_lock = threading.Lock()
+_fingerprinters: Dict[Path, Fingerprinter] = {}
+
+
+def get_shared_fingerprinter(index_path: Path, lock_directory: Path) -> Fingerprinter:
+    """Returns the fingerprinter shared by every SAM handler in the process for the index file. Its
+    index is saved when the process exits.
+    """
+    with _fingerprinters_lock:
+        fingerprinter = _fingerprinters.get(index_path)
+        if fingerprinter is None:
+            fingerprinter = _fingerprinters[index_path] = Fingerprinter(
+                index_path, lock_directory
+            )
+            atexit.register(_save_quietly, fingerprinter)
+        return fingerprinter
+
+
+def _save_quietly(fingerprinter: Fingerprinter):
+    try:
+        fingerprinter.save()
+    except OSError as e:
+        logger.warning(f"Unable to save the fingerprint index: {e}")
@@ -1,21 +1,105 @@
+import functools
+import hashlib
+import logging
+import os
 import posixpath
+import shlex
+import shutil
 import subprocess
-import sys
 import tempfile
 from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
 
+import yaml
 from sceptre.connection_manager import ConnectionManager
-from sceptre.exceptions import UnsupportedTemplateFileTypeError
+from sceptre.exceptions import (
+    TemplateHandlerArgumentsInvalidError,
+    UnsupportedTemplateFileTypeError,
+)
 from sceptre.template_handlers import TemplateHandler, helper
 
+from sam_handler.cache import (
+    CACHE_VERSION,
+    SamBuildCache,
+    TemplateCache,
+    get_default_cache_dir,
+    hash_values,
+)
+from sam_handler.dependencies import LocalDependencyStore, S3DependencyStore
+from sam_handler.environment import SessionEnvironmentCache, session_environment_cache
+from sam_handler.fingerprint import (
+    DEFAULT_IGNORE_PATTERNS,
+    INDEX_FILE_NAME,
+    Fingerprinter,
+    get_shared_fingerprinter,
+    stat_fingerprint,
+)
+from sam_handler.incremental import DependencyStore, IncrementalBuild
+from sam_handler.limiter import SLOTS_DIRECTORY_NAME, ConcurrencyLimiter
+from sam_handler.locking import LOCK_DIRECTORY_NAME, FileLock
+from sam_handler.output import SamCommandError, SamOutputParser, SamOutputStream
+from sam_handler.packager import ArtifactIndex, NativePackager, get_s3_client
+from sam_handler.registry import (
+    BuildRegistry,
+    ResultRegistry,
+    TemplateMemo,
+    build_registry,
+    result_registry,
+    template_memo,
+)
+from sam_handler.rendering import (
+    RenderCache,
+    find_template_sources,
+    get_render_key,
+    render_cache,
+    write_if_changed,
+)
+from sam_handler.template import (
+    dump_template,
+    iter_local_inputs,
+    load_template,
+    make_local_paths_absolute,
+)
+from sam_handler.timing import PROFILERS, JsonLinesSink, LoggerSink, Sink, Tracer
+from sam_handler.worker import (
+    SamWorkerPool,
+    WorkerUnavailableError,
+    get_shared_worker_pool,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_sam_executable() -> str:
+    """Returns the path of the `sam` executable, which is only looked up once per process. If it
+    can't be found, "sam" is returned, so that running a command reports it missing.
+    """
+    return shutil.which("sam") or "sam"
+
 
 class SamInvoker:
+    # The options SAM parses as a list of values following a single option name. Other list-valued
+    # options are repeated for each value.
+    LIST_OPTIONS = frozenset(
+        {
+            "capabilities",
+            "notification-arns",
+            "parameter-overrides",
+            "signing-profiles",
+            "tags",
+        }
+    )
+
     def __init__(
         self,
         connection_manager: ConnectionManager,
         sam_directory: Path,
         *,
         run_subprocess=subprocess.run,
+        environment_cache: SessionEnvironmentCache = session_environment_cache,
+        tracer: Optional[Tracer] = None,
+        limiter: Optional[ConcurrencyLimiter] = None,
+        output_prefix: str = "",
+        sam_executable: Optional[str] = None,
     ):
         """A utility for invoking SAM commands using subprocess
 
@@ -25,39 +109,64 @@ class SamInvoker:
             sam_directory: The directory of the SAM template to use as the CWD when invoking SAM
             run_subprocess: The function to use for invoking subprocesses, matching the signature of
                 subprocess.run
+            environment_cache: The cache of session environment variables, shared by every invoker
+                in the process by default
+            tracer: The tracer to record the timing of SAM commands with
+            limiter: The limit on concurrent SAM commands to wait for, if any
+            output_prefix: The prefix to write before each line of SAM's output, such as the stack
+                name
+            sam_executable: The path of the `sam` executable. Defaults to the one on the PATH.
         """
         self.connection_manager = connection_manager
         self.sam_directory = sam_directory
 
         self.run_subprocess = run_subprocess
-
-    def invoke(self, command_name: str, args_dict: dict) -> None:
+        self.environment_cache = environment_cache
+        self.tracer = tracer or Tracer()
+        self.limiter = limiter
+        self.output_prefix = output_prefix
+        self.sam_executable = sam_executable or get_sam_executable()
+
+    def invoke(
+        self, command_name: str, args_dict: dict, positional_args: Sequence[str] = ()
+    ) -> None:
         """Invokes a SAM Command using the passed dict of arguments.
 
         Args:
             command_name: The name of the sam command to invoke (i.e. "build" or "package")
             args_dict: The dictionary of arguments to pass to the command
+            positional_args: Positional arguments to pass to the command, such as the logical id of
+                the resource to build
         """
-        command_args = self._create_args(args_dict)
-        command = f"sam {command_name}"
-        if command_args.strip() != "":
-            command += f" {command_args}"
-        return self._invoke_sam_command(command)
-
-    def _create_args(self, parameters: dict) -> str:
-        """Creates a CLI argument string by combining two dictionaries and then formatting them as
-        options.
+        command = [
+            self.sam_executable,
+            command_name,
+            *positional_args,
+            *self._create_args(args_dict),
+        ]
+        with self.tracer.span(f"sam_{command_name}") as span:
+            if self.limiter is None:
+                return self._invoke_sam_command(command)
+            with self.limiter.slot() as queue_wait:
+                span["queue_wait"] = round(queue_wait, 6)
+                return self._invoke_sam_command(command)
+
+    def _create_args(self, parameters: dict) -> List[str]:
+        """Creates the CLI arguments for a dictionary of options. Each value is passed to SAM as
+        is, without any quoting, since no shell is involved.
 
         How the dict will be converted to cli args:
         * Keys with a value of None will be omitted, since they have no value
         * Keys with a value of True will be converted to --flag type of arguments
-        * All other key/value pairs will be converted to --key "value" pairs
+        * Keys with a list value in LIST_OPTIONS will be converted to --key value1 value2
+        * Keys with any other list value will be repeated, as --key value1 --key value2
+        * All other key/value pairs will be converted to --key value pairs
 
         Args:
             parameters: The default dictionary of arguments
 
         Returns:
-            The CLI argument string
+            The CLI arguments
         """
         args = []
         for arg_name, arg_value in parameters.items():
@@ -65,28 +174,123 @@ class SamInvoker:
                 # It's an option with no value, so let's skip it
                 continue
 
-            argline = f"--{arg_name}"
-            if arg_value is not True:
+            option = f"--{arg_name}"
+            if arg_value is True:
                 # If the value is True, it's a flag, so we don't want a value
-                argline += f' "{arg_value}"'
-            args.append(argline)
-
-        return " ".join(args)
+                args.append(option)
+            elif isinstance(arg_value, (list, tuple)):
+                values = [str(value) for value in arg_value]
+                if not values:
+                    continue
+                if arg_name in self.LIST_OPTIONS:
+                    args.extend([option, *values])
+                else:
+                    for value in values:
+                        args.extend([option, value])
+            else:
+                args.extend([option, str(arg_value)])
+
+        return args
+
+    def _get_environment_variables(self) -> dict:
+        with self.tracer.span("session_environment"):
+            return self.environment_cache.get(self.connection_manager)
+
+    def _invoke_sam_command(self, command: List[str]) -> None:
+        environment_variables = self._get_environment_variables()
+        # SAM's output is streamed to stderr (so it doesn't combine with stdout that we might want
+        # to capture) through a parser that reports progress.
+        with SamOutputStream(
+            SamOutputParser(self.tracer), prefix=self.output_prefix
+        ) as output:
+            try:
+                self.run_subprocess(
+                    command,
+                    cwd=self.sam_directory,
+                    check=True,
+                    stdout=output.fileno(),
+                    stderr=subprocess.STDOUT,
+                    env=environment_variables,
+                )
+            except subprocess.CalledProcessError as e:
+                output.close()
+                raise SamCommandError(
+                    e.returncode, shlex.join(command), list(output.tail)
+                ) from None
+
+
+class SamWorkerInvoker(SamInvoker):
+    def __init__(
+        self,
+        connection_manager: ConnectionManager,
+        sam_directory: Path,
+        *,
+        run_subprocess=subprocess.run,
+        environment_cache: SessionEnvironmentCache = session_environment_cache,
+        tracer: Optional[Tracer] = None,
+        limiter: Optional[ConcurrencyLimiter] = None,
+        output_prefix: str = "",
+        sam_executable: Optional[str] = None,
+        get_worker_pool=get_shared_worker_pool,
+    ):
+        """A SamInvoker that runs SAM commands on long-lived SAM CLI worker processes, rather than
+        starting a new `sam` process for each command. If SAM CLI can't be run in a worker, commands
+        are run in a subprocess, just like with SamInvoker.
 
-    def _invoke_sam_command(self, command: str) -> None:
-        environment_variables = (
-            self.connection_manager.create_session_environment_variables()
-        )
-        self.run_subprocess(
-            command,
-            shell=True,
-            cwd=self.sam_directory,
-            check=True,
-            # Redirect stdout to stderr so it doesn't combine with stdout that we might want
-            # to capture.
-            stdout=sys.stderr,
-            env=environment_variables,
+        Args:
+            connection_manager: The TemplateHandler's ConnectionManager instance to use for obtaining
+                session environment variables
+            sam_directory: The directory of the SAM template to use as the CWD when invoking SAM
+            run_subprocess: The function to use for invoking subprocesses when workers can't be
+                used, matching the signature of subprocess.run
+            environment_cache: The cache of session environment variables, shared by every invoker
+                in the process by default
+            tracer: The tracer to record the timing of SAM commands with
+            limiter: The limit on concurrent SAM commands to wait for, if any
+            output_prefix: The prefix to write before each line of SAM's output, such as the stack
+                name
+            sam_executable: The path of the `sam` executable to run in a subprocess. Defaults to the
+                one on the PATH.
+            get_worker_pool: The function returning the pool of workers to run commands on
+        """
+        super().__init__(
+            connection_manager,
+            sam_directory,
+            run_subprocess=run_subprocess,
+            environment_cache=environment_cache,
+            tracer=tracer,
+            limiter=limiter,
+            output_prefix=output_prefix,
+            sam_executable=sam_executable,
         )
+        self.worker_pool: SamWorkerPool = get_worker_pool()
+        self.logger = logging.getLogger(__name__)
+
+    def _invoke_sam_command(self, command: List[str]) -> None:
+        if not self.worker_pool.is_available:
+            return super()._invoke_sam_command(command)
+
+        environment_variables = self._get_environment_variables()
+        # The worker forwards the command's output, which is streamed just like a subprocess's.
+        with SamOutputStream(
+            SamOutputParser(self.tracer), prefix=self.output_prefix
+        ) as output:
+            try:
+                # The first argument is the "sam" executable itself
+                exit_code = self.worker_pool.run(
+                    command[1:],
+                    self.sam_directory,
+                    environment_variables,
+                    output.fileno(),
+                )
+            except WorkerUnavailableError as e:
+                self.logger.debug(f"Falling back to a SAM CLI subprocess: {e}")
+                exit_code = None
+
+        if exit_code is None:
+            return super()._invoke_sam_command(command)
+        if exit_code != 0:
+            raise SamCommandError(exit_code, shlex.join(command), list(output.tail))
 
 
 class SAM(TemplateHandler):
@@ -95,6 +299,11 @@ class SAM(TemplateHandler):
     """
 
     SAM_ARTIFACT_DIRECTORY = "sam_artifacts"
+    INVOKER_CLASSES = {"subprocess": SamInvoker, "worker": SamWorkerInvoker}
+    # The package_args that the native packager understands
+    NATIVE_PACKAGE_ARGS = frozenset(
+        {"region", "profile", "s3-bucket", "s3-prefix", "force-upload"}
+    )
     standard_template_extensions = [".yaml"]
     jinja_template_extensions = [".j2"]
     supported_template_extensions = (
@@ -109,16 +318,35 @@ class SAM(TemplateHandler):
         connection_manager=None,
         stack_group_config=None,
         *,
-        invoker_class=SamInvoker,
+        invoker_class=None,
         get_temp_dir=tempfile.gettempdir,
+        get_cache_dir=get_default_cache_dir,
         render_jinja_template=helper.render_jinja_template,
+        build_registry: BuildRegistry = build_registry,
+        result_registry: ResultRegistry = result_registry,
+        render_cache: RenderCache = render_cache,
+        template_memo: TemplateMemo = template_memo,
+        packager_class=NativePackager,
+        get_s3_client=get_s3_client,
+        get_fingerprinter=get_shared_fingerprinter,
+        timing_sinks: Optional[List[Sink]] = None,
     ):
         super().__init__(
             name, arguments, sceptre_user_data, connection_manager, stack_group_config
         )
         self.invoker_class = invoker_class
         self.get_temp_dir = get_temp_dir
+        self.get_cache_dir = get_cache_dir
         self.render_jinja_template = render_jinja_template
+        self.build_registry = build_registry
+        self.result_registry = result_registry
+        self.render_cache = render_cache
+        self.template_memo = template_memo
+        self.packager_class = packager_class
+        self.get_s3_client = get_s3_client
+        self.get_fingerprinter = get_fingerprinter
+        self.timing_sinks = list(timing_sinks or [])
+        self.tracer = Tracer()
 
     def schema(self) -> dict:
         """This is the json schema of the template handler. It is required by Sceptre to define
@@ -137,6 +365,23 @@ class SAM(TemplateHandler):
                     "type": "object",
                 },
                 "skip_jinja_cleanup": {"type": "boolean"},
+                "cache_dir": {"type": "string"},
+                "template_cache": {"type": "boolean"},
+                "template_cache_max_size": {"type": "integer"},
+                "packager": {"type": "string", "enum": ["sam", "native"]},
+                "dry_run": {"type": "boolean"},
+                "invoker": {"type": "string", "enum": list(self.INVOKER_CLASSES)},
+                "incremental_build": {"type": "boolean"},
+                "fingerprint_ignore": {"type": "array", "items": {"type": "string"}},
+                "build_cache_max_size": {"type": "integer"},
+                "build_cache_max_age": {"type": "number"},
+                "dependency_store": {"type": ["boolean", "string"]},
+                "dependency_store_max_size": {"type": "integer"},
+                "dependency_store_endpoint_url": {"type": "string"},
+                "max_concurrent_commands": {"type": "integer", "minimum": 1},
+                "min_available_memory": {"type": "integer"},
+                "timing_file": {"type": "string"},
+                "profile": {"type": "string", "enum": list(PROFILERS)},
             },
             "required": [
                 "path",
@@ -145,22 +390,139 @@ class SAM(TemplateHandler):
         }
 
     def handle(self) -> str:
-        invoker = self.invoker_class(
-            connection_manager=self.connection_manager, sam_directory=self.sam_directory
-        )
-        self._create_generation_destination()
-        template_path = self._prepare_template()
-        self._build(invoker, template_path)
+        if self.is_dry_run and self.arguments.get("packager", "sam") != "native":
+            # Dry runs compute artifact locations the way the native packager does, which `sam
+            # package` doesn't, so a diff against a stack launched with it would be misleading.
+            raise TemplateHandlerArgumentsInvalidError(
+                "dry_run is only supported with the native packager, since `sam package` "
+                "uploads artifacts to different locations. Set packager to native or disable "
+                "dry_run for this stack."
+            )
+        self.tracer = self._create_tracer()
+        with self.tracer.span("handle") as span:
+            handle_key = self.handle_key
+            primed_template = self.result_registry.take(handle_key)
+            if primed_template is not None:
+                self.logger.info("Using template handled by a batch...")
+                span["primed"] = True
+                return primed_template
+
+            with self.tracer.span("memo_lookup") as lookup_span:
+                memoized_template = self.template_memo.get(handle_key)
+                lookup_span["memoized"] = memoized_template is not None
+            if memoized_template is not None:
+                self.logger.info("Using template handled earlier in this process...")
+                span["memoized"] = True
+                return memoized_template
+
+            self._create_generation_destination()
+            template_path = self._prepare_template()
+            memo_paths = self.get_source_paths()
+            # The fingerprint is taken before anything is built, so that changes made while the
+            # template is being handled invalidate it.
+            memo_fingerprint = (
+                None if memo_paths is None else self._fingerprint_sources(memo_paths)
+            )
 
-        skip_jinja_cleanup = self.arguments.get("skip_jinja_cleanup", False)
+            cache_key = None
+            span["cache"] = "disabled"
+            if self.arguments.get("template_cache", False):
+                with self.tracer.span("cache_lookup") as lookup_span:
+                    cache_key = self._get_cache_key(template_path)
+                    cached_template = self.template_cache.get(cache_key)
+                    span["cache"] = lookup_span["cache"] = (
+                        "miss" if cached_template is None else "hit"
+                    )
+                if cached_template is not None:
+                    self.logger.info("Using cached packaged template...")
+                    self.destination_template_path.write_text(cached_template)
+                    if memo_paths is not None:
+                        self.template_memo.put(
+                            handle_key,
+                            memo_paths,
+                            memo_fingerprint,
+                            cached_template,
+                            self.fingerprint_ignore_patterns,
+                        )
+                    return cached_template
+
+            invoker_class = (
+                self.invoker_class
+                or self.INVOKER_CLASSES[self.arguments.get("invoker", "subprocess")]
+            )
+            invoker = invoker_class(
+                connection_manager=self.connection_manager,
+                sam_directory=self.sam_directory,
+                tracer=self.tracer,
+                limiter=self.limiter,
+                output_prefix=f"[{self.name}] ",
+            )
+            with self.tracer.span("build", profile=True):
+                build_directory = self._build(invoker, template_path)
+            with self.tracer.span("package", profile=True):
+                self._package(invoker, build_directory)
+
+            with self.tracer.span("read_template"):
+                template_body = self.destination_template_path.read_text()
+            # A dry run's artifacts were never uploaded, so its template mustn't be reused.
+            if cache_key is not None and not self.is_dry_run:
+                self.template_cache.put(cache_key, template_body)
+            if memo_paths is not None:
+                self.template_memo.put(
+                    handle_key,
+                    memo_paths,
+                    memo_fingerprint,
+                    template_body,
+                    self.fingerprint_ignore_patterns,
+                )
+            return template_body
+
+    def get_source_paths(self) -> Optional[List[Path]]:
+        """Returns the source files the template is handled from: the template (and any Jinja
+        templates it references) and every local file it references (see template.iter_local_inputs).
+        A Jinja template must have been compiled first, since its inputs are only known once it is
+        rendered.
 
-        if not skip_jinja_cleanup and template_path != self.sam_template_path:
-            # We created a temporary file for the build, so let's remove it now.
+        Returns:
+            The paths, or None if they can't all be determined
+        """
+        if self.sam_template_path.suffix in self.jinja_template_extensions:
+            sources = find_template_sources(
+                self.sam_template_path,
+                self.stack_group_config.get("j2_environment", {}),
+            )
+            if sources is None:
+                return None
+            template_path = self.compiled_template_path
+        else:
+            sources = [self.sam_template_path]
+            template_path = self.sam_template_path
+        try:
+            template = load_template(template_path.read_text())
+        except (FileNotFoundError, yaml.YAMLError):
+            return None
+        return [*sources, *iter_local_inputs(template, self.sam_directory)]
 
-            template_path.unlink()
+    @property
+    def handle_key(self) -> str:
+        """Returns a key identifying everything this handler was configured with, so a template
+        handled ahead of time is only used by a handler configured identically.
+        """
+        return hash_values(
+            self.name,
+            self.arguments,
+            self.sceptre_user_data,
+            self.stack_group_config.get("j2_environment", {}),
+            getattr(self.connection_manager, "profile", None),
+            getattr(self.connection_manager, "region", None),
+            getattr(self.connection_manager, "sceptre_role", None),
+            str(self.destination_template_path),
+        )
 
-        self._package(invoker)
-        return self.destination_template_path.read_text()
+    @property
+    def is_dry_run(self) -> bool:
+        """Returns whether the template should be packaged without uploading any artifacts."""
+        return self.arguments.get("dry_run", False)
 
     @property
     def sam_template_path(self) -> Path:
@@ -181,6 +543,24 @@ class SAM(TemplateHandler):
     def destination_template_directory(self) -> Path:
         return self.destination_template_path.parent
 
+    @property
+    def build_directory(self) -> Path:
+        """Returns the directory this stack's SAM build is written to. Every stack gets its own
+        build directory, so that stacks sharing a template can be built concurrently.
+        """
+        stack_name = self.name.split("/")[-1]
+        return self.destination_template_directory / f"{stack_name}.aws-sam" / "build"
+
+    @property
+    def compiled_template_path(self) -> Path:
+        """Returns the path the rendered Jinja template is written to for building."""
+        stack_name = self.name.split("/")[-1]
+        return self.destination_template_directory / f"{stack_name}.compiled"
+
+    @property
+    def lock_directory(self) -> Path:
+        return Path(self.get_temp_dir()).absolute() / LOCK_DIRECTORY_NAME
+
     @property
     def artifact_key_prefix(self) -> str:
         """Returns the key prefix that should be passed to SAM CLI for uploading the packaged
@@ -202,6 +582,104 @@ class SAM(TemplateHandler):
         """
         return self.arguments["artifact_bucket_name"]
 
+    @property
+    def cache_directory(self) -> Path:
+        """Returns the root directory of the handler's persistent caches."""
+        return Path(self.arguments.get("cache_dir") or self.get_cache_dir()).absolute()
+
+    @property
+    def template_cache(self) -> TemplateCache:
+        return TemplateCache(
+            self.cache_directory / "templates",
+            self.arguments.get(
+                "template_cache_max_size", TemplateCache.DEFAULT_MAX_SIZE
+            ),
+        )
+
+    @property
+    def dependency_store(self) -> Optional[DependencyStore]:
+        """Returns the store of resolved function dependencies, if one is configured: an
+        s3://bucket/prefix location, a local directory or, if dependency_store is True, the
+        "dependencies" directory of the cache directory.
+        """
+        location = self.arguments.get("dependency_store")
+        if not location:
+            return None
+        max_size = self.arguments.get(
+            "dependency_store_max_size", LocalDependencyStore.DEFAULT_MAX_SIZE
+        )
+        if location is True:
+            return LocalDependencyStore(self.cache_directory / "dependencies", max_size)
+        if location.startswith("s3://"):
+            bucket, _, prefix = location.split("://", 1)[1].partition("/")
+            s3_client = self.get_s3_client(
+                self.connection_manager,
+                self.packager_class.DEFAULT_MAX_WORKERS,
+                endpoint_url=self.arguments.get("dependency_store_endpoint_url"),
+            )
+            return S3DependencyStore(s3_client, bucket, prefix, max_size)
+        return LocalDependencyStore(Path(location).expanduser().absolute(), max_size)
+
+    @property
+    def sam_build_cache(self) -> SamBuildCache:
+        return SamBuildCache(
+            self.cache_directory / SamBuildCache.DIRECTORY_NAME,
+            self.lock_directory,
+            self.arguments.get("build_cache_max_size", SamBuildCache.DEFAULT_MAX_SIZE),
+            self.arguments.get(
+                "build_cache_max_age", SamBuildCache.DEFAULT_MAX_AGE_DAYS
+            ),
+        )
+
+    @property
+    def fingerprinter(self) -> Fingerprinter:
+        """Returns the fingerprinter computing the digests of local artifacts, whose index is kept
+        in the cache directory.
+        """
+        return self.get_fingerprinter(
+            self.cache_directory / INDEX_FILE_NAME, self.lock_directory
+        )
+
+    @property
+    def fingerprint_ignore_patterns(self) -> List[str]:
+        """Returns the patterns of the file and directory names that never affect the template: the
+        default ignored directories and the fingerprint_ignore argument.
+        """
+        return [
+            *DEFAULT_IGNORE_PATTERNS,
+            *self.arguments.get("fingerprint_ignore", []),
+        ]
+
+    @property
+    def limiter(self) -> Optional[ConcurrencyLimiter]:
+        """Returns the machine-wide limit on concurrent SAM commands, if max_concurrent_commands is
+        set.
+        """
+        max_concurrent = self.arguments.get("max_concurrent_commands")
+        if not max_concurrent:
+            return None
+        return ConcurrencyLimiter(
+            self.lock_directory / SLOTS_DIRECTORY_NAME,
+            max_concurrent,
+            self.arguments.get("min_available_memory", 0),
+        )
+
+    def _create_tracer(self) -> Tracer:
+        """Creates the tracer recording the timing of each phase of handling the template. Spans are
+        logged at debug level, appended to the timing_file (if set) and passed to the timing_sinks.
+        """
+        sinks: List[Sink] = [LoggerSink(self.logger), *self.timing_sinks]
+        timing_file = self.arguments.get("timing_file")
+        if timing_file:
+            sinks.append(JsonLinesSink(Path(timing_file).absolute()))
+        return Tracer(
+            sinks,
+            {"stack": self.name, "template": str(self.sam_template_path)},
+            profiler=self.arguments.get("profile"),
+            # Profile dumps are written next to the generated template
+            profile_path_prefix=self.destination_template_path.with_suffix(""),
+        )
+
     def _create_generation_destination(self):
         """Creates the destination_template_directory, if it doesn't exist."""
         self.destination_template_directory.mkdir(parents=True, exist_ok=True)
@@ -219,25 +697,162 @@ class SAM(TemplateHandler):
             return self._compile_jinja_template()
 
     def _compile_jinja_template(self) -> Path:
-        self.logger.info("Compiling Jinja template...")
+        j2_environment = self.stack_group_config.get("j2_environment", {})
+        with self.tracer.span("render", profile=True) as span:
+            render_key = get_render_key(
+                self.sam_template_path, self.sceptre_user_data, j2_environment
+            )
+            template_body = render_key and self.render_cache.get(render_key)
+            span["memoized"] = template_body is not None
+            if template_body is None:
+                self.logger.info("Compiling Jinja template...")
+                template_body = self._render_jinja_template(j2_environment)
+                if render_key:
+                    self.render_cache.put(render_key, template_body)
+            # Rewriting an unchanged file would only change its modification time.
+            write_if_changed(self.compiled_template_path, template_body)
+        return self.compiled_template_path
+
+    def _render_jinja_template(self, j2_environment: dict) -> str:
         template_body = self.render_jinja_template(
             str(self.sam_template_path),
             {"sceptre_user_data": self.sceptre_user_data},
-            self.stack_group_config.get("j2_environment", {}),
+            j2_environment,
         )
-        compiled_path = (
-            self.sam_template_path.parent / f"{self.sam_template_path.stem}.compiled"
+        template = load_template(template_body)
+        if isinstance(template, dict):
+            # The compiled template doesn't live next to the source template, so any relative
+            # paths in it need to be made absolute for SAM to find them.
+            template_body = dump_template(
+                make_local_paths_absolute(template, self.sam_directory)
+            )
+        return template_body
+
+    def _get_cache_key(self, template_path: Path) -> str:
+        """Computes the template cache key from everything that affects the packaged template: the
+        (rendered) template, the contents of every local file it references (see
+        template.iter_local_inputs), the SAM arguments and the artifact destination.
+        """
+        template_body = template_path.read_text()
+        input_digests = [
+            (os.path.relpath(path, self.sam_directory), self._hash_path(path))
+            for path in iter_local_inputs(
+                load_template(template_body), self.sam_directory
+            )
+            if path.exists()
+        ]
+        return hash_values(
+            CACHE_VERSION,
+            hashlib.sha256(template_body.encode()).hexdigest(),
+            input_digests,
+            self.arguments.get("build_args", {}),
+            self.arguments.get("package_args", {}),
+            self.connection_manager.region,
+            self.artifact_bucket_name,
+            self.artifact_key_prefix,
         )
-        compiled_path.write_text(template_body)
-        return compiled_path
 
-    def _build(self, invoker: SamInvoker, template_path: Path):
-        default_args = {"cached": True, "template-file": str(template_path)}
-        build_args = {**default_args, **self.arguments.get("build_args", {})}
-        invoker.invoke("build", build_args)
+    def _hash_path(self, path: Path) -> str:
+        """Computes the digest of a local file or directory with the fingerprinter, skipping the
+        fingerprint_ignore_patterns.
+        """
+        with self.tracer.span("fingerprint", path=str(path)) as span:
+            result = self.fingerprinter.fingerprint(
+                path, self.fingerprint_ignore_patterns
+            )
+            span["scanned"] = result.scanned
+            span["rehashed"] = result.rehashed
+        return result.digest
 
-    def _package(self, invoker: SamInvoker):
+    def _fingerprint_sources(self, paths: Iterable[Path]) -> str:
+        """Computes the stat fingerprint of source files, which tells whether they might have changed
+        without reading them, skipping the fingerprint_ignore_patterns.
+        """
+        return stat_fingerprint(paths, self.fingerprint_ignore_patterns)
+
+    def _build(self, invoker: SamInvoker, template_path: Path) -> Path:
+        """Builds the template, unless an identical build was already done for another stack.
+
+        Args:
+            invoker: The invoker to run `sam build` with
+            template_path: The path of the (compiled) template to build
+
+        Returns:
+            The directory containing the build output
+        """
+        user_build_args = self.arguments.get("build_args", {})
+        sam_build_cache = self.sam_build_cache
         default_args = {
+            "cached": True,
+            "parallel": True,
+            "template-file": str(template_path),
+            "build-dir": str(self.build_directory),
+        }
+        if "cache-dir" not in user_build_args:
+            # SAM's cache is kept outside the project, so it outlives ephemeral checkouts.
+            default_args["cache-dir"] = str(
+                sam_build_cache.get_directory(self.sam_template_path)
+            )
+        build_args = {**default_args, **user_build_args}
+        # The template and build directory paths are specific to each stack, so they are left out
+        # of the key; the template's contents are what matters, along with the size and
+        # modification time of every local file it refers to, so that a build done earlier in the
+        # process isn't reused once the code has changed.
+        template_body = template_path.read_text()
+        build_key = hash_values(
+            str(self.sam_template_path),
+            hashlib.sha256(template_body.encode()).hexdigest(),
+            self._fingerprint_sources(
+                iter_local_inputs(load_template(template_body), self.sam_directory)
+            ),
+            {
+                key: value
+                for key, value in build_args.items()
+                if (key, value) not in default_args.items()
+            },
+        )
+        if self.build_registry.is_built(build_key):
+            self.logger.info("Reusing SAM build from another stack...")
+
+        # These default to SAM's own locations within the project when they are unset.
+        build_directory = self.sam_directory.joinpath(
+            build_args.get("build-dir") or ".aws-sam/build"
+        )
+        cache_directory = self.sam_directory.joinpath(
+            build_args.get("cache-dir") or ".aws-sam/cache"
+        )
+
+        def build() -> Path:
+            # SAM's cache directory is shared by every build of the project (as is the build
+            # directory, if it was overridden), so only one build may use them at a time.
+            with FileLock.for_resource(cache_directory, self.lock_directory):
+                with FileLock.for_resource(build_directory, self.lock_directory):
+                    dependency_store = self.dependency_store
+                    if dependency_store or self.arguments.get(
+                        "incremental_build", False
+                    ):
+                        IncrementalBuild(
+                            template_path,
+                            build_directory,
+                            build_args,
+                            dependency_store,
+                            hash_path=self._hash_path,
+                        ).run(invoker)
+                    else:
+                        invoker.invoke("build", build_args)
+            return build_directory
+
+        build_directory = self.build_registry.build_once(build_key, build)
+        if "cache-dir" in default_args:
+            sam_build_cache.prune()
+        return build_directory
+
+    def _package(self, invoker: SamInvoker, build_directory: Path):
+        if self.arguments.get("packager", "sam") == "native":
+            return self._package_natively(build_directory)
+
+        default_args = {
+            "template-file": str(build_directory / "template.yaml"),
             "s3-bucket": self.artifact_bucket_name,
             "region": self.connection_manager.region,
             "s3-prefix": self.artifact_key_prefix,
@@ -245,3 +860,44 @@ class SAM(TemplateHandler):
         }
         package_args = {**default_args, **self.arguments.get("package_args", {})}
         invoker.invoke("package", package_args)
+
+    def _package_natively(self, build_directory: Path):
+        package_args = self.arguments.get("package_args", {})
+        unsupported_args = set(package_args) - self.NATIVE_PACKAGE_ARGS
+        if unsupported_args:
+            # Dry runs compute artifact keys the way the native packager does.
+            alternative = (
+                "Disable dry_run for this stack"
+                if self.is_dry_run
+                else "Use the sam packager"
+            )
+            raise TemplateHandlerArgumentsInvalidError(
+                f"The native packager does not support the package_args "
+                f"{sorted(unsupported_args)}. {alternative} instead."
+            )
+
+        max_workers = self.packager_class.DEFAULT_MAX_WORKERS
+        if self.is_dry_run:
+            self.logger.info("Packaging SAM template without uploading artifacts...")
+            s3_client = None
+        else:
+            self.logger.info("Packaging SAM template...")
+            s3_client = self.get_s3_client(
+                self.connection_manager,
+                max_workers,
+                profile=package_args.get("profile", ConnectionManager.STACK_DEFAULT),
+                region=package_args.get("region", ConnectionManager.STACK_DEFAULT),
+            )
+        packager = self.packager_class(
+            s3_client,
+            package_args.get("s3-bucket", self.artifact_bucket_name),
+            package_args.get("s3-prefix", self.artifact_key_prefix),
+            max_workers=max_workers,
+            artifact_index=ArtifactIndex(self.cache_directory / "artifact-index"),
+            force_upload=package_args.get("force-upload", False),
+            tracer=self.tracer,
+            dry_run=self.is_dry_run,
+        )
+        packager.package(
+            build_directory / "template.yaml", self.destination_template_path
+        )
@@ -0,0 +1,416 @@
+import copy
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+from sam_handler.cache import hash_path, hash_values
+from sam_handler.dependencies import (
+    DEFAULT_ARCHITECTURE,
+    STORE_ERRORS,
+    LocalDependencyStore,
+    S3DependencyStore,
+    copy_sources,
+    get_dependency_key,
+    list_dependency_paths,
+)
+from sam_handler.template import (
+    GLOBALS_SECTIONS,
+    PACKAGEABLE_PROPERTIES,
+    dump_template,
+    iter_local_artifacts,
+    load_template,
+)
+
+MANIFEST_VERSION = "1"
+
+# The resource types `sam build` builds. Layers are only built when they have a BuildMethod.
+FUNCTION_TYPES = frozenset({"AWS::Serverless::Function", "AWS::Lambda::Function"})
+LAYER_TYPES = frozenset({"AWS::Serverless::LayerVersion", "AWS::Lambda::LayerVersion"})
+
+# Build arguments that don't affect the build output
+PATH_BUILD_ARGS = frozenset({"template-file", "build-dir", "cache-dir"})
+
+DependencyStore = Union[LocalDependencyStore, S3DependencyStore]
+
+logger = logging.getLogger(__name__)
+
+
+def is_buildable(resource: dict) -> bool:
+    """Returns whether `sam build` builds the resource into its own directory."""
+    if not isinstance(resource, dict):
+        return False
+    resource_type = resource.get("Type")
+    if resource_type in FUNCTION_TYPES:
+        return True
+    metadata = resource.get("Metadata")
+    return (
+        resource_type in LAYER_TYPES
+        and isinstance(metadata, dict)
+        and "BuildMethod" in metadata
+    )
+
+
+class IncrementalBuild:
+    # When more than this fraction of the resources changed, a single full build is faster than
+    # building each of them on its own.
+    MAX_CHANGED_FRACTION = 0.5
+
+    def __init__(
+        self,
+        template_path: Path,
+        build_directory: Path,
+        build_args: dict,
+        dependency_store: Optional[DependencyStore] = None,
+        *,
+        hash_path: Callable[[Path], str] = hash_path,
+    ):
+        """Builds a template with SAM, rebuilding only the resources whose inputs changed since the
+        last build into the same build directory.
+
+        A manifest of the input hashes of every buildable resource (its definition and the contents
+        of its code and Docker context directories) is stored next to the build directory. When only
+        some resources changed, each of them is built on its own with `sam build <logical id>` into
+        a scratch directory and merged into the existing build. Any other change to the template or
+        to the build arguments causes a full build.
+
+        With a dependency store, functions whose resolved dependencies are in the store are built
+        from their sources and the stored dependencies without invoking SAM, even when there is no
+        previous build to reuse. Dependencies that SAM resolves are published to the store.
+
+        Args:
+            template_path: The path of the template to build
+            build_directory: The directory the build is written to
+            build_args: The arguments to pass to `sam build`
+            dependency_store: The store of resolved function dependencies to use, if any
+            hash_path: The function computing the digest of a code or Docker context directory
+        """
+        self.template_path = template_path
+        self.build_directory = build_directory
+        self.build_args = build_args
+        self.dependency_store = dependency_store
+        self.hash_path = hash_path
+        self._code_paths: Dict[str, Path] = {}
+
+    @property
+    def manifest_path(self) -> Path:
+        return (
+            self.build_directory.parent / f"{self.build_directory.name}-manifest.json"
+        )
+
+    @property
+    def scratch_directory(self) -> Path:
+        return self.build_directory.parent / f"{self.build_directory.name}-partial"
+
+    def run(self, invoker):
+        """Builds the template using the invoker (a SamInvoker)."""
+        template = load_template(self.template_path.read_text())
+        if not isinstance(template, dict):
+            # Let SAM report what's wrong with the template
+            self.manifest_path.unlink(missing_ok=True)
+            return invoker.invoke("build", self.build_args)
+
+        manifest = self._compute_manifest(template)
+        changed = self._find_changed_resources(manifest)
+
+        # Whatever happens next, the previous manifest no longer describes the build directory.
+        self.manifest_path.unlink(missing_ok=True)
+        from_scratch = changed is None
+        to_build = list(manifest["resources"]) if from_scratch else changed
+        restorable = self._find_restorable(template, to_build)
+        sam_ids = [
+            logical_id for logical_id in to_build if logical_id not in restorable
+        ]
+        if from_scratch and restorable and not sam_ids:
+            # Only SAM can create the built template, so at least one resource is built with it.
+            logical_id = next(iter(restorable))
+            del restorable[logical_id]
+            sam_ids.append(logical_id)
+
+        if (from_scratch and not restorable) or len(sam_ids) > len(
+            manifest["resources"]
+        ) * self.MAX_CHANGED_FRACTION:
+            invoker.invoke("build", self.build_args)
+            built_ids = list(manifest["resources"])
+        elif to_build:
+            logger.info(f"Rebuilding changed resources: {', '.join(to_build)}")
+            built_ids = self._build_resources(
+                invoker, template, sam_ids, restorable, from_scratch
+            )
+        else:
+            logger.info("SAM build is up to date")
+            built_ids = []
+        self._publish_dependencies(template, built_ids)
+        self._save_manifest(manifest)
+
+    def _compute_manifest(self, template: dict) -> dict:
+        resources = template.get("Resources") or {}
+        buildable_ids = [
+            logical_id
+            for logical_id, resource in resources.items()
+            if is_buildable(resource)
+        ]
+        inputs: Dict[str, List[str]] = {logical_id: [] for logical_id in buildable_ids}
+        for artifact in iter_local_artifacts(template, self.template_path.parent):
+            if artifact.logical_id in inputs and artifact.path.exists():
+                self._code_paths[artifact.logical_id] = artifact.path
+                inputs[artifact.logical_id].append(self.hash_path(artifact.path))
+        for logical_id in buildable_ids:
+            metadata = resources[logical_id].get("Metadata")
+            docker_context = (metadata or {}).get("DockerContext")
+            if isinstance(docker_context, str):
+                context_path = self.template_path.parent / docker_context
+                if context_path.exists():
+                    inputs[logical_id].append(self.hash_path(context_path))
+
+        return {
+            "version": MANIFEST_VERSION,
+            # Everything in the template other than the buildable resources, which can affect any of
+            # them (e.g. Globals) or the built template
+            "template": hash_values(
+                {key: value for key, value in template.items() if key != "Resources"},
+                {
+                    logical_id: resource
+                    for logical_id, resource in resources.items()
+                    if logical_id not in inputs
+                },
+                list(inputs),
+            ),
+            "build_args": hash_values(
+                {
+                    key: value
+                    for key, value in self.build_args.items()
+                    if key not in PATH_BUILD_ARGS
+                }
+            ),
+            "resources": {
+                logical_id: hash_values(resources[logical_id], digests)
+                for logical_id, digests in inputs.items()
+            },
+        }
+
+    def _find_changed_resources(self, manifest: dict) -> Optional[List[str]]:
+        """Returns the logical ids of the resources to rebuild, or None if the previous build can't
+        be reused at all.
+        """
+        previous = self._load_manifest()
+        if (
+            previous is None
+            or not (self.build_directory / "template.yaml").exists()
+            or any(
+                previous.get(key) != manifest[key]
+                for key in ("version", "template", "build_args")
+            )
+        ):
+            return None
+
+        previous_resources = previous.get("resources") or {}
+        return [
+            logical_id
+            for logical_id, digest in manifest["resources"].items()
+            if previous_resources.get(logical_id) != digest
+        ]
+
+    def _build_resources(
+        self,
+        invoker,
+        template: dict,
+        sam_ids: List[str],
+        restorable: Dict[str, str],
+        from_scratch: bool,
+    ) -> List[str]:
+        """Builds each resource on its own and merges it into the build directory.
+
+        Returns:
+            The logical ids of the resources that SAM built
+        """
+        built_template_path = self.build_directory / "template.yaml"
+        built_template = None
+        if from_scratch:
+            shutil.rmtree(self.build_directory, ignore_errors=True)
+            self.build_directory.mkdir(parents=True)
+        else:
+            built_template = load_template(built_template_path.read_text())
+
+        built_ids = []
+        for logical_id in [*sam_ids, *restorable]:
+            resource = None
+            if logical_id in restorable:
+                resource = self._restore_resource(
+                    template, logical_id, restorable[logical_id]
+                )
+            if resource is None:
+                scratch_template = self._build_with_sam(invoker, logical_id)
+                if built_template is None:
+                    # The scratch directory is next to the build directory, so the relative paths
+                    # SAM wrote for the resources it didn't build are valid in either.
+                    built_template = scratch_template
+                resource = scratch_template["Resources"][logical_id]
+                built_ids.append(logical_id)
+            built_template["Resources"][logical_id] = resource
+        shutil.rmtree(self.scratch_directory, ignore_errors=True)
+        built_template_path.write_text(dump_template(built_template))
+        return built_ids
+
+    def _build_with_sam(self, invoker, logical_id: str) -> dict:
+        """Builds a single resource with SAM and moves its output into the build directory.
+
+        Returns:
+            The template SAM built
+        """
+        shutil.rmtree(self.scratch_directory, ignore_errors=True)
+        invoker.invoke(
+            "build",
+            {**self.build_args, "build-dir": str(self.scratch_directory)},
+            [logical_id],
+        )
+        scratch_template = load_template(
+            (self.scratch_directory / "template.yaml").read_text()
+        )
+        self._move_build_output(scratch_template["Resources"][logical_id])
+        return scratch_template
+
+    def _move_build_output(self, resource: dict):
+        """Moves the directories SAM built a resource into from the scratch directory into the build
+        directory. The built template refers to them relative to the build directory, so the
+        resource's definition stays valid.
+        """
+        for value in (resource.get("Properties") or {}).values():
+            if not isinstance(value, str) or os.path.isabs(value):
+                continue
+            source = self.scratch_directory / value
+            if value and source.is_dir() and source.parent == self.scratch_directory:
+                destination = self.build_directory / value
+                shutil.rmtree(destination, ignore_errors=True)
+                shutil.move(str(source), str(destination))
+
+    def _get_function_property(self, template: dict, logical_id: str, name: str):
+        resource = template["Resources"][logical_id]
+        properties = resource.get("Properties") or {}
+        if name in properties:
+            return properties[name]
+        if resource.get("Type") in GLOBALS_SECTIONS:
+            global_sections = template.get("Globals") or {}
+            section = global_sections.get(GLOBALS_SECTIONS[resource["Type"]]) or {}
+            return section.get(name)
+        return None
+
+    def _get_dependency_key(self, template: dict, logical_id: str) -> Optional[str]:
+        """Returns the dependency store key of a function built with SAM's default builder for its
+        runtime, or None if its dependencies can't be stored.
+        """
+        resource = template["Resources"][logical_id]
+        metadata = resource.get("Metadata") or {}
+        code_path = self._code_paths.get(logical_id)
+        runtime = self._get_function_property(template, logical_id, "Runtime")
+        architectures = self._get_function_property(
+            template, logical_id, "Architectures"
+        )
+        if (
+            resource.get("Type") not in FUNCTION_TYPES
+            or "BuildMethod" in metadata
+            or self._get_function_property(template, logical_id, "PackageType")
+            == "Image"
+            or code_path is None
+            or not code_path.is_dir()
+            or not isinstance(runtime, str)
+        ):
+            return None
+        architecture = (
+            architectures[0]
+            if isinstance(architectures, list) and architectures
+            else DEFAULT_ARCHITECTURE
+        )
+        return get_dependency_key(
+            runtime,
+            str(architecture),
+            code_path,
+            bool(self.build_args.get("use-container")),
+        )
+
+    def _find_restorable(
+        self, template: dict, logical_ids: List[str]
+    ) -> Dict[str, str]:
+        """Finds the resources whose dependencies can be restored from the dependency store.
+
+        Returns:
+            A dict mapping each of their logical ids to their dependency store key
+        """
+        if self.dependency_store is None:
+            return {}
+        restorable = {}
+        for logical_id in logical_ids:
+            key = self._get_dependency_key(template, logical_id)
+            try:
+                if key is not None and self.dependency_store.contains(key):
+                    restorable[logical_id] = key
+            except STORE_ERRORS as e:
+                logger.warning(f"Could not read from the dependency store: {e}")
+                return {}
+        return restorable
+
+    def _restore_resource(
+        self, template: dict, logical_id: str, key: str
+    ) -> Optional[dict]:
+        """Builds a function without SAM, from its sources and its stored dependencies.
+
+        Returns:
+            The function's definition for the built template, or None if its dependencies couldn't
+            be restored
+        """
+        runtime = self._get_function_property(template, logical_id, "Runtime")
+        destination = self.build_directory / logical_id
+        shutil.rmtree(destination, ignore_errors=True)
+        try:
+            if not self.dependency_store.restore(key, destination):
+                return None
+        except STORE_ERRORS as e:
+            logger.warning(f"Could not restore dependencies of {logical_id}: {e}")
+            shutil.rmtree(destination, ignore_errors=True)
+            return None
+        copy_sources(runtime, self._code_paths[logical_id], destination)
+
+        resource = copy.deepcopy(template["Resources"][logical_id])
+        property_name = PACKAGEABLE_PROPERTIES[resource["Type"]]
+        resource["Properties"] = {
+            **(resource.get("Properties") or {}),
+            property_name: logical_id,
+        }
+        resource["Metadata"] = {
+            **(resource.get("Metadata") or {}),
+            "SamResourceId": logical_id,
+        }
+        return resource
+
+    def _publish_dependencies(self, template: dict, logical_ids: List[str]):
+        """Adds the dependencies SAM resolved for the functions to the dependency store."""
+        if self.dependency_store is None:
+            return
+        for logical_id in logical_ids:
+            key = self._get_dependency_key(template, logical_id)
+            built_directory = self.build_directory / logical_id
+            if key is None or not built_directory.is_dir():
+                continue
+            runtime = self._get_function_property(template, logical_id, "Runtime")
+            paths = list_dependency_paths(
+                runtime, self._code_paths[logical_id], built_directory
+            )
+            try:
+                if paths and not self.dependency_store.contains(key):
+                    self.dependency_store.publish(key, built_directory, paths)
+            except STORE_ERRORS as e:
+                logger.warning(f"Could not publish dependencies of {logical_id}: {e}")
+
+    def _load_manifest(self) -> Optional[dict]:
+        try:
+            return json.loads(self.manifest_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _save_manifest(self, manifest: dict):
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        temp_path.write_text(json.dumps(manifest, sort_keys=True))
+        os.replace(temp_path, self.manifest_path)
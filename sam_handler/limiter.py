@@ -0,0 +1,102 @@
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from sam_handler.locking import FileLock
+
+# The name of the directory (under the lock directory) where the slot lock files are kept
+SLOTS_DIRECTORY_NAME = "sam-slots"
+
+
+def get_available_memory() -> Optional[int]:
+    """Returns the memory available to new processes, in bytes, or None if it can't be determined."""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ConcurrencyLimiter:
+    POLL_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        directory: Path,
+        max_concurrent: int,
+        min_available_memory: int = 0,
+        *,
+        get_available_memory: Callable[[], Optional[int]] = get_available_memory,
+    ):
+        """A cross-process limit on how many SAM commands run at once on this machine.
+
+        Each running command holds one of max_concurrent slots, which are lock files in the
+        directory, so the limit is shared by every process using the same directory. Processes
+        configured with different limits share the lower slots.
+
+        Optionally, a command is only admitted once at least min_available_memory bytes of memory
+        are available. A command is always admitted if no other command is running, so it can
+        never wait forever.
+
+        Args:
+            directory: The directory to keep the slot lock files in
+            max_concurrent: The maximum number of commands to run at once
+            min_available_memory: The memory that must be available to start a command, in bytes
+            get_available_memory: The function returning the available memory, in bytes (or None,
+                if it can't be determined)
+        """
+        self.directory = directory
+        self.max_concurrent = max(1, max_concurrent)
+        self.min_available_memory = min_available_memory
+        self.get_available_memory = get_available_memory
+
+    @contextmanager
+    def slot(self) -> Iterator[float]:
+        """Waits for a free slot (and enough memory) and holds it until the context exits.
+
+        Yields:
+            How long the command waited to be admitted, in seconds
+        """
+        started = time.monotonic()
+        lock = self._acquire_slot()
+        try:
+            while not self._has_enough_memory() and self._others_are_running(lock):
+                time.sleep(self.POLL_INTERVAL)
+            yield time.monotonic() - started
+        finally:
+            lock.release()
+
+    def _slot_lock(self, index: int) -> FileLock:
+        return FileLock(self.directory / f"slot-{index}.lock")
+
+    def _acquire_slot(self) -> FileLock:
+        while True:
+            for index in range(self.max_concurrent):
+                lock = self._slot_lock(index)
+                if lock.acquire(timeout=0):
+                    return lock
+            time.sleep(self.POLL_INTERVAL)
+
+    def _has_enough_memory(self) -> bool:
+        if not self.min_available_memory:
+            return True
+        available_memory = self.get_available_memory()
+        return available_memory is None or available_memory >= self.min_available_memory
+
+    def _others_are_running(self, own_lock: FileLock) -> bool:
+        for index in range(self.max_concurrent):
+            lock = self._slot_lock(index)
+            if lock.path == own_lock.path:
+                continue
+            if not lock.acquire(timeout=0):
+                return True
+            lock.release()
+        return False
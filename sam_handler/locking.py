@@ -0,0 +1,101 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows only
+    fcntl = None
+    import msvcrt
+
+# The name of the directory (under the system temp directory) where lock files are kept
+LOCK_DIRECTORY_NAME = "sceptre-sam-handler-locks"
+
+
+def _try_lock(fd: int) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:  # pragma: no cover - Windows only
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:  # pragma: no cover - Windows only
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, path: Path):
+        """An exclusive, cross-process lock backed by a lock file.
+
+        The lock is also exclusive between threads of the same process, since every acquisition
+        opens its own file descriptor.
+
+        Args:
+            path: The path of the lock file. Its parent directory will be created if needed.
+        """
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @classmethod
+    def for_resource(cls, resource: Path, lock_directory: Path) -> "FileLock":
+        """Creates the lock guarding a shared file or directory.
+
+        Args:
+            resource: The shared resource that the lock guards
+            lock_directory: The directory to keep the lock file in
+
+        Returns:
+            The FileLock
+        """
+        digest = hashlib.sha256(str(resource.absolute()).encode()).hexdigest()
+        return cls(lock_directory / f"{digest}.lock")
+
+    @property
+    def is_locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Acquires the lock, waiting for up to timeout seconds (or forever, if timeout is None).
+
+        Returns:
+            Whether the lock was acquired
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            if _try_lock(fd):
+                self._fd = fd
+                return True
+            os.close(fd)
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.POLL_INTERVAL)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            _unlock(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -0,0 +1,211 @@
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, TextIO, Tuple
+
+from sam_handler.timing import Span, Tracer
+
+# Longer lines are split, so a single line can't use unbounded memory.
+MAX_LINE_LENGTH = 8 * 1024
+DEFAULT_TAIL_LINES = 50
+# How long to wait for the rest of the output once a command exits. A process the command left
+# running in the background could keep the pipe open forever.
+READER_TIMEOUT = 5
+
+BUILD_START_PATTERN = re.compile(
+    r"^Building codeuri: (?P<codeuri>\S+) runtime: (?P<runtime>\S+).*? functions: (?P<resources>.+)$"
+)
+LAYER_BUILD_START_PATTERN = re.compile(r"^Building layer '(?P<resources>[^']+)'")
+BUILD_END_PATTERN = re.compile(r"^Build (Succeeded|Failed)")
+UPLOAD_PROGRESS_PATTERN = re.compile(
+    r"^Uploading to (?P<key>\S+)\s+(?P<sent>\d+) / (?P<total>[\d.]+)\s+\((?P<percent>[\d.]+)%\)"
+)
+UPLOAD_SKIPPED_PATTERN = re.compile(
+    r"^File with same data already exists at (?P<key>\S+), skipping upload"
+)
+
+# Serializes writing lines, so the output of concurrent commands never interleaves mid-line
+_output_lock = threading.Lock()
+
+
+class SamCommandError(subprocess.CalledProcessError):
+    """Raised when a SAM command fails. Its message ends with the last lines SAM printed."""
+
+    def __init__(self, returncode: int, cmd, tail: List[str]):
+        super().__init__(returncode, cmd, output="\n".join(tail))
+        self.tail = tail
+
+    def __str__(self):
+        message = super().__str__()
+        if self.tail:
+            message += " Last output:\n" + "\n".join(self.tail)
+        return message
+
+
+class SamOutputParser:
+    def __init__(self, tracer: Tracer):
+        """Parses SAM CLI's output line by line, emitting progress as spans on the tracer:
+
+        * `sam_build_resource`, for each function or layer SAM builds, with its resources (the
+          logical ids built from the same code), codeuri and runtime. Its duration lasts until the
+          next resource starts building or the build ends, so it overlaps other builds when SAM
+          builds in parallel.
+        * `sam_upload`, for each artifact `sam package` uploads (or skips), with its key and bytes.
+
+        Args:
+            tracer: The tracer to emit the spans on
+        """
+        self.tracer = tracer
+        self._building: Optional[Tuple[float, float, Dict[str, object]]] = None
+        # Maps the keys of artifacts being uploaded to when they started
+        self._uploads: Dict[str, Tuple[float, float]] = {}
+
+    def feed(self, line: str) -> bool:
+        """Parses a line of output.
+
+        Returns:
+            Whether the line is worth showing; intermediate upload progress lines aren't.
+        """
+        line = line.strip()
+        match = BUILD_START_PATTERN.match(line) or LAYER_BUILD_START_PATTERN.match(line)
+        if match:
+            self._finish_build()
+            attributes = {
+                "resources": [r.strip() for r in match["resources"].split(",")]
+            }
+            if "codeuri" in match.groupdict():
+                attributes.update(codeuri=match["codeuri"], runtime=match["runtime"])
+            self._building = (time.time(), time.perf_counter(), attributes)
+            return True
+        if BUILD_END_PATTERN.match(line):
+            self._finish_build()
+            return True
+
+        match = UPLOAD_PROGRESS_PATTERN.match(line)
+        if match:
+            key = match["key"]
+            start, started = self._uploads.setdefault(
+                key, (time.time(), time.perf_counter())
+            )
+            if float(match["percent"]) < 100:
+                return False
+            del self._uploads[key]
+            self._emit(
+                "sam_upload",
+                start,
+                time.perf_counter() - started,
+                key=key,
+                bytes=int(float(match["total"])),
+                skipped=False,
+            )
+            return True
+        match = UPLOAD_SKIPPED_PATTERN.match(line)
+        if match:
+            self._emit(
+                "sam_upload", time.time(), 0.0, key=match["key"], bytes=0, skipped=True
+            )
+        return True
+
+    def close(self):
+        """Finishes any progress still pending at the end of the output."""
+        self._finish_build()
+        self._uploads.clear()
+
+    def _finish_build(self):
+        if self._building is not None:
+            start, started, attributes = self._building
+            self._building = None
+            self._emit(
+                "sam_build_resource", start, time.perf_counter() - started, **attributes
+            )
+
+    def _emit(self, phase: str, start: float, duration: float, **attributes):
+        self.tracer.emit(
+            Span(phase, start, duration, {**self.tracer.attributes, **attributes})
+        )
+
+
+class SamOutputStream:
+    def __init__(
+        self,
+        parser: SamOutputParser,
+        *,
+        prefix: str = "",
+        output: Optional[TextIO] = None,
+        tail_lines: int = DEFAULT_TAIL_LINES,
+    ):
+        """A pipe for a SAM command's output that streams each line through the parser and on to
+        the output, without ever holding more than a bounded tail of it in memory.
+
+        Use it as a context manager and pass fileno() as the command's stdout and stderr.
+
+        Args:
+            parser: The parser to feed every line to
+            prefix: The prefix to write before each line (such as the stack name), so the output of
+                concurrent commands can be told apart
+            output: The stream to write the output to. Defaults to stderr, so it doesn't mix with
+                stdout that might be captured.
+            tail_lines: The number of lines to keep for the error message if the command fails
+        """
+        self.parser = parser
+        self.prefix = prefix
+        self.output = output
+        self.tail: Deque[str] = deque(maxlen=tail_lines)
+        self._read_fd: Optional[int] = None
+        self._write_fd: Optional[int] = None
+        self._reader: Optional[threading.Thread] = None
+        # Guards the parser and tail, since the reader may still be running when the stream is
+        # closed (if a background process kept the pipe open); output read after that is dropped.
+        self._lock = threading.Lock()
+        self._is_closed = False
+
+    def fileno(self) -> int:
+        return self._write_fd
+
+    def __enter__(self) -> "SamOutputStream":
+        self._read_fd, self._write_fd = os.pipe()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Waits for the rest of the output once the command has exited."""
+        if self._write_fd is None:
+            return
+        os.close(self._write_fd)
+        self._write_fd = None
+        self._reader.join(READER_TIMEOUT)
+        with self._lock:
+            self._is_closed = True
+            self.parser.close()
+
+    def _read(self):
+        with os.fdopen(self._read_fd, "rb") as pipe:
+            while True:
+                chunk = pipe.readline(MAX_LINE_LENGTH)
+                if not chunk:
+                    break
+                # Progress bars redraw the same line with carriage returns.
+                text = chunk.decode(errors="replace").rstrip("\n")
+                for line in text.split("\r"):
+                    if line.strip():
+                        self._handle_line(line.rstrip())
+
+    def _handle_line(self, line: str):
+        with self._lock:
+            if self._is_closed:
+                return
+            self.tail.append(line)
+            if not self.parser.feed(line):
+                return
+        output = self.output or sys.stderr
+        with _output_lock:
+            output.write(f"{self.prefix}{line}\n")
+            output.flush()
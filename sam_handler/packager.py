@@ -0,0 +1,395 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from sceptre.connection_manager import ConnectionManager
+from sceptre.exceptions import SceptreException
+
+from sam_handler.template import (
+    GLOBALS_SECTIONS,
+    LocalArtifact,
+    dump_template,
+    is_local_path,
+    iter_local_artifacts,
+    iter_local_paths,
+    load_template,
+)
+from sam_handler.timing import Tracer
+from sam_handler.zipping import make_zips
+
+# Properties whose artifacts must be uploaded as zip files, even if they refer to a single file
+ZIPPED_PROPERTIES = frozenset({"CodeUri", "ContentUri", "Code", "Content"})
+
+# Properties that CloudFormation expects as an S3Bucket/S3Key dict rather than as an S3 URI
+S3_DICT_PROPERTIES = frozenset({"Code", "Content"})
+
+_client_lock = threading.Lock()
+# Maps each session to its clients, by max_pool_connections and endpoint_url. Clients are dropped
+# along with their session, so a client never outlives the credentials it was created with.
+_s3_clients: "weakref.WeakKeyDictionary[object, dict]" = weakref.WeakKeyDictionary()
+
+
+class PackagingError(SceptreException):
+    """Raised when the native packager cannot package a template."""
+
+
+def get_s3_client(
+    connection_manager: ConnectionManager,
+    max_pool_connections: int,
+    profile: str = ConnectionManager.STACK_DEFAULT,
+    region: str = ConnectionManager.STACK_DEFAULT,
+    endpoint_url: Optional[str] = None,
+):
+    """Returns an S3 client for the ConnectionManager's session, with a connection pool big enough
+    for max_pool_connections concurrent uploads.
+
+    Clients are thread-safe and are shared by every packager in the process that uses the same
+    session. endpoint_url can point the client at an S3-compatible service instead of S3.
+    """
+    session = connection_manager.get_session(profile=profile, region=region)
+    key = (max_pool_connections, endpoint_url)
+    with _client_lock:
+        clients = _s3_clients.setdefault(session, {})
+        if key not in clients:
+            clients[key] = session.client(
+                "s3",
+                endpoint_url=endpoint_url,
+                config=Config(max_pool_connections=max_pool_connections),
+            )
+        return clients[key]
+
+
+def _md5_file(path: Path) -> str:
+    md5 = hashlib.md5()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class ArtifactIndex:
+    DEFAULT_MAX_AGE = 24 * 60 * 60
+
+    def __init__(
+        self, directory: Optional[Path] = None, max_age: float = DEFAULT_MAX_AGE
+    ):
+        """An index of the artifact keys known to exist under a bucket/prefix.
+
+        Artifact keys are content hashes, so a key that exists already holds the right content and
+        doesn't need to be uploaded again. Existing keys are discovered with a single
+        ListObjectsV2 listing per prefix (falling back to HEAD requests if listing isn't allowed)
+        and, when a directory is given, persisted so that later runs can skip the listing too.
+
+        Args:
+            directory: The directory to persist the index in; if None, it's only kept in memory
+            max_age: How long known keys are trusted before they are checked again, in seconds.
+                This guards against artifacts having been deleted from the bucket since.
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # Maps (bucket, prefix) to the time the known keys were checked (the oldest check, when they
+        # were found at different times) and the known keys
+        self._entries: Dict[Tuple[str, str], Tuple[float, Set[str]]] = {}
+
+    def find_existing(
+        self, s3_client, bucket: str, prefix: str, keys: Iterable[str]
+    ) -> Set[str]:
+        """Returns which of the keys already exist in the bucket.
+
+        Args:
+            s3_client: The boto3 S3 client to list the bucket with, if needed
+            bucket: The artifact bucket
+            prefix: The artifact key prefix
+            keys: The keys to check
+
+        Returns:
+            The subset of keys that exist
+        """
+        keys = set(keys)
+        with self._lock:
+            listed_at, known = self._load(bucket, prefix)
+            if keys - known:
+                listed = self._list_keys(s3_client, bucket, prefix)
+                if listed is None:
+                    listed = {
+                        key
+                        for key in keys - known
+                        if self._key_exists(s3_client, bucket, key)
+                    }
+                    if not known:
+                        listed_at = time.time()
+                else:
+                    listed_at = time.time()
+                known = known | listed
+                self._save(bucket, prefix, listed_at, known)
+        return keys & known
+
+    def add(self, bucket: str, prefix: str, keys: Iterable[str]):
+        """Records keys that were just uploaded."""
+        with self._lock:
+            listed_at, known = self._load(bucket, prefix)
+            if not known:
+                listed_at = time.time()
+            self._save(bucket, prefix, listed_at, known | set(keys))
+
+    def _list_keys(self, s3_client, bucket: str, prefix: str) -> Optional[Set[str]]:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        try:
+            return {
+                item["Key"]
+                for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/")
+                for item in page.get("Contents", [])
+            }
+        except ClientError:
+            # The credentials might only allow object-level access to the bucket.
+            return None
+
+    def _key_exists(self, s3_client, bucket: str, key: str) -> bool:
+        try:
+            s3_client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    def _index_path(self, bucket: str, prefix: str) -> Path:
+        digest = hashlib.sha256(f"{bucket}/{prefix}".encode()).hexdigest()
+        return self.directory / f"{digest}.json"
+
+    def _load(self, bucket: str, prefix: str) -> Tuple[float, Set[str]]:
+        entry = self._entries.get((bucket, prefix))
+        if entry is None and self.directory is not None:
+            try:
+                data = json.loads(self._index_path(bucket, prefix).read_text())
+                entry = (data["listed_at"], set(data["keys"]))
+            except (FileNotFoundError, ValueError, KeyError):
+                pass
+        if entry is None or time.time() - entry[0] > self.max_age:
+            return 0.0, set()
+        return entry
+
+    def _save(self, bucket: str, prefix: str, listed_at: float, keys: Set[str]):
+        self._entries[(bucket, prefix)] = (listed_at, keys)
+        if self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index_path = self._index_path(bucket, prefix)
+        temp_path = index_path.with_name(
+            f"{index_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        temp_path.write_text(json.dumps({"listed_at": listed_at, "keys": sorted(keys)}))
+        os.replace(temp_path, index_path)
+
+
+class NativePackager:
+    DEFAULT_MAX_WORKERS = 8
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        prefix: str,
+        *,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        artifact_index: Optional[ArtifactIndex] = None,
+        force_upload: bool = False,
+        zip_executor: Optional[Executor] = None,
+        tracer: Optional[Tracer] = None,
+        dry_run: bool = False,
+    ):
+        """An in-process replacement for `sam package`.
+
+        It rewrites the local artifact references of a built SAM template into S3 locations, zipping
+        and uploading the artifacts concurrently.
+
+        Args:
+            s3_client: The boto3 S3 client to upload artifacts with (unused in a dry run)
+            bucket: The bucket to upload artifacts to
+            prefix: The key prefix to upload artifacts under
+            max_workers: The maximum number of artifacts to zip and upload at once
+            artifact_index: The index used to skip uploading artifacts that already exist. If not
+                passed, an index that is only kept in memory is used.
+            force_upload: If True, every artifact is uploaded, even if it already exists
+            zip_executor: The executor to create zip files with; by default, the process pool
+                shared by the whole process is used.
+            tracer: The tracer to record the timing of zipping and uploading with
+            dry_run: If True, the template is rewritten with the keys the artifacts would be
+                uploaded to, but nothing is uploaded
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_workers = max_workers
+        self.artifact_index = artifact_index or ArtifactIndex()
+        self.force_upload = force_upload
+        self.zip_executor = zip_executor
+        self.tracer = tracer or Tracer()
+        self.dry_run = dry_run
+
+    def package(self, template_path: Path, output_template_path: Path) -> str:
+        """Packages the built template, writing the packaged template to output_template_path.
+
+        Args:
+            template_path: The path of the built template (i.e. .aws-sam/build/template.yaml)
+            output_template_path: The path to write the packaged template to
+
+        Returns:
+            The packaged template body
+        """
+        template = load_template(template_path.read_text())
+        artifacts = list(iter_local_artifacts(template, template_path.parent))
+        self._check_supported(template, artifacts)
+
+        unique_paths = list(dict.fromkeys(artifact.path for artifact in artifacts))
+        with tempfile.TemporaryDirectory() as staging_directory:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # First work out every artifact's key, so we can tell which ones already exist.
+                with self.tracer.span("zip", artifacts=len(unique_paths)):
+                    prepared = self._prepare(
+                        unique_paths, artifacts, Path(staging_directory), executor
+                    )
+                uploads = {key: upload_path for upload_path, key in prepared.values()}
+                if self.dry_run:
+                    # Only the keys are needed to rewrite the template.
+                    uploads.clear()
+                elif not self.force_upload:
+                    for key in self.artifact_index.find_existing(
+                        self.s3_client, self.bucket, self.prefix, uploads
+                    ):
+                        del uploads[key]
+
+                with self.tracer.span(
+                    "upload", uploads=len(uploads), skipped=len(prepared) - len(uploads)
+                ):
+                    for future in [
+                        executor.submit(
+                            self.s3_client.upload_file,
+                            str(upload_path),
+                            self.bucket,
+                            key,
+                        )
+                        for key, upload_path in uploads.items()
+                    ]:
+                        future.result()
+
+        self.artifact_index.add(self.bucket, self.prefix, uploads)
+        uploaded = {path: key for path, (_, key) in prepared.items()}
+        self._rewrite_template(template, artifacts, uploaded)
+        template_body = dump_template(template)
+        output_template_path.write_text(template_body)
+        return template_body
+
+    def _check_supported(self, template: dict, artifacts: List[LocalArtifact]):
+        for artifact in artifacts:
+            if not artifact.path.exists():
+                raise PackagingError(
+                    f"{artifact.logical_id}'s {artifact.property_name} refers to "
+                    f"{artifact.path}, which does not exist."
+                )
+        global_sections = template.get("Globals") or {}
+        global_function = global_sections.get("Function") or {}
+        for logical_id, resource in (template.get("Resources") or {}).items():
+            if not isinstance(resource, dict):
+                continue
+            properties = resource.get("Properties") or {}
+            package_type = properties.get("PackageType")
+            if (
+                package_type is None
+                and resource.get("Type") == "AWS::Serverless::Function"
+            ):
+                package_type = global_function.get("PackageType")
+            if package_type == "Image":
+                raise PackagingError(
+                    f"{logical_id} is a container image function, which the native packager "
+                    f"does not support. Use the sam packager for this template instead."
+                )
+        for local_path in iter_local_paths(template):
+            # Only packageable properties are uploaded and rewritten; any other local path would be
+            # left pointing at a file CloudFormation can't read.
+            if not local_path.is_packageable:
+                raise PackagingError(
+                    f"{local_path.owner} refers to a local {local_path.key}, which the native "
+                    f"packager does not support. Use the sam packager for this template instead."
+                )
+
+    def _needs_zip(self, path: Path, artifacts: List[LocalArtifact]) -> bool:
+        if path.is_dir():
+            return True
+        if path.suffix in (".zip", ".jar"):
+            return False
+        return any(
+            artifact.path == path and artifact.property_name in ZIPPED_PROPERTIES
+            for artifact in artifacts
+        )
+
+    def _prepare(
+        self,
+        paths: List[Path],
+        artifacts: List[LocalArtifact],
+        staging_directory: Path,
+        executor: Executor,
+    ) -> Dict[Path, Tuple[Path, str]]:
+        """Zips the artifacts that need it and computes every artifact's key.
+
+        Returns:
+            A dict mapping each artifact path to the path of the file to upload and its key
+        """
+        zip_paths = {
+            path: staging_directory
+            / f"{hashlib.sha256(str(path).encode()).hexdigest()}.zip"
+            for path in paths
+            if self._needs_zip(path, artifacts)
+        }
+        zip_digests = make_zips(list(zip_paths.items()), self.zip_executor)
+        plain_paths = [path for path in paths if path not in zip_paths]
+        plain_digests = dict(zip(plain_paths, executor.map(_md5_file, plain_paths)))
+
+        prepared = {}
+        for path in paths:
+            if path in zip_paths:
+                upload_path = zip_paths[path]
+                digest = zip_digests[upload_path]
+            else:
+                upload_path = path
+                digest = plain_digests[path]
+            prepared[path] = (upload_path, f"{self.prefix}/{digest}")
+        return prepared
+
+    def _rewrite_template(
+        self, template: dict, artifacts: List[LocalArtifact], uploaded: Dict[Path, str]
+    ):
+        resources = template.get("Resources") or {}
+        for artifact in artifacts:
+            key = uploaded[artifact.path]
+            properties = resources[artifact.logical_id].setdefault("Properties", {})
+            if artifact.property_name in S3_DICT_PROPERTIES:
+                properties[artifact.property_name] = {
+                    "S3Bucket": self.bucket,
+                    "S3Key": key,
+                }
+            else:
+                properties[artifact.property_name] = f"s3://{self.bucket}/{key}"
+
+        # Every resource now has its own artifact location, so any local paths in Globals are no
+        # longer needed (and wouldn't be valid once deployed).
+        global_sections = template.get("Globals") or {}
+        for section_name in GLOBALS_SECTIONS.values():
+            section = global_sections.get(section_name)
+            if not isinstance(section, dict):
+                continue
+            for property_name in list(section):
+                if property_name in ZIPPED_PROPERTIES | {"DefinitionUri"} and (
+                    is_local_path(section[property_name])
+                ):
+                    del section[property_name]
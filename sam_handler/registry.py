@@ -0,0 +1,173 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from sam_handler.fingerprint import DEFAULT_IGNORE_PATTERNS, stat_fingerprint
+
+T = TypeVar("T")
+
+
+class BuildRegistry:
+    def __init__(self):
+        """A thread-safe registry of builds performed in this process.
+
+        Each build is identified by a key describing all of its inputs, so handlers whose builds
+        would produce identical output can share a single build. If a build for a key is already in
+        progress, other callers wait for it to finish rather than starting another one.
+        """
+        self._lock = threading.Lock()
+        self._builds: Dict[str, Future] = {}
+
+    def build_once(self, key: str, build: Callable[[], T]) -> T:
+        """Runs the build for the key, unless it has already run (or is running) in this process.
+
+        Failed builds are not recorded, so a later call with the same key will try again.
+
+        Args:
+            key: The key identifying the build's inputs
+            build: The function that performs the build
+
+        Returns:
+            The result of the (possibly shared) build
+        """
+        with self._lock:
+            future = self._builds.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._builds[key] = Future()
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = build()
+        except BaseException as e:
+            with self._lock:
+                del self._builds[key]
+            future.set_exception(e)
+            raise
+
+        future.set_result(result)
+        return result
+
+    def is_built(self, key: str) -> bool:
+        """Returns whether a build for the key has completed successfully."""
+        with self._lock:
+            future = self._builds.get(key)
+        return future is not None and future.done()
+
+    def clear(self):
+        """Forgets every completed build, so that they will run again."""
+        with self._lock:
+            self._builds = {
+                key: future for key, future in self._builds.items() if not future.done()
+            }
+
+
+class ResultRegistry:
+    def __init__(self):
+        """A thread-safe registry of templates handled ahead of time (for instance, by a batch), so
+        that the handler of each stack can return its template without doing the work again.
+
+        Each result can only be taken once, so a template is never served stale after its first use.
+        """
+        self._lock = threading.Lock()
+        self._results: Dict[str, str] = {}
+
+    def prime(self, key: str, result: str):
+        """Records the handled template for the key, replacing any earlier one."""
+        with self._lock:
+            self._results[key] = result
+
+    def take(self, key: str) -> Optional[str]:
+        """Removes and returns the handled template for the key, if there is one."""
+        with self._lock:
+            return self._results.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+class TemplateMemo:
+    DEFAULT_MAX_ENTRIES = 256
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        *,
+        fingerprint: Callable[[Iterable[Path], Iterable[str]], str] = stat_fingerprint,
+    ):
+        """A thread-safe, in-memory memo of the templates handled in this process, so that a stack
+        whose template is requested again (for instance, to resolve dependencies and then to launch)
+        doesn't build and package it again.
+
+        Each template is recorded along with a fingerprint of its source files, and is only returned
+        while their fingerprint is unchanged. Once it holds max_entries templates, the least recently
+        used are evicted.
+
+        Args:
+            max_entries: The maximum number of templates to keep
+            fingerprint: The function computing the fingerprint of the source files, skipping the
+                files matching the ignore patterns
+        """
+        self.max_entries = max_entries
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._entries: (
+            "OrderedDict[str, Tuple[List[Path], Tuple[str, ...], str, str]]"
+        ) = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the template memoized for the key, unless its source files have changed since."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        paths, ignore_patterns, fingerprint, template_body = entry
+        if self.fingerprint(paths, ignore_patterns) != fingerprint:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return template_body
+
+    def put(
+        self,
+        key: str,
+        paths: List[Path],
+        fingerprint: str,
+        template_body: str,
+        ignore_patterns: Iterable[str] = DEFAULT_IGNORE_PATTERNS,
+    ):
+        """Memoizes the template for the key.
+
+        Args:
+            key: The key identifying the handler's inputs
+            paths: The source files (and directories) the template was handled from
+            fingerprint: The fingerprint of the source files, taken before they were read, so that
+                changes made while the template was being handled aren't missed
+            template_body: The handled template
+            ignore_patterns: The patterns of the files the fingerprint skipped
+        """
+        entry = (list(paths), tuple(ignore_patterns), fingerprint, template_body)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# The registries shared by every SAM handler in the process
+build_registry = BuildRegistry()
+result_registry = ResultRegistry()
+template_memo = TemplateMemo()
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+from jinja2 import Environment, meta
+
+from sam_handler.cache import hash_path, hash_values
+
+
+def find_template_sources(path: Path, j2_environment: dict) -> Optional[List[Path]]:
+    """Finds every file a Jinja template is rendered from: the template itself and, recursively,
+    every template it includes, imports or extends.
+
+    Args:
+        path: The path of the Jinja template
+        j2_environment: The Jinja environment options the template is rendered with
+
+    Returns:
+        The paths of the files, or None if they can't all be determined without rendering (for
+        instance, because a template includes a name computed at render time)
+    """
+    if not isinstance(j2_environment, dict) or "loader" in j2_environment:
+        # A custom loader could find templates anywhere.
+        return None
+    try:
+        # Custom syntax or extensions change how templates are parsed.
+        environment = Environment(**j2_environment)
+    except Exception:
+        return None
+
+    sources = [path]
+    pending = [path]
+    while pending:
+        source = pending.pop()
+        try:
+            names = meta.find_referenced_templates(
+                environment.parse(source.read_text())
+            )
+            for name in names:
+                if name is None:
+                    return None
+                # Templates are loaded from the directory of the template being rendered.
+                referenced = path.parent / name
+                if referenced not in sources:
+                    sources.append(referenced)
+                    pending.append(referenced)
+        except Exception:
+            return None
+    return sources
+
+
+def get_render_key(
+    path: Path, sceptre_user_data: Optional[dict], j2_environment: dict
+) -> Optional[str]:
+    """Returns a key identifying everything a Jinja template's rendering depends on: the contents of
+    the template and of the templates it references, the sceptre_user_data and the Jinja
+    environment options.
+
+    Returns:
+        The key, or None if the template's sources can't be determined without rendering it
+    """
+    sources = find_template_sources(path, j2_environment)
+    if sources is None:
+        return None
+    return hash_values(
+        str(path),
+        [(str(source), hash_path(source)) for source in sources],
+        sceptre_user_data,
+        j2_environment,
+    )
+
+
+def write_if_changed(path: Path, contents: str) -> bool:
+    """Writes the contents to the file, unless it already holds them, so that its modification time
+    only changes along with its contents.
+
+    Returns:
+        Whether the file was written
+    """
+    try:
+        if path.read_text() == contents:
+            return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    path.write_text(contents)
+    return True
+
+
+class RenderCache:
+    DEFAULT_MAX_ENTRIES = 256
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """A thread-safe, in-memory cache of compiled Jinja templates, keyed by get_render_key.
+
+        Once it holds max_entries templates, the least recently used are evicted.
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: str, body: str):
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# The cache shared by every SAM handler in the process
+render_cache = RenderCache()
@@ -0,0 +1,351 @@
+from pathlib import Path
+from typing import Any, Iterator, NamedTuple
+
+import yaml
+
+# The resource properties that SAM CLI treats as references to local files or directories that get
+# uploaded to S3 when the template is packaged.
+PACKAGEABLE_PROPERTIES = {
+    "AWS::Serverless::Function": "CodeUri",
+    "AWS::Serverless::LayerVersion": "ContentUri",
+    "AWS::Serverless::Api": "DefinitionUri",
+    "AWS::Serverless::HttpApi": "DefinitionUri",
+    "AWS::Serverless::StateMachine": "DefinitionUri",
+    "AWS::Lambda::Function": "Code",
+    "AWS::Lambda::LayerVersion": "Content",
+}
+
+# Every other resource property that `sam package` uploads from a local path, relative to the
+# template's directory, as the keys leading to the property within the resource's Properties
+OTHER_LOCAL_PATH_PROPERTIES = {
+    "AWS::Serverless::Application": [("Location",)],
+    "AWS::Serverless::GraphQLApi": [("SchemaUri",)],
+    "AWS::CloudFormation::Stack": [("TemplateURL",)],
+    "AWS::ApiGateway::RestApi": [("BodyS3Location",)],
+    "AWS::ApiGatewayV2::Api": [("BodyS3Location",)],
+    "AWS::StepFunctions::StateMachine": [("DefinitionS3Location",)],
+    "AWS::AppSync::GraphQLSchema": [("DefinitionS3Location",)],
+    "AWS::AppSync::Resolver": [
+        ("RequestMappingTemplateS3Location",),
+        ("ResponseMappingTemplateS3Location",),
+        ("CodeS3Location",),
+    ],
+    "AWS::AppSync::FunctionConfiguration": [
+        ("RequestMappingTemplateS3Location",),
+        ("ResponseMappingTemplateS3Location",),
+        ("CodeS3Location",),
+    ],
+    "AWS::Glue::Job": [("Command", "ScriptLocation")],
+    "AWS::ElasticBeanstalk::ApplicationVersion": [("SourceBundle",)],
+    "AWS::CloudFormation::ModuleVersion": [("ModulePackage",)],
+    "AWS::CloudFormation::ResourceVersion": [("SchemaHandlerPackage",)],
+}
+
+# Resource types whose packageable property can be inherited from the template's Globals section.
+GLOBALS_SECTIONS = {
+    "AWS::Serverless::Function": "Function",
+    "AWS::Serverless::Api": "Api",
+    "AWS::Serverless::HttpApi": "HttpApi",
+}
+
+# The code SAM CLI builds and packages for a serverless function or layer that doesn't set any: the
+# template's directory
+DEFAULT_CODE_URI = "."
+
+
+class TaggedValue:
+    """A CloudFormation short-form intrinsic function (like !Ref or !Sub) loaded from YAML.
+
+    PyYAML doesn't know anything about CloudFormation's tags, so these are preserved as-is in order
+    to be able to dump the template again without altering it.
+    """
+
+    def __init__(self, tag: str, value: Any):
+        self.tag = tag
+        self.value = value
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, TaggedValue)
+            and self.tag == other.tag
+            and self.value == other.value
+        )
+
+    def __repr__(self):
+        return f"TaggedValue({self.tag!r}, {self.value!r})"
+
+
+class _TemplateLoader(yaml.SafeLoader):
+    pass
+
+
+class _TemplateDumper(yaml.SafeDumper):
+    pass
+
+
+def _construct_tagged_value(loader: yaml.Loader, tag_suffix: str, node: yaml.Node):
+    tag = f"!{tag_suffix}"
+    if isinstance(node, yaml.ScalarNode):
+        return TaggedValue(tag, loader.construct_scalar(node))
+    if isinstance(node, yaml.SequenceNode):
+        return TaggedValue(tag, loader.construct_sequence(node, deep=True))
+    return TaggedValue(tag, loader.construct_mapping(node, deep=True))
+
+
+def _represent_tagged_value(dumper: yaml.Dumper, data: TaggedValue):
+    if isinstance(data.value, list):
+        return dumper.represent_sequence(data.tag, data.value)
+    if isinstance(data.value, dict):
+        return dumper.represent_mapping(data.tag, data.value)
+    return dumper.represent_scalar(data.tag, data.value)
+
+
+_TemplateLoader.add_multi_constructor("!", _construct_tagged_value)
+_TemplateDumper.add_representer(TaggedValue, _represent_tagged_value)
+
+
+def load_template(template_body: str) -> dict:
+    """Parses a SAM/CloudFormation template body, preserving any short-form intrinsic functions.
+
+    Args:
+        template_body: The YAML (or JSON) template body
+
+    Returns:
+        The parsed template
+    """
+    return yaml.load(template_body, Loader=_TemplateLoader) or {}
+
+
+def dump_template(template: dict) -> str:
+    """Serializes a template loaded with load_template back into YAML.
+
+    Args:
+        template: The template to dump
+
+    Returns:
+        The YAML template body
+    """
+    return yaml.dump(template, Dumper=_TemplateDumper, sort_keys=False)
+
+
+class LocalArtifact(NamedTuple):
+    """A reference to a local file or directory in a template resource's packageable property."""
+
+    logical_id: str
+    resource_type: str
+    property_name: str
+    path: Path
+
+
+def is_local_path(value: Any) -> bool:
+    """Returns whether the value of a packageable property refers to a local path (rather than to an
+    S3 location or an intrinsic function).
+    """
+    return isinstance(value, str) and "://" not in value
+
+
+def iter_local_artifacts(
+    template: dict, base_directory: Path
+) -> Iterator[LocalArtifact]:
+    """Yields every local file or directory referenced by the template's packageable properties,
+    including the DEFAULT_CODE_URI of functions and layers that don't set their code.
+
+        Args:
+            template: The template as returned from load_template
+            base_directory: The directory relative paths in the template are resolved against
+
+        Yields:
+            The local artifacts, in template order
+    """
+    if not isinstance(template, dict):
+        return
+    resources = template.get("Resources") or {}
+    global_sections = template.get("Globals") or {}
+    for logical_id, resource in resources.items():
+        if not isinstance(resource, dict):
+            continue
+        resource_type = resource.get("Type")
+        property_name = PACKAGEABLE_PROPERTIES.get(resource_type)
+        if property_name is None:
+            continue
+
+        properties = resource.get("Properties") or {}
+        if property_name in properties:
+            value = properties[property_name]
+        elif _uses_default_code_uri(resource_type, properties, global_sections):
+            value = DEFAULT_CODE_URI
+        else:
+            section = global_sections.get(GLOBALS_SECTIONS.get(resource_type)) or {}
+            value = section.get(property_name)
+
+        if is_local_path(value):
+            yield LocalArtifact(
+                logical_id, resource_type, property_name, base_directory / value
+            )
+
+
+class LocalPath(NamedTuple):
+    """A reference to a local path in a template, which SAM CLI reads when building or packaging
+    it.
+    """
+
+    # The logical ID of the resource, the Globals section name or "AWS::Include"
+    owner: str
+    # The mapping (within the template) that holds the path
+    mapping: dict
+    # The key of the path in the mapping
+    key: str
+    # Whether it's a packageable property, rather than one of the other local path properties, a
+    # docker context or an included snippet
+    is_packageable: bool
+
+    @property
+    def value(self) -> str:
+        # A function or layer relying on the default code has no such key yet
+        return self.mapping.get(self.key, DEFAULT_CODE_URI)
+
+
+def iter_local_paths(template: dict) -> Iterator[LocalPath]:
+    """Yields every local path in the template: packageable properties (including those in Globals,
+    and those of functions and layers relying on DEFAULT_CODE_URI), the other local path
+    properties, the DockerContext of container image functions and the Location of AWS::Include
+    transforms.
+
+    Args:
+        template: The template as returned from load_template
+
+    Yields:
+        The local paths, in template order
+    """
+    if not isinstance(template, dict):
+        return
+
+    global_sections = template.get("Globals") or {}
+    if isinstance(global_sections, dict):
+        for resource_type, section_name in GLOBALS_SECTIONS.items():
+            section = global_sections.get(section_name)
+            property_name = PACKAGEABLE_PROPERTIES[resource_type]
+            if isinstance(section, dict) and is_local_path(section.get(property_name)):
+                yield LocalPath(section_name, section, property_name, True)
+
+    for logical_id, resource in (template.get("Resources") or {}).items():
+        if not isinstance(resource, dict):
+            continue
+        resource_type = resource.get("Type")
+        properties = resource.get("Properties")
+        if isinstance(properties, dict):
+            property_name = PACKAGEABLE_PROPERTIES.get(resource_type)
+            if property_name and (
+                is_local_path(properties.get(property_name))
+                or _uses_default_code_uri(resource_type, properties, global_sections)
+            ):
+                yield LocalPath(logical_id, properties, property_name, True)
+            for *parents, property_name in OTHER_LOCAL_PATH_PROPERTIES.get(
+                resource_type, []
+            ):
+                mapping = properties
+                for parent in parents:
+                    mapping = mapping.get(parent) if isinstance(mapping, dict) else None
+                if isinstance(mapping, dict) and is_local_path(
+                    mapping.get(property_name)
+                ):
+                    yield LocalPath(logical_id, mapping, property_name, False)
+
+        # Container image functions are built from a docker context relative to the template
+        metadata = resource.get("Metadata")
+        if isinstance(metadata, dict) and is_local_path(metadata.get("DockerContext")):
+            yield LocalPath(logical_id, metadata, "DockerContext", False)
+
+    yield from _iter_included_paths(template)
+
+
+def iter_local_inputs(template: dict, base_directory: Path) -> Iterator[Path]:
+    """Yields every local file or directory SAM CLI reads when building and packaging the template,
+    besides the template itself.
+
+    Args:
+        template: The template as returned from load_template
+        base_directory: The directory relative paths in the template are resolved against
+
+    Yields:
+        The paths, each only once, in template order
+    """
+    seen = set()
+    for local_path in iter_local_paths(template):
+        path = base_directory / local_path.value
+        if path not in seen:
+            seen.add(path)
+            yield path
+
+
+def _iter_included_paths(value: Any) -> Iterator[LocalPath]:
+    """Yields the Location of every AWS::Include transform, in long or short form, at any depth."""
+    if isinstance(value, TaggedValue):
+        if value.tag == "!Transform":
+            yield from _iter_include_location(value.value)
+        yield from _iter_included_paths(value.value)
+    elif isinstance(value, dict):
+        if "Fn::Transform" in value:
+            yield from _iter_include_location(value["Fn::Transform"])
+        for item in value.values():
+            yield from _iter_included_paths(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _iter_included_paths(item)
+
+
+def _iter_include_location(transform: Any) -> Iterator[LocalPath]:
+    if not isinstance(transform, dict) or transform.get("Name") != "AWS::Include":
+        return
+    parameters = transform.get("Parameters")
+    if isinstance(parameters, dict) and is_local_path(parameters.get("Location")):
+        yield LocalPath("AWS::Include", parameters, "Location", False)
+
+
+def _uses_default_code_uri(
+    resource_type: str, properties: dict, global_sections: Any
+) -> bool:
+    """Returns whether a serverless function or layer is built from DEFAULT_CODE_URI, since neither
+    its properties nor the template's Globals set its code (and it isn't a container image
+    function).
+
+    Args:
+        resource_type: The resource's type
+        properties: The resource's Properties
+        global_sections: The template's Globals section
+    """
+    if resource_type == "AWS::Serverless::LayerVersion":
+        return "ContentUri" not in properties
+    if resource_type != "AWS::Serverless::Function":
+        return False
+    global_function = (
+        global_sections.get("Function") if isinstance(global_sections, dict) else None
+    )
+    if not isinstance(global_function, dict):
+        global_function = {}
+    if any(
+        key in properties or key in global_function
+        for key in ("CodeUri", "InlineCode", "ImageUri")
+    ):
+        return False
+    package_type = properties.get("PackageType", global_function.get("PackageType"))
+    return package_type != "Image"
+
+
+def make_local_paths_absolute(template: dict, base_directory: Path) -> dict:
+    """Rewrites every relative local path in the template to an absolute path, so that the template
+    can be built from a different directory than the one it was written in.
+
+    Args:
+        template: The template as returned from load_template; it is modified in place
+        base_directory: The directory relative paths in the template are resolved against
+
+    Returns:
+        The modified template
+    """
+    for local_path in list(iter_local_paths(template)):
+        if not Path(local_path.value).is_absolute():
+            local_path.mapping[local_path.key] = str(
+                base_directory.joinpath(local_path.value).absolute()
+            )
+    return template
@@ -0,0 +1,167 @@
+import cProfile
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+PROFILERS = ("cprofile", "tracemalloc")
+
+logger = logging.getLogger(__name__)
+
+
+class Span(NamedTuple):
+    """The timing of one phase of handling a template."""
+
+    phase: str
+    start: float
+    duration: float
+    attributes: Dict[str, object]
+
+    def to_dict(self) -> dict:
+        return {
+            "phase": self.phase,
+            "start": self.start,
+            "duration": self.duration,
+            **self.attributes,
+        }
+
+
+Sink = Callable[[Span], None]
+
+
+class LoggerSink:
+    def __init__(self, logger: logging.Logger = logger, level: int = logging.DEBUG):
+        """A sink that logs every span."""
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, span: Span):
+        if self.logger.isEnabledFor(self.level):
+            attributes = " ".join(f"{k}={v}" for k, v in span.attributes.items())
+            self.logger.log(
+                self.level, f"{span.phase} took {span.duration:.3f}s {attributes}"
+            )
+
+
+class JsonLinesSink:
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path):
+        """A sink that appends every span to a JSON-lines file."""
+        self.path = path
+
+    def __call__(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a") as f:
+                f.write(line)
+
+
+# Sinks that receive the spans of every handler in the process, in addition to their own
+_global_sinks: List[Sink] = []
+
+
+def register_sink(sink: Sink):
+    """Registers a callable that will receive the spans recorded by every SAM handler."""
+    _global_sinks.append(sink)
+
+
+def unregister_sink(sink: Sink):
+    _global_sinks.remove(sink)
+
+
+class Tracer:
+    def __init__(
+        self,
+        sinks: Optional[List[Sink]] = None,
+        attributes: Optional[Dict[str, object]] = None,
+        *,
+        profiler: Optional[str] = None,
+        profile_path_prefix: Optional[Path] = None,
+    ):
+        """Records timing spans for the phases of handling a template and sends them to sinks.
+
+        Args:
+            sinks: The callables to send each span to, in addition to the globally registered ones
+            attributes: Attributes added to every span, such as the stack name
+            profiler: If set to "cprofile" or "tracemalloc", profiled phases are run under that
+                profiler and a dump is written for each of them
+            profile_path_prefix: The path prefix for profile dumps; each dump is written to
+                "<prefix>.<phase>.<profiler>"
+        """
+        self.sinks = list(sinks or [])
+        self.attributes = dict(attributes or {})
+        self.profiler = profiler
+        self.profile_path_prefix = profile_path_prefix
+
+    @contextmanager
+    def span(
+        self, phase: str, *, profile: bool = False, **attributes
+    ) -> Iterator[Dict[str, object]]:
+        """Times the body of the with statement as a phase.
+
+        Args:
+            phase: The name of the phase
+            profile: Whether to run the phase under the tracer's profiler, if it has one
+            **attributes: Attributes to add to the span
+
+        Yields:
+            The span's attributes, which the body can add to (e.g. to record a cache hit)
+        """
+        span_attributes = {**self.attributes, **attributes}
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            with self._profile(phase, profile):
+                yield span_attributes
+        finally:
+            self.emit(
+                Span(phase, start, time.perf_counter() - started, span_attributes)
+            )
+
+    def emit(self, span: Span):
+        for sink in [*self.sinks, *_global_sinks]:
+            try:
+                sink(span)
+            except Exception:
+                logger.exception("Timing sink failed")
+
+    @contextmanager
+    def _profile(self, phase: str, profile: bool):
+        if not (profile and self.profiler and self.profile_path_prefix):
+            yield
+            return
+
+        dump_path = Path(f"{self.profile_path_prefix}.{phase}.{self.profiler}")
+        if self.profiler == "cprofile":
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Only one profiler can be active at a time (on Python 3.12+), so concurrent
+                # phases can't all be profiled.
+                logger.debug(f"Could not profile {phase}; another profiler is active")
+                yield
+                return
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(str(dump_path))
+        elif self.profiler == "tracemalloc":
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            try:
+                yield
+            finally:
+                tracemalloc.take_snapshot().dump(str(dump_path))
+                if started_tracing:
+                    tracemalloc.stop()
+        else:
+            yield
@@ -0,0 +1,229 @@
+import argparse
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sceptre.context import SceptreContext
+from sceptre.plan.plan import SceptrePlan
+
+from sam_handler.batch import create_handlers
+from sam_handler.fingerprint import stat_fingerprint
+from sam_handler.handler import SAM
+
+# How often the source files are checked for changes, in seconds
+DEFAULT_POLL_INTERVAL = 0.5
+# How long the source files must stay unchanged before the templates are handled again, in
+# seconds, so that a burst of changes (such as saving several files, or switching branches) only
+# triggers a single run
+DEFAULT_DEBOUNCE = 0.3
+
+logger = logging.getLogger(__name__)
+
+
+class Watcher:
+    def __init__(
+        self,
+        handlers: Iterable[SAM],
+        *,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        debounce: float = DEFAULT_DEBOUNCE,
+        on_handled: Optional[Callable[[SAM, str], None]] = None,
+        fingerprint: Callable[[Iterable[Path], Iterable[str]], str] = stat_fingerprint,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """Handles the templates of SAM handlers again whenever their source files change, for
+        local development.
+
+        The handlers are kept for as long as the watcher runs, along with everything the handler
+        keeps in the process: rendered Jinja templates, the templates of unchanged stacks and, with
+        the "worker" invoker, the SAM CLI workers. Unless the stacks are configured otherwise, they
+        are built incrementally, so only the functions and layers whose inputs changed are rebuilt,
+        and SAM CLI runs on workers.
+
+        Changes are detected by polling the size and modification time of each stack's source files
+        (see SAM.get_source_paths). If they can't be determined, the stack's whole project directory
+        is watched instead.
+
+        Args:
+            handlers: The handlers of the stacks to watch
+            poll_interval: How often to check the source files for changes, in seconds
+            debounce: How long the source files must stay unchanged before handling the templates
+                again, in seconds
+            on_handled: The function to call with each handler and its template, once handled
+            fingerprint: The function computing the fingerprint of the source files, skipping the
+                handler's fingerprint_ignore_patterns
+            sleep: The function to wait with
+        """
+        self.handlers = list(handlers)
+        for handler in self.handlers:
+            handler.arguments.setdefault("incremental_build", True)
+            handler.arguments.setdefault("invoker", "worker")
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.on_handled = on_handled
+        self.fingerprint = fingerprint
+        self.sleep = sleep
+        # Maps each stack's name to the paths watched for it and their fingerprint when it was
+        # last handled
+        self._watched: Dict[str, Tuple[List[Path], str]] = {}
+
+    def run(self, max_runs: Optional[int] = None):
+        """Handles every template, then handles the changed templates again whenever their source
+        files change.
+
+        Args:
+            max_runs: The number of runs after which to stop, if any
+        """
+        self.run_once(self.handlers)
+        runs = 1
+        while max_runs is None or runs < max_runs:
+            self.run_once(self.wait_for_changes())
+            runs += 1
+
+    def run_once(self, handlers: Iterable[SAM]) -> Dict[str, Exception]:
+        """Handles the templates, recording the source files to watch for each of them.
+
+        Returns:
+            The error of each stack that failed, by stack name
+        """
+        # Builds shared between stacks are keyed on the fingerprint of their sources, so a stack
+        # whose code changed is built again, while the other stacks keep their builds.
+        errors = {}
+        for handler in handlers:
+            error = self._handle(handler)
+            if error is not None:
+                errors[handler.name] = error
+        return errors
+
+    def wait_for_changes(self) -> List[SAM]:
+        """Waits until the source files of at least one stack change, and then until they stay
+        unchanged for the debounce window.
+
+        Returns:
+            The handlers whose source files changed
+        """
+        snapshot = self._take_snapshot()
+        while not self._get_changed(snapshot):
+            self.sleep(self.poll_interval)
+            snapshot = self._take_snapshot()
+        while True:
+            self.sleep(self.debounce)
+            latest_snapshot = self._take_snapshot()
+            if latest_snapshot == snapshot:
+                return self._get_changed(snapshot)
+            snapshot = latest_snapshot
+
+    def _handle(self, handler: SAM) -> Optional[Exception]:
+        paths = self._get_watched_paths(handler)
+        # The fingerprint is taken before handling, so that changes made in the meantime trigger
+        # another run.
+        fingerprint = self._fingerprint(handler, paths)
+        error = None
+        started = time.perf_counter()
+        try:
+            template = handler.handle()
+        except Exception as e:
+            logger.error(f"[{handler.name}] Failed to handle template: {e}")
+            error = e
+
+        source_paths = handler.get_source_paths() or [handler.sam_directory]
+        if source_paths != paths:
+            paths, fingerprint = source_paths, self._fingerprint(handler, source_paths)
+        self._watched[handler.name] = (paths, fingerprint)
+        if error is not None:
+            return error
+
+        logger.info(
+            f"[{handler.name}] Handled template in {time.perf_counter() - started:.2f}s: "
+            f"{handler.destination_template_path}"
+        )
+        if self.on_handled is not None:
+            self.on_handled(handler, template)
+        return None
+
+    def _get_watched_paths(self, handler: SAM) -> List[Path]:
+        if handler.name in self._watched:
+            return self._watched[handler.name][0]
+        return handler.get_source_paths() or [handler.sam_directory]
+
+    def _fingerprint(self, handler: SAM, paths: List[Path]) -> str:
+        return self.fingerprint(paths, handler.fingerprint_ignore_patterns)
+
+    def _take_snapshot(self) -> Dict[str, str]:
+        return {
+            handler.name: self._fingerprint(handler, self._get_watched_paths(handler))
+            for handler in self.handlers
+        }
+
+    def _get_changed(self, snapshot: Dict[str, str]) -> List[SAM]:
+        return [
+            handler
+            for handler in self.handlers
+            if handler.name not in self._watched
+            or snapshot[handler.name] != self._watched[handler.name][1]
+        ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sam_handler.watch",
+        description="Handles the SAM templates of Sceptre stacks again whenever their sources change.",
+    )
+    parser.add_argument(
+        "command_path", help="The stack or stack group to watch, as passed to sceptre"
+    )
+    parser.add_argument(
+        "--project-path",
+        default=".",
+        help="The Sceptre project directory (defaults to the current directory)",
+    )
+    parser.add_argument(
+        "--var",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="A Sceptre variable, like sceptre's --var (can be repeated)",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help="How often to check for changes, in seconds (defaults to %(default)s)",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+        help="How long changes must settle before handling, in seconds (defaults to %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    user_variables = {}
+    for variable in args.var:
+        key, separator, value = variable.partition("=")
+        if not separator:
+            parser.error(f"--var must be KEY=VALUE, not {variable!r}")
+        user_variables[key] = value
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    context = SceptreContext(
+        project_path=str(Path(args.project_path).absolute()),
+        command_path=args.command_path,
+        user_variables=user_variables,
+    )
+    handlers = create_handlers(SceptrePlan(context).command_stacks)
+    if not handlers:
+        parser.error(f"No stacks under {args.command_path} use the SAM handler")
+
+    watcher = Watcher(
+        handlers, poll_interval=args.poll_interval, debounce=args.debounce
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import atexit
+import importlib.util
+import json
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SERVER_SCRIPT = Path(__file__).with_name("_worker_server.py")
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerUnavailableError(Exception):
+    """Raised when a SAM CLI worker can't be started or dies while running a command."""
+
+
+def find_sam_python() -> Optional[str]:
+    """Finds the Python interpreter that SAM CLI is installed into.
+
+    SAM CLI installed via pip or pipx has a `sam` console script whose shebang points to the
+    interpreter of its environment. Otherwise, SAM CLI might be installed alongside the handler.
+
+    Returns:
+        The path of the interpreter, or None if SAM CLI can't be run in-process (for instance, when it
+        was installed with AWS's native installer)
+    """
+    sam_path = shutil.which("sam")
+    if sam_path:
+        try:
+            with open(sam_path, "rb") as f:
+                first_line = f.readline(1024).decode(errors="ignore").strip()
+        except OSError:
+            first_line = ""
+        if first_line.startswith("#!"):
+            interpreter = shlex.split(first_line[2:])
+            if interpreter and Path(interpreter[0]).name == "env":
+                interpreter = interpreter[1:]
+            if interpreter and "python" in Path(interpreter[0]).name:
+                return shutil.which(interpreter[0]) or interpreter[0]
+
+    if importlib.util.find_spec("samcli") is not None:
+        return sys.executable
+    return None
+
+
+class SamWorker:
+    def __init__(self, python: str, *, popen=subprocess.Popen):
+        """A long-lived process that runs SAM CLI commands in-process, sparing the interpreter
+        startup and import time of a new `sam` process for every command.
+
+        Args:
+            python: The Python interpreter SAM CLI is installed into
+            popen: The function used to start the worker process, matching subprocess.Popen
+        """
+        self.process = popen(
+            [python, str(SERVER_SCRIPT)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        response = self._read_response()
+        if not response.get("ready"):
+            self.close()
+            raise WorkerUnavailableError(
+                response.get("error", "The SAM CLI worker failed to start")
+            )
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(
+        self,
+        args: List[str],
+        cwd: Path,
+        env: Dict[str, str],
+        output_fd: Optional[int] = None,
+    ) -> int:
+        """Runs `sam <args>` in the worker.
+
+        Args:
+            args: The arguments to pass to `sam`
+            cwd: The directory to run the command in
+            env: The command's environment variables
+            output_fd: The file descriptor to write the command's output to as it runs, if any
+
+        Returns:
+            The command's exit code
+        """
+        request = {"args": args, "cwd": str(cwd), "env": dict(env)}
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerUnavailableError("The SAM CLI worker has exited") from e
+        while True:
+            response = self._read_response()
+            if "output" not in response:
+                return response["exit_code"]
+            if output_fd is not None:
+                os.write(output_fd, response["output"].encode())
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def _read_response(self) -> dict:
+        line = self.process.stdout.readline()
+        if not line:
+            raise WorkerUnavailableError("The SAM CLI worker has exited")
+        return json.loads(line)
+
+
+class SamWorkerPool:
+    def __init__(
+        self,
+        python: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        *,
+        worker_class=SamWorker,
+    ):
+        """A pool of SAM CLI workers shared by every invoker in the process.
+
+        Workers are started on demand, up to max_workers, and reused for later commands.
+
+        Args:
+            python: The Python interpreter SAM CLI is installed into; found with find_sam_python if
+                not passed
+            max_workers: The maximum number of workers to run at once. Defaults to the CPU count.
+            worker_class: The class of the workers to start
+        """
+        self.python = python
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.worker_class = worker_class
+        self._condition = threading.Condition()
+        self._idle: List[SamWorker] = []
+        self._worker_count = 0
+        self._is_available: Optional[bool] = None
+
+    @property
+    def is_available(self) -> bool:
+        """Returns whether SAM CLI can be run in a worker at all."""
+        if self._is_available is None:
+            if self.python is None:
+                self.python = find_sam_python()
+            self._is_available = self.python is not None
+        return self._is_available
+
+    def run(
+        self,
+        args: List[str],
+        cwd: Path,
+        env: Dict[str, str],
+        output_fd: Optional[int] = None,
+    ) -> int:
+        """Runs `sam <args>` on an idle worker, starting a new one if needed.
+
+        Args:
+            args: The arguments to pass to `sam`
+            cwd: The directory to run the command in
+            env: The command's environment variables
+            output_fd: The file descriptor to write the command's output to as it runs, if any
+
+        Returns:
+            The command's exit code
+
+        Raises:
+            WorkerUnavailableError: If no worker could run the command
+        """
+        if not self.is_available:
+            raise WorkerUnavailableError("SAM CLI could not be found")
+
+        worker = self._checkout()
+        try:
+            exit_code = worker.run(args, cwd, env, output_fd)
+        except BaseException:
+            self._discard(worker)
+            raise
+        self._checkin(worker)
+        return exit_code
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._worker_count -= len(idle)
+        for worker in idle:
+            worker.close()
+
+    def _checkout(self) -> SamWorker:
+        with self._condition:
+            while not self._idle and self._worker_count >= self.max_workers:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._worker_count += 1
+
+        try:
+            logger.debug("Starting SAM CLI worker with %s", self.python)
+            return self.worker_class(self.python)
+        except BaseException as e:
+            with self._condition:
+                self._worker_count -= 1
+                self._condition.notify()
+            if isinstance(e, WorkerUnavailableError):
+                # SAM CLI can't be imported, so there's no point in trying again.
+                self._is_available = False
+            raise
+
+    def _checkin(self, worker: SamWorker):
+        with self._condition:
+            if worker.is_alive:
+                self._idle.append(worker)
+            else:
+                self._worker_count -= 1
+            self._condition.notify()
+
+    def _discard(self, worker: SamWorker):
+        worker.close()
+        with self._condition:
+            self._worker_count -= 1
+            self._condition.notify()
+
+
+_pool_lock = threading.Lock()
+_shared_pool: Optional[SamWorkerPool] = None
+
+
+def get_shared_worker_pool() -> SamWorkerPool:
+    """Returns the worker pool shared by every SAM handler in the process."""
+    global _shared_pool
+    with _pool_lock:
+        if _shared_pool is None:
+            _shared_pool = SamWorkerPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
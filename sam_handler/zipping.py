@@ -0,0 +1,120 @@
+import hashlib
+import multiprocessing
+import os
+import shutil
+import stat
+import threading
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Zip files can't represent dates before 1980, so this is the earliest fixed timestamp available.
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Lambda only needs to know whether a file is executable, so permissions are normalized to these.
+FILE_MODE = 0o644
+EXECUTABLE_FILE_MODE = 0o755
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+_executor_lock = threading.Lock()
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_shared_executor() -> ProcessPoolExecutor:
+    """Returns the process pool shared by every zip job in this process."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Sceptre runs handlers from a thread pool, and forking a multi-threaded process isn't
+            # safe, so the workers are spawned.
+            _executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _list_files(source: Path) -> List[Tuple[Path, str]]:
+    """Lists every file under the source directory with its archive name, sorted by name."""
+    files = []
+    for root, _, file_names in os.walk(source, followlinks=True):
+        for file_name in file_names:
+            file_path = Path(root, file_name)
+            files.append((file_path, file_path.relative_to(source).as_posix()))
+    return sorted(files, key=lambda item: item[1])
+
+
+def _zip_info(archive_name: str, source_mode: int) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(archive_name, date_time=FIXED_DATE_TIME)
+    mode = EXECUTABLE_FILE_MODE if source_mode & stat.S_IXUSR else FILE_MODE
+    info.external_attr = (stat.S_IFREG | mode) << 16
+    info.compress_type = zipfile.ZIP_DEFLATED
+    # Record the archive as being created on Unix, no matter what platform this runs on, so the
+    # permissions are honored and the bytes are identical.
+    info.create_system = 3
+    return info
+
+
+def make_zip(source: Path, destination: Path) -> str:
+    """Creates a reproducible zip file of the source file or directory.
+
+    Identical inputs always produce byte-identical archives: entries are sorted, timestamps are
+    fixed and permissions are normalized. File contents are streamed into the archive, so memory
+    use doesn't grow with the size of the files.
+
+    Args:
+        source: The file or directory to zip. A single file is stored at the root of the archive.
+        destination: The path of the zip file to create
+
+    Returns:
+        The md5 hex digest of the zip file
+    """
+    files = [(source, source.name)] if source.is_file() else _list_files(source)
+    with zipfile.ZipFile(destination, "w") as archive:
+        for file_path, archive_name in files:
+            info = _zip_info(archive_name, file_path.stat().st_mode)
+            with file_path.open("rb") as source_file, archive.open(
+                info, "w", force_zip64=True
+            ) as archive_file:
+                shutil.copyfileobj(source_file, archive_file, COPY_BUFFER_SIZE)
+
+    md5 = hashlib.md5()
+    with destination.open("rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _make_zip_job(job: Tuple[str, str]) -> str:
+    source, destination = job
+    return make_zip(Path(source), Path(destination))
+
+
+def make_zips(
+    jobs: List[Tuple[Path, Path]], executor: Optional[Executor] = None
+) -> Dict[Path, str]:
+    """Creates several reproducible zip files in parallel.
+
+    Args:
+        jobs: The (source, destination) pairs to zip
+        executor: The executor to zip with. By default, a process pool shared by the whole process
+            is used so that compression can use every CPU.
+
+    Returns:
+        A dict mapping each destination to the md5 hex digest of its zip file
+    """
+    if not jobs:
+        return {}
+    if len(jobs) == 1:
+        # Not worth starting a process pool for a single archive
+        source, destination = jobs[0]
+        return {destination: make_zip(source, destination)}
+
+    executor = executor or _get_shared_executor()
+    digests = executor.map(
+        _make_zip_job,
+        [(str(source), str(destination)) for source, destination in jobs],
+    )
+    return {destination: digest for (_, destination), digest in zip(jobs, digests)}
@@ -32,7 +32,16 @@ setup(
     author=TEMPLATE_HANDLER_AUTHOR,
     license="Apache2",
     url=TEMPLATE_HANDLER_URL,
-    packages=find_packages(exclude=["*.tests", "*.tests.*", "tests.*", "tests"]),
+    packages=find_packages(
+        exclude=[
+            "*.tests",
+            "*.tests.*",
+            "tests.*",
+            "tests",
+            "benchmarks",
+            "benchmarks.*",
+        ]
+    ),
     entry_points={
         "sceptre.template_handlers": [
             f"{TEMPLATE_HANDLER_TYPE}={TEMPLATE_HANDLER_MODULE_NAME}:{TEMPLATE_HANDLER_CLASS}"
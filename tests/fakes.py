@@ -0,0 +1,120 @@
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+from typing import List, NamedTuple, Sequence
+
+from sam_handler.template import dump_template, iter_local_artifacts, load_template
+
+# aws-lambda-builders' PythonPipWorkflow.EXCLUDED_FILES, which `sam build` skips when copying the
+# sources of Python functions
+SAM_PYTHON_EXCLUDED_FILES = (
+    ".aws-sam",
+    ".chalice",
+    ".git",
+    ".gitignore",
+    "*.pyc",
+    "__pycache__",
+    "*.so",
+    ".Python",
+    "*.egg-info",
+    "*.egg",
+    "pip-log.txt",
+    "pip-delete-this-directory.txt",
+    "htmlcov",
+    ".tox",
+    ".nox",
+    ".coverage",
+    ".cache",
+    ".pytest_cache",
+    ".python-version",
+    ".mypy_cache",
+    ".dmypy.json",
+    ".pyre",
+    ".env",
+    ".venv",
+    "venv",
+    "venv.bak",
+    "env.bak",
+    "ENV",
+    "env",
+    ".vscode",
+    ".idea",
+)
+
+
+class FakeCommand(NamedTuple):
+    # The SAM command, like "build"
+    name: str
+    # The file name of the template the command was run on
+    template_name: str
+    # The resources the command was limited to
+    resources: List[str]
+
+
+class FakeInvoker:
+    """Runs SAM commands like SAM CLI would, without invoking it, recording every command.
+
+    `sam build` copies each function's code into a directory named after it (skipping the files
+    SAM's Python builder skips), "installs" its requirements next to it and writes the built template
+    referring to those directories; a template without resources is built as is. `sam package`
+    writes "packaged " followed by the built template as the packaged template.
+
+    The invoker can be passed as a SAM handler's invoker_class, since calling it returns itself.
+    """
+
+    def __init__(self):
+        self.commands: List[FakeCommand] = []
+        # Whether every command fails
+        self.fail = False
+        # The file names of the templates whose commands fail
+        self.failing_templates = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs) -> "FakeInvoker":
+        return self
+
+    def invoke(
+        self, command_name: str, args_dict: dict, positional_args: Sequence[str] = ()
+    ):
+        template_path = Path(args_dict["template-file"])
+        with self._lock:
+            self.commands.append(
+                FakeCommand(command_name, template_path.name, list(positional_args))
+            )
+        if self.fail or template_path.name in self.failing_templates:
+            raise subprocess.CalledProcessError(1, f"sam {command_name}")
+        if command_name == "build":
+            self._build(template_path, Path(args_dict["build-dir"]), positional_args)
+        else:
+            Path(args_dict["output-template-file"]).write_text(
+                f"packaged {template_path.read_text()}"
+            )
+
+    def _build(
+        self, template_path: Path, build_directory: Path, resources: Sequence[str]
+    ):
+        template = load_template(template_path.read_text())
+        shutil.rmtree(build_directory, ignore_errors=True)
+        build_directory.mkdir(parents=True)
+        if not isinstance(template, dict):
+            (build_directory / "template.yaml").write_text(template_path.read_text())
+            return
+
+        for artifact in iter_local_artifacts(template, template_path.parent):
+            if resources and artifact.logical_id not in resources:
+                continue
+            destination = build_directory / artifact.logical_id
+            shutil.copytree(
+                artifact.path,
+                destination,
+                ignore=shutil.ignore_patterns(*SAM_PYTHON_EXCLUDED_FILES),
+            )
+            requirements = artifact.path / "requirements.txt"
+            if requirements.exists():
+                package = destination / "package"
+                package.mkdir()
+                (package / "__init__.py").write_text(requirements.read_text())
+            properties = template["Resources"][artifact.logical_id]["Properties"]
+            properties[artifact.property_name] = artifact.logical_id
+        (build_directory / "template.yaml").write_text(dump_template(template))
@@ -0,0 +1,236 @@
+import json
+import subprocess
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import Mock, PropertyMock, patch
+
+from benchmarks.fake_sam import FakeConnectionManager
+from sam_handler.batch import (
+    DurationHistory,
+    SamBatch,
+    get_default_max_workers,
+    handle_stacks,
+)
+from sam_handler.handler import SAM
+from sam_handler.registry import BuildRegistry, ResultRegistry, TemplateMemo
+from tests.fakes import FakeInvoker
+
+
+class BatchTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+        self.invoker = FakeInvoker()
+        self.build_registry = BuildRegistry()
+        self.result_registry = ResultRegistry()
+        self.template_memo = TemplateMemo()
+        self.duration_history = DurationHistory(
+            self.directory / "durations.json", self.directory / "locks"
+        )
+
+    def create_handler(self, name: str, template_name: str = None) -> SAM:
+        template_path = self.directory / "project" / (template_name or f"{name}.yaml")
+        if not template_path.exists():
+            template_path.parent.mkdir(parents=True, exist_ok=True)
+            template_path.write_text(template_path.stem)
+        return SAM(
+            f"group/{name}",
+            arguments={
+                "path": str(template_path),
+                "artifact_bucket_name": "bucket",
+                "cache_dir": str(self.directory / "cache"),
+            },
+            connection_manager=FakeConnectionManager(),
+            stack_group_config={},
+            invoker_class=self.invoker,
+            get_temp_dir=lambda: str(self.directory / "temp"),
+            build_registry=self.build_registry,
+            result_registry=self.result_registry,
+            template_memo=self.template_memo,
+        )
+
+    @property
+    def commands(self) -> list:
+        """Returns each command run so far, with the file name of its template."""
+        return [
+            (command.name, command.template_name) for command in self.invoker.commands
+        ]
+
+    def run_batch(self, handlers, max_workers=4):
+        return SamBatch(
+            handlers,
+            max_workers=max_workers,
+            duration_history=self.duration_history,
+            result_registry=self.result_registry,
+        ).run()
+
+
+class TestSamBatch(BatchTestCase):
+    def test_run__returns_every_handled_template(self):
+        result = self.run_batch(
+            [self.create_handler("one"), self.create_handler("two")]
+        )
+
+        self.assertEqual(
+            {"group/one": "packaged one", "group/two": "packaged two"},
+            result.templates,
+        )
+        self.assertEqual({}, result.errors)
+
+    def test_run__primes_results__later_handle_does_not_invoke_sam(self):
+        self.run_batch([self.create_handler("one")])
+        self.invoker.commands.clear()
+
+        template = self.create_handler("one").handle()
+
+        self.assertEqual("packaged one", template)
+        self.assertEqual([], self.commands)
+
+    def test_run__primed_result_is_only_used_once(self):
+        self.run_batch([self.create_handler("one")])
+        self.create_handler("one").handle()
+        self.template_memo.clear()
+        self.invoker.commands.clear()
+
+        self.create_handler("one").handle()
+
+        # The build is shared within the process, but the template is packaged again.
+        self.assertEqual([("package", "template.yaml")], self.commands)
+
+    def test_run__handler_configured_differently__does_not_use_primed_result(self):
+        self.run_batch([self.create_handler("one")])
+        self.invoker.commands.clear()
+        handler = self.create_handler("one")
+        handler.arguments["artifact_prefix"] = "other"
+
+        handler.handle()
+
+        self.assertEqual([("package", "template.yaml")], self.commands)
+
+    def test_run__duplicate_stacks__handles_them_once(self):
+        self.run_batch([self.create_handler("one"), self.create_handler("one")])
+        self.assertEqual(
+            [("build", "one.yaml"), ("package", "template.yaml")], self.commands
+        )
+
+    def test_run__stacks_share_template__builds_once_and_packages_each(self):
+        handlers = [
+            self.create_handler(name, "shared.yaml") for name in ("a", "b", "c")
+        ]
+
+        result = self.run_batch(handlers)
+
+        self.assertEqual(3, len(result.templates))
+        self.assertEqual(
+            [("build", "shared.yaml")] + [("package", "template.yaml")] * 3,
+            self.commands,
+        )
+
+    def test_run__recorded_durations__builds_longest_first(self):
+        for name, duration in [("short", 1.0), ("long", 10.0), ("medium", 5.0)]:
+            self.duration_history.record(f"group/{name}", duration)
+        handlers = [
+            self.create_handler(name) for name in ("short", "new", "medium", "long")
+        ]
+
+        self.run_batch(handlers, max_workers=1)
+
+        self.assertEqual(
+            ["new.yaml", "long.yaml", "medium.yaml", "short.yaml"],
+            [template for command, template in self.commands if command == "build"],
+        )
+
+    def test_run__records_durations(self):
+        self.run_batch([self.create_handler("one")])
+
+        durations = json.loads((self.directory / "durations.json").read_text())
+
+        self.assertEqual(["group/one"], list(durations))
+
+    def test_run__stack_fails__records_error_and_handles_the_rest(self):
+        self.invoker.failing_templates.add("bad.yaml")
+
+        result = self.run_batch(
+            [self.create_handler("bad"), self.create_handler("good")]
+        )
+
+        self.assertEqual(["group/good"], list(result.templates))
+        self.assertIsInstance(result.errors["group/bad"], subprocess.CalledProcessError)
+        self.assertIsNone(
+            self.result_registry.take(self.create_handler("bad").handle_key)
+        )
+
+    def test_run__no_handlers__returns_empty_result(self):
+        result = SamBatch([], result_registry=self.result_registry).run()
+        self.assertEqual(({}, {}), result)
+
+
+class TestHandleStacks(BatchTestCase):
+    def test_handle_stacks__handles_only_sam_stacks(self):
+        handler = self.create_handler("one")
+        sam_stack = Mock(
+            template_handler_config={"type": "sam", **handler.arguments},
+            sceptre_user_data={},
+            connection_manager=FakeConnectionManager(),
+            stack_group_config={},
+        )
+        sam_stack.name = handler.name
+        other_stack = Mock(template_handler_config={"type": "file", "path": "x.yaml"})
+
+        with patch(
+            "sam_handler.batch.SAM", wraps=lambda **kwargs: handler
+        ) as sam_class:
+            result = handle_stacks(
+                [sam_stack, other_stack],
+                duration_history=self.duration_history,
+                result_registry=self.result_registry,
+            )
+
+        self.assertEqual(["group/one"], list(result.templates))
+        self.assertEqual(handler.arguments, sam_class.call_args.kwargs["arguments"])
+
+    def test_handle_stacks__resolver_fails__skips_stack(self):
+        handler = self.create_handler("one")
+        sam_stack = Mock(
+            template_handler_config={"type": "sam", **handler.arguments},
+            sceptre_user_data={},
+            connection_manager=FakeConnectionManager(),
+            stack_group_config={},
+        )
+        sam_stack.name = handler.name
+        unresolvable_stack = Mock(
+            template_handler_config={"type": "sam", **handler.arguments}
+        )
+        unresolvable_stack.name = "group/two"
+        type(unresolvable_stack).sceptre_user_data = PropertyMock(
+            side_effect=Exception("Stack group/dependency does not exist")
+        )
+
+        with patch("sam_handler.batch.SAM", wraps=lambda **kwargs: handler):
+            result = handle_stacks(
+                [sam_stack, unresolvable_stack],
+                duration_history=self.duration_history,
+                result_registry=self.result_registry,
+            )
+
+        self.assertEqual(["group/one"], list(result.templates))
+
+
+class TestGetDefaultMaxWorkers(TestCase):
+    @patch("os.cpu_count", return_value=8)
+    def test_get_default_max_workers__little_memory__bounded_by_memory(self, _):
+        with patch("sam_handler.batch.get_available_memory", return_value=3 * 1024):
+            self.assertEqual(3, get_default_max_workers(memory_per_build=1024))
+
+    @patch("os.cpu_count", return_value=8)
+    def test_get_default_max_workers__plenty_of_memory__one_per_cpu(self, _):
+        with patch("sam_handler.batch.get_available_memory", return_value=None):
+            self.assertEqual(8, get_default_max_workers())
+
+    @patch("os.cpu_count", return_value=8)
+    def test_get_default_max_workers__no_memory__returns_one(self, _):
+        with patch("sam_handler.batch.get_available_memory", return_value=0):
+            self.assertEqual(1, get_default_max_workers())
@@ -0,0 +1,88 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from benchmarks.project import ProjectSpec
+from benchmarks.runner import (
+    Scenario,
+    ScenarioRunner,
+    calibrate,
+    compare,
+    run_scenario,
+)
+from sam_handler.template import load_template
+
+
+class TestScenarioRunner(TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+
+    def handle(self, scenario: Scenario) -> dict:
+        return load_template(ScenarioRunner(scenario, self.directory).handle())
+
+    def test_handle__packages_every_artifact(self):
+        template = self.handle(Scenario("test", ProjectSpec(functions=2, layers=1)))
+
+        resources = template["Resources"]
+        self.assertEqual({"Function0", "Function1", "Layer0"}, set(resources))
+        for resource in resources.values():
+            uri = resource["Properties"].get("CodeUri") or resource["Properties"].get(
+                "ContentUri"
+            )
+            self.assertTrue(uri.startswith("s3://bucket/"))
+
+    def test_handle__jinja_template__renders_same_resources_as_plain_template(self):
+        plain = self.handle(Scenario("plain", ProjectSpec(functions=2)))
+        jinja = self.handle(Scenario("jinja", ProjectSpec(functions=2, jinja=True)))
+
+        self.assertEqual(plain["Resources"], jinja["Resources"])
+
+    def test_run_scenario__reports_metrics(self):
+        result = run_scenario(
+            Scenario("test", ProjectSpec(functions=1)), iterations=2, warmup=0
+        )
+
+        self.assertEqual(
+            {"throughput", "p50", "p90", "p99", "peak_memory"}, set(result)
+        )
+
+
+class TestCompare(TestCase):
+    def test_compare__slower_than_threshold__reports_regression(self):
+        baseline = {"scenario": {"relative_p50": 1.0, "peak_memory": 100}}
+        results = {"scenario": {"relative_p50": 1.5, "peak_memory": 100}}
+
+        [regression] = compare(
+            results, baseline, {"relative_p50": 0.25, "peak_memory": 0.25}
+        )
+
+        self.assertIn("scenario: relative_p50", regression)
+
+    def test_compare__within_threshold__reports_nothing(self):
+        baseline = {"scenario": {"relative_p50": 1.0, "peak_memory": 100}}
+        results = {"scenario": {"relative_p50": 1.2, "peak_memory": 110}, "new": {}}
+
+        self.assertEqual(
+            [],
+            compare(results, baseline, {"relative_p50": 0.25, "peak_memory": 0.25}),
+        )
+
+    def test_compare__metric_not_compared__reports_nothing(self):
+        baseline = {"scenario": {"relative_p50": 1.0, "peak_memory": 100}}
+        results = {"scenario": {"relative_p50": 3.0, "peak_memory": 100}}
+
+        self.assertEqual([], compare(results, baseline, {"peak_memory": 0.25}))
+
+    def test_compare__metric_missing_from_baseline__reports_nothing(self):
+        baseline = {"scenario": {"p50": 1.0, "peak_memory": 100}}
+        results = {"scenario": {"relative_p50": 3.0, "peak_memory": 100}}
+
+        self.assertEqual([], compare(results, baseline, {"relative_p50": 0.25}))
+
+
+class TestCalibrate(TestCase):
+    def test_calibrate__returns_positive_time(self):
+        self.assertGreater(calibrate(repeats=1), 0)
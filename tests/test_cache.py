@@ -0,0 +1,197 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from pyfakefs.fake_filesystem_unittest import TestCase as FsTestCase
+
+from sam_handler.cache import (
+    SamBuildCache,
+    TemplateCache,
+    hash_path,
+    hash_values,
+    prune_entries,
+)
+from sam_handler.locking import FileLock
+
+
+class TestHashing(FsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.setUpPyfakefs()
+        self.fs.create_file("/code/app.py", contents="print('hi')")
+        self.fs.create_file("/code/lib/util.py", contents="x = 1")
+
+    def test_hash_path__same_contents__same_digest(self):
+        self.fs.create_file("/other/app.py", contents="print('hi')")
+        self.fs.create_file("/other/lib/util.py", contents="x = 1")
+        self.assertEqual(hash_path(Path("/code")), hash_path(Path("/other")))
+
+    def test_hash_path__file_contents_changed__digest_changes(self):
+        before = hash_path(Path("/code"))
+        Path("/code/lib/util.py").write_text("x = 2")
+        self.assertNotEqual(before, hash_path(Path("/code")))
+
+    def test_hash_path__file_renamed__digest_changes(self):
+        before = hash_path(Path("/code"))
+        Path("/code/lib/util.py").rename("/code/lib/other.py")
+        self.assertNotEqual(before, hash_path(Path("/code")))
+
+    def test_hash_path__ignores_build_directories(self):
+        before = hash_path(Path("/code"))
+        self.fs.create_file("/code/.aws-sam/build/template.yaml", contents="built")
+        self.assertEqual(before, hash_path(Path("/code")))
+
+    def test_hash_values__ignores_dict_ordering(self):
+        self.assertEqual(hash_values({"a": 1, "b": 2}), hash_values({"b": 2, "a": 1}))
+
+
+class TestTemplateCache(FsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.setUpPyfakefs()
+        self.directory = Path("/cache/templates")
+        self.cache = TemplateCache(self.directory, max_size=10)
+
+    def test_get__no_entry__returns_none(self):
+        self.assertIsNone(self.cache.get("missing"))
+
+    def test_put__then_get__returns_body(self):
+        self.cache.put("key", "body")
+        self.assertEqual("body", self.cache.get("key"))
+
+    def test_put__over_max_size__evicts_least_recently_used(self):
+        self.cache.put("old", "12345")
+        self.cache.put("used", "12345")
+        os.utime(self.directory / "old.yaml", (1, 1))
+        os.utime(self.directory / "used.yaml", (2, 2))
+        self.cache.get("used")
+
+        self.cache.put("new", "12345")
+
+        self.assertIsNone(self.cache.get("old"))
+        self.assertEqual("12345", self.cache.get("used"))
+        self.assertEqual("12345", self.cache.get("new"))
+
+    def test_invalidate__removes_entry(self):
+        self.cache.put("key", "body")
+        self.cache.invalidate("key")
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_clear__removes_all_entries(self):
+        self.cache.put("one", "1")
+        self.cache.put("two", "2")
+        self.cache.clear()
+        self.assertEqual([], list(self.directory.iterdir()))
+
+
+class TestPruneEntries(FsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.setUpPyfakefs()
+
+    def test_prune_entries__removes_entries_older_than_max_age(self):
+        old = Path(self.fs.create_file("/entries/old", contents="x").path)
+        new = Path(self.fs.create_file("/entries/new", contents="x").path)
+        os.utime(old, (time.time() - 100, time.time() - 100))
+
+        removed = prune_entries([old, new], max_age=50)
+
+        self.assertEqual(1, removed)
+        self.assertFalse(old.exists())
+        self.assertTrue(new.exists())
+
+    def test_prune_entries__directory_entries__removes_them_by_total_size(self):
+        old = Path(self.fs.create_dir("/entries/old").path)
+        self.fs.create_file("/entries/old/a", contents="12345")
+        self.fs.create_file("/entries/old/b/c", contents="12345")
+        new = Path(self.fs.create_dir("/entries/new").path)
+        self.fs.create_file("/entries/new/a", contents="12345")
+        os.utime(old, (1, 1))
+
+        removed = prune_entries([old, new], max_size=5)
+
+        self.assertEqual(1, removed)
+        self.assertFalse(old.exists())
+        self.assertTrue(new.exists())
+
+
+class TestSamBuildCache(TestCase):
+    # Real files, since the build caches are guarded by OS-level file locks
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+        self.lock_directory = self.directory / "locks"
+        self.cache = SamBuildCache(
+            self.directory / "sam-build", self.lock_directory, max_size=10
+        )
+
+    def create_cache(self, name: str, size: int, last_used: float) -> Path:
+        directory = self.cache.get_directory(Path(name))
+        (directory / "entry").write_text("x" * size)
+        os.utime(directory, (last_used, last_used))
+        return directory
+
+    def test_get_directory__same_template__returns_same_directory(self):
+        first = self.cache.get_directory(Path("project/template.yaml"))
+        second = self.cache.get_directory(Path("project/template.yaml").absolute())
+        other = self.cache.get_directory(Path("other/template.yaml"))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertTrue(first.is_dir())
+
+    def test_prune__too_big__evicts_least_recently_used(self):
+        old = self.create_cache("old.yaml", 8, time.time() - 10)
+        new = self.create_cache("new.yaml", 8, time.time())
+
+        self.assertEqual(1, self.cache.prune())
+
+        self.assertFalse(old.exists())
+        self.assertTrue(new.exists())
+
+    def test_prune__unused_for_too_long__evicts_cache(self):
+        self.cache.max_age_days = 1
+        old = self.create_cache("old.yaml", 1, time.time() - 2 * 24 * 60 * 60)
+        new = self.create_cache("new.yaml", 1, time.time())
+
+        self.cache.prune()
+
+        self.assertFalse(old.exists())
+        self.assertTrue(new.exists())
+
+    def test_prune__cache_in_use__keeps_it(self):
+        old = self.create_cache("old.yaml", 8, time.time() - 10)
+        self.create_cache("new.yaml", 8, time.time())
+
+        with FileLock.for_resource(old, self.lock_directory):
+            self.cache.prune()
+
+        self.assertTrue(old.exists())
+
+    def test_prune__pruned_recently__does_nothing(self):
+        self.cache.prune()
+        old = self.create_cache("old.yaml", 8, time.time() - 10)
+        self.create_cache("new.yaml", 8, time.time())
+
+        self.assertEqual(0, self.cache.prune())
+        self.assertTrue(old.exists())
+        self.assertEqual(1, self.cache.prune(force=True))
+
+    def test_clear__removes_every_cache(self):
+        self.create_cache("first.yaml", 1, time.time())
+        self.create_cache("second.yaml", 1, time.time())
+
+        self.assertEqual(2, self.cache.clear())
+
+        self.assertEqual(
+            (
+                [SamBuildCache.PRUNE_MARKER_NAME]
+                if (self.cache.directory / SamBuildCache.PRUNE_MARKER_NAME).exists()
+                else []
+            ),
+            [path.name for path in self.cache.directory.iterdir()],
+        )
@@ -0,0 +1,217 @@
+import io
+import tarfile
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from benchmarks.fake_sam import FakeS3Client
+from sam_handler.dependencies import (
+    LocalDependencyStore,
+    S3DependencyStore,
+    copy_sources,
+    get_dependency_key,
+    list_dependency_paths,
+)
+
+
+class DependencyTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+        self.code_directory = self.directory / "src"
+        self.built_directory = self.directory / "build" / "Fn"
+
+    def write(self, path: Path, contents: str = "") -> Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+        return path
+
+
+class TestGetDependencyKey(DependencyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write(self.code_directory / "app.py")
+        self.requirements = self.write(
+            self.code_directory / "requirements.txt", "requests"
+        )
+
+    def get_key(self, runtime="python3.11", architecture="x86_64", use_container=False):
+        return get_dependency_key(
+            runtime, architecture, self.code_directory, use_container
+        )
+
+    def test_get_dependency_key__same_manifest_elsewhere__returns_same_key(self):
+        other_directory = self.directory / "other"
+        self.write(other_directory / "requirements.txt", "requests")
+
+        self.assertEqual(
+            self.get_key(),
+            get_dependency_key("python3.11", "x86_64", other_directory, False),
+        )
+
+    def test_get_dependency_key__source_changed__returns_same_key(self):
+        key = self.get_key()
+        self.write(self.code_directory / "app.py", "changed")
+        self.assertEqual(key, self.get_key())
+
+    def test_get_dependency_key__manifest_changed__returns_new_key(self):
+        key = self.get_key()
+        self.requirements.write_text("boto3")
+        self.assertNotEqual(key, self.get_key())
+
+    def test_get_dependency_key__runtime_architecture_or_container_changed__returns_new_keys(
+        self,
+    ):
+        keys = {
+            self.get_key(),
+            self.get_key(runtime="python3.12"),
+            self.get_key(architecture="arm64"),
+            self.get_key(use_container=True),
+        }
+        self.assertEqual(4, len(keys))
+
+    def test_get_dependency_key__no_manifest__returns_none(self):
+        self.requirements.unlink()
+        self.assertIsNone(self.get_key())
+
+    def test_get_dependency_key__unsupported_runtime__returns_none(self):
+        self.assertIsNone(self.get_key(runtime="java17"))
+
+    def test_get_dependency_key__nodejs_runtime__returns_none(self):
+        self.write(self.code_directory / "package.json", '{"name": "fn"}')
+        self.assertIsNone(self.get_key(runtime="nodejs20.x"))
+
+
+class TestBuildOutput(DependencyTestCase):
+    def test_list_dependency_paths__python__lists_entries_not_in_source(self):
+        self.write(self.code_directory / "app.py")
+        self.write(self.built_directory / "app.py")
+        self.write(self.built_directory / "requests" / "__init__.py")
+        self.write(self.built_directory / "requests-2.0.dist-info" / "METADATA")
+
+        self.assertEqual(
+            ["requests", "requests-2.0.dist-info"],
+            list_dependency_paths(
+                "python3.11", self.code_directory, self.built_directory
+            ),
+        )
+
+    def test_copy_sources__skips_excluded_files(self):
+        self.write(self.code_directory / "app.py")
+        self.write(self.code_directory / "__pycache__" / "app.cpython-311.pyc")
+        self.write(self.code_directory / "module.pyc")
+        self.write(self.code_directory / ".env", "SECRET=1")
+        self.write(self.code_directory / "env" / "bin" / "python")
+        self.write(self.code_directory / "lib" / "native.so")
+        self.write(self.code_directory / "lib" / "util.py")
+        self.write(self.code_directory / ".vscode" / "settings.json")
+
+        copy_sources("python3.11", self.code_directory, self.built_directory)
+
+        self.assertEqual(
+            ["app.py", "lib/util.py"],
+            sorted(
+                path.relative_to(self.built_directory).as_posix()
+                for path in self.built_directory.rglob("*")
+                if path.is_file()
+            ),
+        )
+
+
+class TestLocalDependencyStore(DependencyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = LocalDependencyStore(self.directory / "store")
+        self.write(self.built_directory / "app.py")
+        self.write(self.built_directory / "requests" / "__init__.py", "requests")
+
+    def test_restore__published_entry__extracts_dependencies(self):
+        self.store.publish("key", self.built_directory, ["requests"])
+        destination = self.directory / "restored"
+
+        self.assertTrue(self.store.restore("key", destination))
+
+        self.assertEqual(
+            "requests", (destination / "requests" / "__init__.py").read_text()
+        )
+        self.assertFalse((destination / "app.py").exists())
+
+    def test_restore__no_entry__returns_false(self):
+        self.assertFalse(self.store.restore("key", self.directory / "restored"))
+
+    def test_contains__published_entry__returns_true(self):
+        self.store.publish("key", self.built_directory, ["requests"])
+        self.assertTrue(self.store.contains("key"))
+        self.assertFalse(self.store.contains("other"))
+
+    def test_publish__store_too_big__evicts_entries(self):
+        self.store.max_size = 1
+        self.store.publish("first", self.built_directory, ["requests"])
+        self.store.publish("second", self.built_directory, ["requests"])
+
+        self.assertEqual([], list(self.store.directory.glob("*.tar.gz")))
+
+    def test_restore__unsafe_archive__raises_error(self):
+        self.store.directory.mkdir()
+        with tarfile.open(self.store.directory / "key.tar.gz", "w:gz") as archive:
+            info = tarfile.TarInfo("../escaped")
+            archive.addfile(info, io.BytesIO())
+
+        with self.assertRaises(tarfile.TarError):
+            self.store.restore("key", self.directory / "restored")
+        self.assertFalse((self.directory / "escaped").exists())
+
+
+class TestS3DependencyStore(DependencyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.s3_client = FakeS3Client()
+        self.store = S3DependencyStore(self.s3_client, "bucket", "deps/")
+        self.write(self.built_directory / "requests" / "__init__.py", "requests")
+
+    def test_restore__published_entry__extracts_dependencies(self):
+        self.store.publish("key", self.built_directory, ["requests"])
+        destination = self.directory / "restored"
+
+        self.assertTrue(self.store.restore("key", destination))
+
+        self.assertEqual(
+            "requests", (destination / "requests" / "__init__.py").read_text()
+        )
+        self.assertIn(("bucket", "deps/key.tar.gz"), self.s3_client.objects)
+
+    def test_restore__no_entry__returns_false(self):
+        self.assertFalse(self.store.restore("key", self.directory / "restored"))
+        self.assertFalse(self.store.contains("key"))
+
+    def test_publish__store_too_big__evicts_oldest_entries(self):
+        self.store.publish("first", self.built_directory, ["requests"])
+        self.store.max_size = len(
+            self.s3_client.objects[("bucket", "deps/first.tar.gz")]
+        )
+
+        self.store.publish("second", self.built_directory, ["requests"])
+
+        self.assertEqual(
+            [("bucket", "deps/second.tar.gz")], list(self.s3_client.objects)
+        )
+
+    def test_publish__no_prefix__stores_entries_at_bucket_root(self):
+        store = S3DependencyStore(self.s3_client, "bucket", "")
+
+        store.publish("key", self.built_directory, ["requests"])
+
+        self.assertTrue(store.contains("key"))
+        self.assertEqual([("bucket", "key.tar.gz")], list(self.s3_client.objects))
+
+    def test_publish__no_prefix__only_evicts_entries(self):
+        self.s3_client.objects[("bucket", "artifacts/app.zip")] = b"x" * 1024
+        store = S3DependencyStore(self.s3_client, "bucket", "", max_size=0)
+
+        store.publish("key", self.built_directory, ["requests"])
+
+        self.assertEqual(
+            [("bucket", "artifacts/app.zip")], list(self.s3_client.objects)
+        )
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sceptre.connection_manager import ConnectionManager
+
+from sam_handler.environment import SessionEnvironmentCache
+
+
+class TestSessionEnvironmentCache(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 1000.0
+        self.cache = SessionEnvironmentCache(
+            ttl=60, refresh_margin=10, clock=lambda: self.now
+        )
+        self.connection_manager = self.create_connection_manager()
+
+    def create_connection_manager(self, **attributes):
+        connection_manager = Mock(
+            **{
+                "spec": ConnectionManager,
+                "profile": "profile",
+                "region": "region",
+                "sceptre_role": "role",
+                "_boto_session_expirations": {},
+                **attributes,
+            }
+        )
+        connection_manager.create_session_environment_variables.side_effect = lambda: {
+            "AWS_ACCESS_KEY_ID": f"key-{self.now}"
+        }
+        return connection_manager
+
+    def test_get__returns_session_environment_variables(self):
+        self.assertEqual(
+            {"AWS_ACCESS_KEY_ID": "key-1000.0"}, self.cache.get(self.connection_manager)
+        )
+
+    def test_get__same_session_from_other_connection_manager__reuses_variables(self):
+        self.cache.get(self.connection_manager)
+        other = self.create_connection_manager()
+
+        self.cache.get(other)
+
+        other.create_session_environment_variables.assert_not_called()
+
+    def test_get__different_region__creates_variables(self):
+        self.cache.get(self.connection_manager)
+        other = self.create_connection_manager(region="other")
+
+        self.cache.get(other)
+
+        other.create_session_environment_variables.assert_called_once()
+
+    def test_get__after_ttl__refreshes_variables(self):
+        self.cache.get(self.connection_manager)
+        self.now += 61
+        self.assertEqual(
+            {"AWS_ACCESS_KEY_ID": "key-1061.0"}, self.cache.get(self.connection_manager)
+        )
+
+    def test_get__known_expiration__refreshes_shortly_before_it(self):
+        expiration = datetime.fromtimestamp(1500, tz=timezone.utc)
+        self.connection_manager._boto_session_expirations = {
+            ("region", "profile", "role"): expiration
+        }
+        self.cache.get(self.connection_manager)
+
+        self.now = 1489
+        self.cache.get(self.connection_manager)
+        self.now = 1490
+        self.cache.get(self.connection_manager)
+
+        self.assertEqual(
+            2, self.connection_manager.create_session_environment_variables.call_count
+        )
+
+    def test_get__returns_copy(self):
+        self.cache.get(self.connection_manager)["AWS_ACCESS_KEY_ID"] = "changed"
+        self.assertEqual(
+            {"AWS_ACCESS_KEY_ID": "key-1000.0"}, self.cache.get(self.connection_manager)
+        )
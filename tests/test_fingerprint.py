@@ -0,0 +1,165 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from sam_handler.cache import hash_path
+from sam_handler.fingerprint import Fingerprinter, hash_file, stat_fingerprint
+
+
+class TestFingerprinter(TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+        self.code = self.directory / "code"
+        self.write("app.py", "print('hi')")
+        self.write("lib/util.py", "x = 1")
+        self.index_path = self.directory / "cache" / "fingerprints.json"
+        self.lock_directory = self.directory / "locks"
+
+    def write(self, name: str, contents: str):
+        path = self.code / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+        # Files modified within the racy window aren't indexed, so they are backdated.
+        mtime = time.time_ns() - 10 * 1000**3 + len(contents)
+        os.utime(path, ns=(mtime, mtime))
+
+    def create_fingerprinter(self, **kwargs) -> Fingerprinter:
+        return Fingerprinter(self.index_path, self.lock_directory, **kwargs)
+
+    def test_fingerprint__new_files__hashes_each(self):
+        result = self.create_fingerprinter().fingerprint(self.code)
+        self.assertEqual((2, 2), (result.scanned, result.rehashed))
+
+    def test_fingerprint__unchanged__does_not_hash_again(self):
+        fingerprinter = self.create_fingerprinter()
+        first = fingerprinter.fingerprint(self.code)
+
+        second = fingerprinter.fingerprint(self.code)
+
+        self.assertEqual((first.digest, 2, 0), second)
+        self.assertEqual((4, 2), (fingerprinter.scanned, fingerprinter.rehashed))
+
+    def test_fingerprint__file_changed__hashes_only_that_file(self):
+        fingerprinter = self.create_fingerprinter()
+        first = fingerprinter.fingerprint(self.code)
+        self.write("lib/util.py", "x = 22")
+
+        second = fingerprinter.fingerprint(self.code)
+
+        self.assertNotEqual(first.digest, second.digest)
+        self.assertEqual(1, second.rehashed)
+
+    def test_fingerprint__file_renamed__digest_changes(self):
+        fingerprinter = self.create_fingerprinter()
+        before = fingerprinter.fingerprint(self.code).digest
+        (self.code / "lib/util.py").rename(self.code / "lib/other.py")
+        self.assertNotEqual(before, fingerprinter.fingerprint(self.code).digest)
+
+    def test_fingerprint__recently_modified_file__is_not_indexed(self):
+        fingerprinter = self.create_fingerprinter()
+        (self.code / "app.py").write_text("print('new')")
+        fingerprinter.fingerprint(self.code)
+
+        result = fingerprinter.fingerprint(self.code)
+
+        self.assertEqual(1, result.rehashed)
+
+    def test_fingerprint__ignore_patterns__skips_matching_names(self):
+        fingerprinter = self.create_fingerprinter()
+        before = fingerprinter.fingerprint(self.code, ["node_modules", "*.pyc"])
+        self.write("node_modules/dep/index.js", "module.exports = 1")
+        self.write("app.pyc", "compiled")
+
+        after = fingerprinter.fingerprint(self.code, ["node_modules", "*.pyc"])
+
+        self.assertEqual((before.digest, 2), (after.digest, after.scanned))
+
+    def test_fingerprint__file__returns_digest_of_contents(self):
+        path = self.code / "app.py"
+        result = self.create_fingerprinter().fingerprint(path)
+        self.assertEqual((hash_path(path), 1, 1), result)
+
+    def test_fingerprint__missing_path__returns_empty_digest(self):
+        result = self.create_fingerprinter().fingerprint(self.directory / "missing")
+        self.assertEqual((0, 0), (result.scanned, result.rehashed))
+
+    def test_save__index_is_used_by_other_fingerprinters(self):
+        fingerprinter = self.create_fingerprinter()
+        digest = fingerprinter.fingerprint(self.code).digest
+        fingerprinter.save()
+
+        result = self.create_fingerprinter().fingerprint(self.code)
+
+        self.assertEqual((digest, 2, 0), result)
+
+    def test_save__keeps_entries_saved_by_others_in_the_meantime(self):
+        first = self.create_fingerprinter()
+        second = self.create_fingerprinter()
+        first.fingerprint(self.code / "app.py")
+        second.fingerprint(self.code / "lib")
+        first.save()
+        second.save()
+
+        result = self.create_fingerprinter().fingerprint(self.code)
+
+        self.assertEqual(0, result.rehashed)
+
+    def test_save__no_index_path__does_nothing(self):
+        fingerprinter = Fingerprinter()
+        fingerprinter.fingerprint(self.code)
+        fingerprinter.save()
+        self.assertFalse(self.index_path.exists())
+
+
+class TestStatFingerprint(TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+        self.code = self.directory / "code"
+        (self.code / "lib").mkdir(parents=True)
+        (self.code / "app.py").write_text("print('hi')")
+        (self.code / "lib" / "util.py").write_text("x = 1")
+
+    def test_stat_fingerprint__unchanged__same_digest(self):
+        paths = [self.code, self.directory / "template.yaml"]
+        self.assertEqual(stat_fingerprint(paths), stat_fingerprint(paths))
+
+    def test_stat_fingerprint__file_modified__digest_changes(self):
+        before = stat_fingerprint([self.code])
+        os.utime(self.code / "lib" / "util.py", ns=(1, 1))
+        self.assertNotEqual(before, stat_fingerprint([self.code]))
+
+    def test_stat_fingerprint__missing_path_created__digest_changes(self):
+        path = self.code / "new.py"
+        before = stat_fingerprint([path])
+        path.write_text("")
+        self.assertNotEqual(before, stat_fingerprint([path]))
+
+    def test_stat_fingerprint__ignores_build_directories(self):
+        before = stat_fingerprint([self.code])
+        (self.code / ".aws-sam").mkdir()
+        (self.code / ".aws-sam" / "template.yaml").write_text("built")
+        self.assertEqual(before, stat_fingerprint([self.code]))
+
+    def test_stat_fingerprint__ignore_patterns__skips_matching_files(self):
+        before = stat_fingerprint([self.code], ["*.log"])
+        (self.code / "debug.log").write_text("log")
+        self.assertEqual(before, stat_fingerprint([self.code], ["*.log"]))
+        self.assertNotEqual(before, stat_fingerprint([self.code]))
+
+
+class TestHashFile(TestCase):
+    def test_hash_file__large_file__same_digest_as_reading_it(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory, "large.bin")
+            path.write_bytes(os.urandom(4096))
+            with patch("sam_handler.fingerprint.MMAP_THRESHOLD", 1024):
+                self.assertEqual(hash_path(path), hash_file(path, 4096))
@@ -1,16 +1,38 @@
+import io
+import json
+import os
 import subprocess
-import sys
 from pathlib import Path
 from unittest import TestCase
-from unittest.mock import Mock, create_autospec
+from unittest.mock import ANY, Mock, create_autospec, patch
 
 from botocore.credentials import Credentials
 from pyfakefs.fake_filesystem_unittest import TestCase as FsTestCase
 from sceptre.connection_manager import ConnectionManager
-from sceptre.exceptions import UnsupportedTemplateFileTypeError
+from sceptre.exceptions import (
+    TemplateHandlerArgumentsInvalidError,
+    UnsupportedTemplateFileTypeError,
+)
 from sceptre.template_handlers import helper
 
-from sam_handler.handler import SAM, SamInvoker
+from sam_handler.cache import hash_values
+from sam_handler.dependencies import LocalDependencyStore, S3DependencyStore
+from sam_handler.environment import SessionEnvironmentCache
+from sam_handler.fingerprint import Fingerprinter
+from sam_handler.handler import (
+    SAM,
+    SamInvoker,
+    SamWorkerInvoker,
+    get_sam_executable,
+)
+from sam_handler.limiter import ConcurrencyLimiter
+from sam_handler.output import SamCommandError
+from sam_handler.packager import NativePackager, get_s3_client
+from sam_handler.registry import BuildRegistry, ResultRegistry, TemplateMemo
+from sam_handler.rendering import RenderCache
+from sam_handler.template import TaggedValue, load_template
+from sam_handler.timing import Tracer
+from sam_handler.worker import SamWorkerPool, WorkerUnavailableError
 
 
 class TestSAM(FsTestCase):
@@ -31,6 +53,8 @@ class TestSAM(FsTestCase):
         self.invoker_class = create_autospec(SamInvoker, return_value=self.invoker)
         self.temp_dir = "/temp"
         self.get_temp_dir = lambda: self.temp_dir
+        self.cache_dir = "/cache"
+        self.get_cache_dir = lambda: self.cache_dir
         self.render_jinja_template: Mock = create_autospec(
             helper.render_jinja_template, return_value=self.processed_contents
         )
@@ -46,7 +70,31 @@ class TestSAM(FsTestCase):
         self.name = "top/mid/stack"
         self.sceptre_user_data = {"user": "data"}
         self.stack_group_config = {"j2_environment": "blah"}
-        self.handler = SAM(
+        self.build_registry = BuildRegistry()
+        self.result_registry = ResultRegistry()
+        self.render_cache = RenderCache()
+        self.template_memo = TemplateMemo()
+        self.packager = Mock(spec=NativePackager)
+        self.packager.package.side_effect = (
+            lambda template_path, output_path: output_path.write_text(
+                self.processed_contents
+            )
+        )
+        self.packager_class = Mock(
+            return_value=self.packager,
+            DEFAULT_MAX_WORKERS=NativePackager.DEFAULT_MAX_WORKERS,
+        )
+        self.s3_client = Mock()
+        self.get_s3_client = create_autospec(get_s3_client, return_value=self.s3_client)
+        self.fingerprinter = Fingerprinter()
+        self.spans = []
+        self.fake_build_output = False
+        self.handler = self.create_handler()
+        self._is_built = False
+        self.build_dir = Path(self.temp_dir, "top/mid/stack.aws-sam/build")
+
+    def create_handler(self):
+        return SAM(
             self.name,
             connection_manager=self.connection_manager,
             arguments=self.arguments,
@@ -54,14 +102,30 @@ class TestSAM(FsTestCase):
             stack_group_config=self.stack_group_config,
             invoker_class=self.invoker_class,
             get_temp_dir=self.get_temp_dir,
+            get_cache_dir=self.get_cache_dir,
             render_jinja_template=self.render_jinja_template,
+            build_registry=self.build_registry,
+            result_registry=self.result_registry,
+            render_cache=self.render_cache,
+            template_memo=self.template_memo,
+            packager_class=self.packager_class,
+            get_s3_client=self.get_s3_client,
+            get_fingerprinter=lambda index_path, lock_directory: self.fingerprinter,
+            timing_sinks=[self.spans.append],
         )
-        self._is_built = False
+
+    def get_sam_cache_dir(self) -> Path:
+        template_path = Path(self.arguments["path"]).absolute()
+        return Path(self.cache_dir, "sam-build", hash_values(str(template_path)))
 
     def fake_invoke(self, command, args):
         if command == "build":
             self._is_built = True
             self.assertTrue(Path(args["template-file"]).exists())
+            if self.fake_build_output:
+                build_dir = Path(args["build-dir"])
+                build_dir.mkdir(parents=True, exist_ok=True)
+                (build_dir / "template.yaml").write_text(self.template_contents)
         elif command == "package":
             self.assertTrue(self._is_built)
             output_file = Path(args["output-template-file"])
@@ -70,7 +134,23 @@ class TestSAM(FsTestCase):
     def test_handle__instantiates_invoker_with_correct_args(self):
         self.handler.handle()
         self.invoker_class.assert_called_with(
-            self.connection_manager, Path(self.arguments["path"]).parent.absolute()
+            self.connection_manager,
+            Path(self.arguments["path"]).parent.absolute(),
+            tracer=self.handler.tracer,
+            limiter=None,
+            output_prefix="[top/mid/stack] ",
+        )
+
+    def test_handle__max_concurrent_commands_set__passes_limiter_to_invoker(self):
+        self.arguments["max_concurrent_commands"] = 2
+        self.arguments["min_available_memory"] = 1024
+
+        self.handler.handle()
+
+        limiter = self.invoker_class.call_args.kwargs["limiter"]
+        self.assertEqual(
+            (Path(self.temp_dir, "sceptre-sam-handler-locks", "sam-slots"), 2, 1024),
+            (limiter.directory, limiter.max_concurrent, limiter.min_available_memory),
         )
 
     def test_handle__invokes_build_with_default_arguments(self):
@@ -79,7 +159,10 @@ class TestSAM(FsTestCase):
             "build",
             {
                 "cached": True,
+                "parallel": True,
                 "template-file": str(Path(self.arguments["path"]).absolute()),
+                "build-dir": str(self.build_dir),
+                "cache-dir": str(self.get_sam_cache_dir()),
             },
         )
 
@@ -90,7 +173,10 @@ class TestSAM(FsTestCase):
             "build",
             {
                 "cached": True,
+                "parallel": True,
                 "template-file": str(Path(self.arguments["path"]).absolute()),
+                "build-dir": str(self.build_dir),
+                "cache-dir": str(self.get_sam_cache_dir()),
                 "use-container": True,
             },
         )
@@ -105,6 +191,7 @@ class TestSAM(FsTestCase):
         self.invoker.invoke.assert_any_call(
             "package",
             {
+                "template-file": str(self.build_dir / "template.yaml"),
                 "s3-bucket": self.arguments["artifact_bucket_name"],
                 "region": self.region,
                 "s3-prefix": expected_prefix,
@@ -125,6 +212,7 @@ class TestSAM(FsTestCase):
         self.invoker.invoke.assert_any_call(
             "package",
             {
+                "template-file": str(self.build_dir / "template.yaml"),
                 "s3-bucket": self.arguments["artifact_bucket_name"],
                 "region": self.region,
                 "s3-prefix": expected_prefix,
@@ -157,24 +245,84 @@ class TestSAM(FsTestCase):
         self,
     ):
         self.arguments["path"] = "my/random/path.yaml.j2"
-        expected_file_path = Path("my/random/path.yaml.compiled").absolute()
+        expected_file_path = Path(self.temp_dir, "top/mid/stack.compiled")
         self.handler.handle()
         self.invoker.invoke.assert_any_call(
-            "build", {"cached": True, "template-file": str(expected_file_path)}
+            "build",
+            {
+                "cached": True,
+                "parallel": True,
+                "template-file": str(expected_file_path),
+                "build-dir": str(self.build_dir),
+                "cache-dir": str(self.get_sam_cache_dir()),
+            },
         )
 
-    def test_handle__path_has_jinja_extension__deletes_compiled_jinja_file(self):
+    def test_handle__path_has_jinja_extension__keeps_compiled_jinja_file(self):
         self.arguments["path"] = "my/random/path.yaml.j2"
-        expected_file_path = Path("my/random/path.yaml.compiled").absolute()
+        expected_file_path = Path(self.temp_dir, "top/mid/stack.compiled")
         self.handler.handle()
-        self.assertFalse(expected_file_path.exists())
+        self.assertEqual(self.processed_contents, expected_file_path.read_text())
+
+    def test_handle__jinja_template_handled_twice__renders_once(self):
+        self.arguments["path"] = "my/random/path.yaml.j2"
+        self.stack_group_config["j2_environment"] = {}
+        self.fs.create_file(self.arguments["path"], contents="{{ sceptre_user_data }}")
+
+        self.create_handler().handle()
+        self.template_memo.clear()
+        self.create_handler().handle()
+
+        self.render_jinja_template.assert_called_once()
+        self.assertEqual(
+            [False, True],
+            [
+                span.attributes["memoized"]
+                for span in self.spans
+                if span.phase == "render"
+            ],
+        )
+
+    def test_handle__jinja_template_with_new_user_data__renders_again(self):
+        self.arguments["path"] = "my/random/path.yaml.j2"
+        self.stack_group_config["j2_environment"] = {}
+        self.fs.create_file(self.arguments["path"], contents="{{ sceptre_user_data }}")
+
+        self.create_handler().handle()
+        self.sceptre_user_data = {"user": "other"}
+        self.create_handler().handle()
+
+        self.assertEqual(2, self.render_jinja_template.call_count)
+
+    def test_handle__jinja_template_source_changed__renders_again(self):
+        self.arguments["path"] = "my/random/path.yaml.j2"
+        self.stack_group_config["j2_environment"] = {}
+        self.fs.create_file(self.arguments["path"], contents="{{ sceptre_user_data }}")
+
+        self.create_handler().handle()
+        Path(self.arguments["path"]).write_text("changed")
+        self.create_handler().handle()
+
+        self.assertEqual(2, self.render_jinja_template.call_count)
+
+    def test_handle__compiled_jinja_template_unchanged__does_not_rewrite_it(self):
+        self.arguments["path"] = "my/random/path.yaml.j2"
+        compiled_path = Path(self.temp_dir, "top/mid/stack.compiled")
+        self.create_handler().handle()
+        os.utime(compiled_path, (1, 1))
+
+        self.render_cache.clear()
+        self.create_handler().handle()
+
+        self.render_jinja_template.assert_called()
+        self.assertEqual(1, compiled_path.stat().st_mtime)
 
     def test_handle__path_has_jinja_extension_and_skip_jinja_cleanup_flag_is_true__keeps_compiled_jinja_file(
         self,
     ):
         self.arguments["path"] = "my/random/path.yaml.j2"
         self.arguments["skip_jinja_cleanup"] = True
-        expected_file_path = Path("my/random/path.yaml.compiled").absolute()
+        expected_file_path = Path(self.temp_dir, "top/mid/stack.compiled")
         self.handler.handle()
         self.assertTrue(expected_file_path.exists())
 
@@ -191,6 +339,578 @@ class TestSAM(FsTestCase):
         with self.assertRaises(UnsupportedTemplateFileTypeError):
             self.handler.handle()
 
+    def test_handle__same_template_handled_twice__builds_once_and_packages_twice(
+        self,
+    ):
+        self.create_handler().handle()
+        self.name = "top/mid/other-stack"
+        self.create_handler().handle()
+
+        commands = [call.args[0] for call in self.invoker.invoke.call_args_list]
+        self.assertEqual(["build", "package", "package"], commands)
+
+    def test_handle__code_changed_between_stacks__builds_again(self):
+        Path("my/random/path.yaml").write_text(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src\n"
+        )
+        self.fs.create_file("my/random/src/app.py", contents="v1")
+        self.create_handler().handle()
+        Path("my/random/src/app.py").write_text("version 2")
+        self.name = "top/mid/other-stack"
+        self.create_handler().handle()
+
+        commands = [call.args[0] for call in self.invoker.invoke.call_args_list]
+        self.assertEqual(["build", "package", "build", "package"], commands)
+
+    def test_handle__same_template_handled_twice__packages_shared_build(self):
+        self.create_handler().handle()
+        self.name = "top/mid/other-stack"
+        self.create_handler().handle()
+
+        package_args = self.invoker.invoke.call_args_list[-1].args[1]
+        self.assertEqual(
+            str(self.build_dir / "template.yaml"), package_args["template-file"]
+        )
+
+    def test_handle__path_has_jinja_extension__makes_relative_paths_absolute(self):
+        self.arguments["path"] = "my/random/path.yaml.j2"
+        self.arguments["skip_jinja_cleanup"] = True
+        self.render_jinja_template.return_value = (
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src\n"
+            "      Role: !GetAtt Role.Arn\n"
+        )
+        self.handler.handle()
+
+        compiled = load_template(
+            Path(self.temp_dir, "top/mid/stack.compiled").read_text()
+        )
+        properties = compiled["Resources"]["Fn"]["Properties"]
+        self.assertEqual(str(Path("my/random/src").absolute()), properties["CodeUri"])
+        self.assertEqual(TaggedValue("!GetAtt", "Role.Arn"), properties["Role"])
+
+    def test_handle__path_has_jinja_extension__sets_default_code_uri(self):
+        self.arguments["path"] = "my/random/path.yaml.j2"
+        self.arguments["skip_jinja_cleanup"] = True
+        self.render_jinja_template.return_value = (
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      Handler: app.handler\n"
+        )
+        self.handler.handle()
+
+        compiled = load_template(
+            Path(self.temp_dir, "top/mid/stack.compiled").read_text()
+        )
+        self.assertEqual(
+            str(Path("my/random").absolute()),
+            compiled["Resources"]["Fn"]["Properties"]["CodeUri"],
+        )
+
+    def test_handle__path_has_jinja_extension__makes_included_paths_absolute(self):
+        self.arguments["path"] = "my/random/path.yaml.j2"
+        self.arguments["skip_jinja_cleanup"] = True
+        self.render_jinja_template.return_value = (
+            "Resources:\n"
+            "  Machine:\n"
+            "    Type: AWS::StepFunctions::StateMachine\n"
+            "    Properties:\n"
+            "      DefinitionS3Location: machine.json\n"
+            "      Fn::Transform:\n"
+            "        Name: AWS::Include\n"
+            "        Parameters:\n"
+            "          Location: snippets/machine.yaml\n"
+        )
+        self.handler.handle()
+
+        compiled = load_template(
+            Path(self.temp_dir, "top/mid/stack.compiled").read_text()
+        )
+        properties = compiled["Resources"]["Machine"]["Properties"]
+        self.assertEqual(
+            str(Path("my/random/machine.json").absolute()),
+            properties["DefinitionS3Location"],
+        )
+        self.assertEqual(
+            str(Path("my/random/snippets/machine.yaml").absolute()),
+            properties["Fn::Transform"]["Parameters"]["Location"],
+        )
+
+    def test_handle__same_template_with_different_build_args__builds_twice(self):
+        self.create_handler().handle()
+        self.arguments["build_args"] = {"use-container": True}
+        self.create_handler().handle()
+
+        commands = [call.args[0] for call in self.invoker.invoke.call_args_list]
+        self.assertEqual(["build", "package", "build", "package"], commands)
+
+    def test_handle__native_packager__packages_build_without_invoking_sam(self):
+        self.arguments["packager"] = "native"
+        result = self.handler.handle()
+
+        commands = [call.args[0] for call in self.invoker.invoke.call_args_list]
+        self.assertEqual(["build"], commands)
+        self.packager.package.assert_called_once_with(
+            self.build_dir / "template.yaml",
+            Path(self.temp_dir) / (self.name + ".yaml"),
+        )
+        self.assertEqual(self.processed_contents, result)
+
+    def test_handle__native_packager__uses_bucket_and_prefix(self):
+        self.arguments["packager"] = "native"
+        self.handler.handle()
+
+        self.packager_class.assert_called_once_with(
+            self.s3_client,
+            "bucket",
+            "prefix/top/mid/stack/sam_artifacts",
+            max_workers=NativePackager.DEFAULT_MAX_WORKERS,
+            artifact_index=ANY,
+            force_upload=False,
+            tracer=self.handler.tracer,
+            dry_run=False,
+        )
+
+    def test_handle__native_packager__persists_artifact_index_in_cache_dir(self):
+        self.arguments["packager"] = "native"
+        self.handler.handle()
+
+        artifact_index = self.packager_class.call_args.kwargs["artifact_index"]
+        self.assertEqual(
+            Path(self.cache_dir, "artifact-index"), artifact_index.directory
+        )
+
+    def test_handle__native_packager_with_force_upload__passes_force_upload(self):
+        self.arguments["packager"] = "native"
+        self.arguments["package_args"] = {"force-upload": True}
+        self.handler.handle()
+
+        self.assertTrue(self.packager_class.call_args.kwargs["force_upload"])
+
+    def test_handle__native_packager__uses_package_args_region_and_profile(self):
+        self.arguments["packager"] = "native"
+        self.arguments["package_args"] = {"region": "us-west-2", "profile": "other"}
+        self.handler.handle()
+
+        self.get_s3_client.assert_called_once_with(
+            self.connection_manager,
+            NativePackager.DEFAULT_MAX_WORKERS,
+            profile="other",
+            region="us-west-2",
+        )
+
+    def test_handle__native_packager_with_unsupported_package_args__raises_error(
+        self,
+    ):
+        self.arguments["packager"] = "native"
+        self.arguments["package_args"] = {"kms-key-id": "key"}
+        with self.assertRaises(TemplateHandlerArgumentsInvalidError):
+            self.handler.handle()
+
+    def test_handle__dry_run__packages_natively_without_s3_client(self):
+        self.arguments["dry_run"] = True
+        self.arguments["packager"] = "native"
+
+        result = self.handler.handle()
+
+        commands = [call.args[0] for call in self.invoker.invoke.call_args_list]
+        self.assertEqual(["build"], commands)
+        self.get_s3_client.assert_not_called()
+        self.assertIsNone(self.packager_class.call_args.args[0])
+        self.assertTrue(self.packager_class.call_args.kwargs["dry_run"])
+        self.assertEqual(self.processed_contents, result)
+
+    def test_handle__dry_run_with_sam_packager__raises_error(self):
+        self.arguments["dry_run"] = True
+        with self.assertRaisesRegex(
+            TemplateHandlerArgumentsInvalidError, "native packager"
+        ):
+            self.handler.handle()
+
+        self.invoker.invoke.assert_not_called()
+
+    def test_handle__dry_run_with_template_cache__does_not_cache_template(self):
+        self.arguments["dry_run"] = True
+        self.arguments["packager"] = "native"
+        self.arguments["template_cache"] = True
+
+        self.handler.handle()
+
+        self.assertEqual([], list(Path(self.cache_dir, "templates").glob("*.yaml")))
+
+    def test_handle__dry_run_with_unsupported_package_args__raises_error(self):
+        self.arguments["dry_run"] = True
+        self.arguments["packager"] = "native"
+        self.arguments["package_args"] = {"kms-key-id": "key"}
+        with self.assertRaisesRegex(
+            TemplateHandlerArgumentsInvalidError, "Disable dry_run"
+        ):
+            self.handler.handle()
+
+    def test_handle__worker_invoker__instantiates_worker_invoker(self):
+        self.arguments["invoker"] = "worker"
+        handler = self.create_handler()
+        handler.invoker_class = None
+        with patch.dict(SAM.INVOKER_CLASSES, {"worker": self.invoker_class}):
+            handler.handle()
+        self.invoker_class.assert_called_once()
+
+    def test_handle__template_cache_enabled__cache_hit__does_not_invoke_sam(self):
+        self.arguments["template_cache"] = True
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+
+        result = self.create_handler().handle()
+
+        self.assertEqual(self.processed_contents, result)
+        self.invoker_class.assert_not_called()
+
+    def test_handle__template_cache_enabled__cache_hit__writes_destination_template(
+        self,
+    ):
+        self.arguments["template_cache"] = True
+        self.create_handler().handle()
+        self.template_memo.clear()
+        destination = Path(self.temp_dir) / (self.name + ".yaml")
+        destination.unlink()
+
+        self.create_handler().handle()
+
+        self.assertEqual(self.processed_contents, destination.read_text())
+
+    def test_handle__template_cache_enabled__code_changed__invokes_sam(self):
+        Path("my/random/path.yaml").write_text(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src\n"
+        )
+        self.fs.create_file("my/random/src/app.py", contents="v1")
+        self.arguments["template_cache"] = True
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+        Path("my/random/src/app.py").write_text("v2")
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_called_once()
+
+    def test_handle__template_cache_enabled__default_code_changed__invokes_sam(self):
+        Path("my/random/path.yaml").write_text(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      Handler: app.handler\n"
+        )
+        self.fs.create_file("my/random/app.py", contents="v1")
+        self.arguments["template_cache"] = True
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+        self.template_memo.clear()
+        Path("my/random/app.py").write_text("v2")
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_called_once()
+
+    def test_handle__template_cache_enabled__included_file_changed__invokes_sam(self):
+        Path("my/random/path.yaml").write_text(
+            "Resources:\n"
+            "  Bucket:\n"
+            "    Type: AWS::S3::Bucket\n"
+            "    Properties:\n"
+            "      Fn::Transform:\n"
+            "        Name: AWS::Include\n"
+            "        Parameters:\n"
+            "          Location: snippets/bucket.yaml\n"
+        )
+        self.fs.create_file("my/random/snippets/bucket.yaml", contents="v1")
+        self.arguments["template_cache"] = True
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+        self.template_memo.clear()
+        Path("my/random/snippets/bucket.yaml").write_text("v2")
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_called_once()
+
+    def test_handle__template_cache_enabled__docker_context_changed__invokes_sam(self):
+        Path("my/random/path.yaml").write_text(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      PackageType: Image\n"
+            "    Metadata:\n"
+            "      DockerContext: image\n"
+            "      Dockerfile: Dockerfile\n"
+        )
+        self.fs.create_file("my/random/image/Dockerfile", contents="FROM v1")
+        self.arguments["template_cache"] = True
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+        self.template_memo.clear()
+        Path("my/random/image/Dockerfile").write_text("FROM v2")
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_called_once()
+
+    def test_handle__template_cache_enabled__ignored_file_changed__uses_cache(self):
+        Path("my/random/path.yaml").write_text(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src\n"
+        )
+        self.fs.create_file("my/random/src/app.py", contents="v1")
+        self.arguments["template_cache"] = True
+        self.arguments["fingerprint_ignore"] = ["node_modules"]
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+        self.template_memo.clear()
+        self.fs.create_file("my/random/src/node_modules/dep.js", contents="v2")
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_not_called()
+        fingerprint_spans = [span for span in self.spans if span.phase == "fingerprint"]
+        self.assertEqual(
+            [1, 1], [span.attributes["scanned"] for span in fingerprint_spans]
+        )
+
+    def test_handle__template_cache_enabled__build_args_changed__invokes_sam(self):
+        self.arguments["template_cache"] = True
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+        self.arguments["build_args"] = {"use-container": True}
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_called_once()
+
+    def test_handle__result_primed__returns_it_without_invoking_sam(self):
+        self.result_registry.prime(self.handler.handle_key, "primed")
+
+        self.assertEqual("primed", self.handler.handle())
+
+        self.invoker.invoke.assert_not_called()
+        self.assertIsNone(self.result_registry.take(self.handler.handle_key))
+
+    def test_handle__result_primed_for_other_user_data__handles_template(self):
+        self.result_registry.prime(self.handler.handle_key, "primed")
+        self.sceptre_user_data["user"] = "other"
+
+        self.assertEqual(self.processed_contents, self.create_handler().handle())
+
+    def test_handle__handled_twice__returns_memoized_template(self):
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+
+        result = self.create_handler().handle()
+
+        self.assertEqual(self.processed_contents, result)
+        self.invoker_class.assert_not_called()
+        self.assertTrue(self.spans[-1].attributes["memoized"])
+
+    def test_handle__code_changed_since_memoized__handles_template_again(self):
+        Path("my/random/path.yaml").write_text(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src\n"
+        )
+        self.fs.create_file("my/random/src/app.py", contents="v1")
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+        Path("my/random/src/app.py").write_text("v2 with more code")
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_called_once()
+
+    def test_handle__ignored_file_changed_since_memoized__returns_memoized_template(
+        self,
+    ):
+        Path("my/random/path.yaml").write_text(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src\n"
+        )
+        self.fs.create_file("my/random/src/app.py", contents="v1")
+        self.arguments["fingerprint_ignore"] = ["*.log"]
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+        self.fs.create_file("my/random/src/debug.log", contents="log")
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_not_called()
+
+    def test_handle__configured_differently_since_memoized__handles_template_again(
+        self,
+    ):
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+        self.arguments["artifact_prefix"] = "other"
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_called_once()
+
+    def test_handle__jinja_template_sources_unknown__does_not_memoize(self):
+        self.arguments["path"] = "my/random/path.yaml.j2"
+        self.stack_group_config["j2_environment"] = {}
+        self.fs.create_file(
+            self.arguments["path"], contents="{% include sceptre_user_data.file %}"
+        )
+        self.create_handler().handle()
+        self.invoker_class.reset_mock()
+
+        self.create_handler().handle()
+
+        self.invoker_class.assert_called_once()
+
+    def test_handle__template_cache_disabled__does_not_write_cache(self):
+        self.handler.handle()
+        self.assertFalse(Path(self.cache_dir, "templates").exists())
+
+    def test_handle__cache_dir_in_build_args__uses_it(self):
+        self.arguments["build_args"] = {"cache-dir": "my/cache"}
+        self.handler.handle()
+        build_args = self.invoker.invoke.call_args_list[0].args[1]
+        self.assertEqual("my/cache", build_args["cache-dir"])
+        self.assertFalse(Path(self.cache_dir, "sam-build").exists())
+
+    def test_handle__parallel_disabled_in_build_args__passes_none(self):
+        self.arguments["build_args"] = {"parallel": None}
+        self.handler.handle()
+        build_args = self.invoker.invoke.call_args_list[0].args[1]
+        self.assertIsNone(build_args["parallel"])
+
+    def test_handle__build_caches_too_big__prunes_unused_caches(self):
+        old_cache = Path(self.cache_dir, "sam-build", "old")
+        self.fs.create_file(old_cache / "entry", contents="x" * 100)
+        self.arguments["build_cache_max_size"] = 50
+
+        self.handler.handle()
+
+        self.assertFalse(old_cache.exists())
+        self.assertTrue(self.get_sam_cache_dir().exists())
+
+    def test_handle__cache_dir_argument__stores_cache_in_that_directory(self):
+        self.arguments["template_cache"] = True
+        self.arguments["cache_dir"] = "/custom/cache"
+        self.handler.handle()
+        self.assertEqual(1, len(list(Path("/custom/cache/templates").iterdir())))
+
+    def test_handle__incremental_build__does_not_rebuild_unchanged_template(self):
+        self.arguments["incremental_build"] = True
+        self.fake_build_output = True
+        Path(self.arguments["path"]).write_text("Resources: {}\n")
+        self.handler.handle()
+        self.build_registry.clear()
+
+        self.handler.handle()
+
+        self.assertEqual(
+            1,
+            [call.args[0] for call in self.invoker.invoke.call_args_list].count(
+                "build"
+            ),
+        )
+
+    def test_dependency_store__true__uses_cache_directory(self):
+        self.arguments["dependency_store"] = True
+        store = self.handler.dependency_store
+        self.assertIsInstance(store, LocalDependencyStore)
+        self.assertEqual(Path(self.cache_dir, "dependencies"), store.directory)
+
+    def test_dependency_store__s3_location__uses_s3_store(self):
+        self.arguments["dependency_store"] = "s3://deps-bucket/some/prefix"
+        self.arguments["dependency_store_endpoint_url"] = "http://localhost:9000"
+
+        store = self.handler.dependency_store
+
+        self.assertIsInstance(store, S3DependencyStore)
+        self.assertEqual(("deps-bucket", "some/prefix"), (store.bucket, store.prefix))
+        self.get_s3_client.assert_called_once_with(
+            self.connection_manager,
+            NativePackager.DEFAULT_MAX_WORKERS,
+            endpoint_url="http://localhost:9000",
+        )
+
+    def test_dependency_store__not_set__returns_none(self):
+        self.assertIsNone(self.handler.dependency_store)
+
+    def test_handle__records_span_for_each_phase(self):
+        self.handler.handle()
+        self.assertEqual(
+            ["memo_lookup", "build", "package", "read_template", "handle"],
+            [span.phase for span in self.spans],
+        )
+
+    def test_handle__spans_have_stack_and_template(self):
+        self.handler.handle()
+        for span in self.spans:
+            self.assertEqual(self.name, span.attributes["stack"])
+            self.assertEqual(
+                str(Path(self.arguments["path"]).absolute()),
+                span.attributes["template"],
+            )
+
+    def test_handle__path_has_jinja_extension__records_render_span(self):
+        self.arguments["path"] = "my/random/path.j2"
+        self.fs.create_file(self.arguments["path"], contents=self.template_contents)
+        self.handler.handle()
+        self.assertEqual(
+            ["memo_lookup", "render"], [span.phase for span in self.spans[:2]]
+        )
+
+    def test_handle__template_cache_enabled__records_cache_hit_and_miss(self):
+        self.arguments["template_cache"] = True
+        self.create_handler().handle()
+        self.template_memo.clear()
+        self.create_handler().handle()
+
+        lookups = [span for span in self.spans if span.phase == "cache_lookup"]
+        self.assertEqual(
+            ["miss", "hit"], [span.attributes["cache"] for span in lookups]
+        )
+
+    def test_handle__timing_file_argument__appends_spans_as_json_lines(self):
+        self.arguments["timing_file"] = "/timing/spans.jsonl"
+        self.handler.handle()
+        self.handler.handle()
+
+        lines = Path("/timing/spans.jsonl").read_text().splitlines()
+        self.assertEqual(len(self.spans), len(lines))
+        self.assertEqual("handle", json.loads(lines[-1])["phase"])
+
+    def test_handle__profile_argument__writes_dumps_next_to_generated_template(self):
+        self.arguments["profile"] = "cprofile"
+        self.handler.handle()
+
+        destination_directory = Path(self.temp_dir, "top/mid")
+        self.assertTrue((destination_directory / "stack.build.cprofile").exists())
+        self.assertTrue((destination_directory / "stack.package.cprofile").exists())
+
 
 class TestSamInvoker(TestCase):
     def setUp(self):
@@ -222,15 +942,17 @@ class TestSamInvoker(TestCase):
             connection_manager=self.connection_manager,
             sam_directory=self.sam_directory,
             run_subprocess=self.run_subprocess,
+            environment_cache=SessionEnvironmentCache(),
+            sam_executable="/usr/bin/sam",
         )
 
     def assert_sam_command(self, command):
         self.run_subprocess.assert_called_with(
             command,
-            shell=True,
             check=True,
             cwd=self.sam_directory,
-            stdout=sys.stderr,
+            stdout=ANY,
+            stderr=subprocess.STDOUT,
             env=self.envs,
         )
 
@@ -241,10 +963,196 @@ class TestSamInvoker(TestCase):
             "ignore me": None,
         }
         self.invoker.invoke("build", args)
-        expected_command = 'sam build --key "value" --flag'
+        expected_command = ["/usr/bin/sam", "build", "--key", "value", "--flag"]
         self.assert_sam_command(expected_command)
 
+    def test_invoke__values_with_quotes_and_spaces__passes_them_verbatim(self):
+        self.invoker.invoke("build", {"key": 'it\'s "quoted" $HOME'})
+        self.assert_sam_command(
+            ["/usr/bin/sam", "build", "--key", 'it\'s "quoted" $HOME']
+        )
+
+    def test_invoke__list_value__repeats_option(self):
+        self.invoker.invoke("build", {"container-env-var": ["A=1", "B=2"]})
+        self.assert_sam_command(
+            [
+                "/usr/bin/sam",
+                "build",
+                "--container-env-var",
+                "A=1",
+                "--container-env-var",
+                "B=2",
+            ]
+        )
+
+    def test_invoke__list_value_of_list_option__passes_values_after_option(self):
+        self.invoker.invoke(
+            "build", {"parameter-overrides": ["A=1", "B=2"], "tags": []}
+        )
+        self.assert_sam_command(
+            ["/usr/bin/sam", "build", "--parameter-overrides", "A=1", "B=2"]
+        )
+
+    def test_invoke__invoked_twice__creates_session_environment_variables_once(self):
+        self.invoker.invoke("build", {})
+        self.invoker.invoke("package", {})
+        self.connection_manager.create_session_environment_variables.assert_called_once()
+
     def test_invoke__runs_sam_command_with_empty_args(self):
         self.invoker.invoke("build", {})
-        expected_command = "sam build"
+        expected_command = ["/usr/bin/sam", "build"]
         self.assert_sam_command(expected_command)
+
+    def test_invoke__positional_args__passes_them_after_command_name(self):
+        self.invoker.invoke("build", {"flag": True}, ["MyFunction"])
+        self.assert_sam_command(["/usr/bin/sam", "build", "MyFunction", "--flag"])
+
+    def test_invoke__records_span_for_command(self):
+        spans = []
+        self.invoker.tracer = Tracer([spans.append])
+        self.invoker.invoke("build", {})
+        self.assertEqual(
+            ["session_environment", "sam_build"], [span.phase for span in spans]
+        )
+
+    def test_invoke__streams_output_with_prefix(self):
+        output = io.StringIO()
+        self.run_subprocess.side_effect = lambda *args, stdout, **kwargs: os.write(
+            stdout, b"Building codeuri: src runtime: python3.11 functions: Fn\n"
+        )
+        self.invoker.output_prefix = "[stack] "
+
+        with patch("sys.stderr", output):
+            self.invoker.invoke("build", {})
+
+        self.assertEqual(
+            "[stack] Building codeuri: src runtime: python3.11 functions: Fn\n",
+            output.getvalue(),
+        )
+
+    def test_invoke__command_fails__raises_error_with_output_tail(self):
+        def run_subprocess(command, *, stdout, **kwargs):
+            os.write(stdout, b"".join(b"line %d\n" % i for i in range(100)))
+            raise subprocess.CalledProcessError(1, command)
+
+        self.run_subprocess.side_effect = run_subprocess
+
+        with patch("sys.stderr", io.StringIO()):
+            with self.assertRaises(SamCommandError) as context:
+                self.invoker.invoke("build", {})
+
+        self.assertEqual(1, context.exception.returncode)
+        self.assertEqual([f"line {i}" for i in range(50, 100)], context.exception.tail)
+        self.assertIn("line 99", str(context.exception))
+        self.assertEqual("/usr/bin/sam build", context.exception.cmd)
+
+    def test_invoke__limiter__runs_command_in_slot_and_records_queue_wait(self):
+        spans = []
+        self.invoker.tracer = Tracer([spans.append])
+        limiter = self.invoker.limiter = Mock(spec=ConcurrencyLimiter)
+        limiter.slot.return_value.__enter__ = Mock(return_value=1.5)
+        limiter.slot.return_value.__exit__ = Mock(return_value=None)
+        self.run_subprocess.side_effect = lambda *args, **kwargs: self.assertTrue(
+            limiter.slot.return_value.__enter__.called
+        )
+
+        self.invoker.invoke("build", {})
+
+        self.run_subprocess.assert_called_once()
+        limiter.slot.return_value.__exit__.assert_called_once()
+        self.assertEqual(1.5, spans[-1].attributes["queue_wait"])
+
+
+class TestGetSamExecutable(TestCase):
+    def setUp(self):
+        super().setUp()
+        get_sam_executable.cache_clear()
+        self.addCleanup(get_sam_executable.cache_clear)
+
+    def test_get_sam_executable__looks_up_path_once(self):
+        with patch("shutil.which", return_value="/opt/bin/sam") as which:
+            self.assertEqual("/opt/bin/sam", get_sam_executable())
+            self.assertEqual("/opt/bin/sam", get_sam_executable())
+        which.assert_called_once_with("sam")
+
+    def test_get_sam_executable__not_found__returns_sam(self):
+        with patch("shutil.which", return_value=None):
+            self.assertEqual("sam", get_sam_executable())
+
+
+class TestSamWorkerInvoker(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.envs = {"some": "env"}
+        self.connection_manager = Mock(
+            **{
+                "spec": ConnectionManager,
+                "create_session_environment_variables.return_value": self.envs,
+            }
+        )
+        self.sam_directory = Path("/path/to/my/sam/directory")
+        self.run_subprocess = Mock(spec=subprocess.run)
+        self.worker_pool = Mock(spec=SamWorkerPool, is_available=True)
+        self.worker_pool.run.return_value = 0
+
+        self.invoker = SamWorkerInvoker(
+            connection_manager=self.connection_manager,
+            sam_directory=self.sam_directory,
+            run_subprocess=self.run_subprocess,
+            environment_cache=SessionEnvironmentCache(),
+            get_worker_pool=lambda: self.worker_pool,
+        )
+
+    def test_invoke__runs_command_on_worker(self):
+        self.invoker.invoke("build", {"key": "value with spaces", "flag": True})
+        self.worker_pool.run.assert_called_once_with(
+            ["build", "--key", "value with spaces", "--flag"],
+            self.sam_directory,
+            self.envs,
+            ANY,
+        )
+        self.run_subprocess.assert_not_called()
+
+    def test_invoke__streams_worker_output_with_prefix(self):
+        def run(args, cwd, env, output_fd):
+            os.write(
+                output_fd, b"Building codeuri: src runtime: python3.11 functions: Fn\n"
+            )
+            return 0
+
+        self.worker_pool.run.side_effect = run
+        self.invoker.output_prefix = "[stack] "
+        output = io.StringIO()
+        with patch("sys.stderr", output):
+            self.invoker.invoke("build", {})
+
+        self.assertEqual(
+            "[stack] Building codeuri: src runtime: python3.11 functions: Fn\n",
+            output.getvalue(),
+        )
+
+    def test_invoke__command_fails__raises_error_with_output_tail(self):
+        def run(args, cwd, env, output_fd):
+            os.write(output_fd, b"".join(b"line %d\n" % i for i in range(100)))
+            return 1
+
+        self.worker_pool.run.side_effect = run
+
+        with patch("sys.stderr", io.StringIO()):
+            with self.assertRaises(SamCommandError) as context:
+                self.invoker.invoke("build", {})
+
+        self.assertEqual(1, context.exception.returncode)
+        self.assertEqual([f"line {i}" for i in range(50, 100)], context.exception.tail)
+        self.assertTrue(context.exception.cmd.endswith(" build"))
+
+    def test_invoke__workers_unavailable__runs_subprocess(self):
+        self.worker_pool.is_available = False
+        self.invoker.invoke("build", {})
+        self.run_subprocess.assert_called_once()
+        self.worker_pool.run.assert_not_called()
+
+    def test_invoke__worker_dies__falls_back_to_subprocess(self):
+        self.worker_pool.run.side_effect = WorkerUnavailableError("died")
+        self.invoker.invoke("build", {})
+        self.run_subprocess.assert_called_once()
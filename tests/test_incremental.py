@@ -0,0 +1,306 @@
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from sam_handler.dependencies import LocalDependencyStore
+from sam_handler.incremental import IncrementalBuild, is_buildable
+from sam_handler.template import dump_template, load_template
+from tests.fakes import FakeInvoker
+
+
+class IncrementalBuildTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+        self.function_ids = ["Fn0", "Fn1", "Fn2", "Fn3"]
+        for logical_id in self.function_ids:
+            self.write_code(logical_id, "v1")
+        self.template = {
+            "Resources": {
+                logical_id: {
+                    "Type": "AWS::Serverless::Function",
+                    "Properties": {"CodeUri": f"src/{logical_id}", "Runtime": "py"},
+                }
+                for logical_id in self.function_ids
+            }
+        }
+        self.template_path = self.directory / "template.yaml"
+        self.write_template()
+        self.build_directory = self.directory / ".aws-sam" / "build"
+        self.build_args = {
+            "cached": True,
+            "template-file": str(self.template_path),
+            "build-dir": str(self.build_directory),
+        }
+        self.invoker = FakeInvoker()
+
+    def write_code(self, logical_id: str, contents: str):
+        path = self.directory / "src" / logical_id / "app.py"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+
+    def write_template(self):
+        self.template_path.write_text(dump_template(self.template))
+
+    def build(self, build_args=None, dependency_store=None):
+        IncrementalBuild(
+            self.template_path,
+            self.build_directory,
+            build_args or self.build_args,
+            dependency_store,
+        ).run(self.invoker)
+
+    def built_resources(self) -> list:
+        """Returns the resources each `sam build` was limited to."""
+        return [command.resources for command in self.invoker.commands]
+
+    def built_template(self) -> dict:
+        return load_template((self.build_directory / "template.yaml").read_text())
+
+
+class TestIncrementalBuild(IncrementalBuildTestCase):
+    def test_run__first_build__builds_everything(self):
+        self.build()
+        self.assertEqual([[]], self.built_resources())
+
+    def test_run__nothing_changed__does_not_invoke_sam(self):
+        self.build()
+        self.build()
+        self.assertEqual([[]], self.built_resources())
+
+    def test_run__one_function_changed__rebuilds_only_that_function(self):
+        self.build()
+        self.write_code("Fn1", "v2")
+
+        self.build()
+
+        self.assertEqual([[], ["Fn1"]], self.built_resources())
+
+    def test_run__one_function_changed__merges_its_build_output(self):
+        self.build()
+        self.write_code("Fn1", "v2")
+
+        self.build()
+
+        self.assertEqual("v2", (self.build_directory / "Fn1" / "app.py").read_text())
+        self.assertEqual("v1", (self.build_directory / "Fn0" / "app.py").read_text())
+        resources = self.built_template()["Resources"]
+        self.assertEqual(
+            {logical_id: logical_id for logical_id in self.function_ids},
+            {
+                logical_id: resource["Properties"]["CodeUri"]
+                for logical_id, resource in resources.items()
+            },
+        )
+        self.assertFalse(
+            self.build_directory.with_name("build-partial").exists(),
+        )
+
+    def test_run__default_code_uri_changed__rebuilds_that_function(self):
+        del self.template["Resources"]["Fn0"]["Properties"]["CodeUri"]
+        self.write_template()
+        (self.directory / "app.py").write_text("v1")
+        self.build()
+        (self.directory / "app.py").write_text("v2")
+
+        self.build()
+
+        self.assertEqual([[], ["Fn0"]], self.built_resources())
+
+    def test_run__function_definition_changed__rebuilds_only_that_function(self):
+        self.build()
+        self.template["Resources"]["Fn2"]["Properties"]["Runtime"] = "other"
+        self.write_template()
+
+        self.build()
+
+        self.assertEqual([[], ["Fn2"]], self.built_resources())
+
+    def test_run__rest_of_template_changed__builds_everything(self):
+        self.build()
+        self.template["Globals"] = {"Function": {"Timeout": 10}}
+        self.write_template()
+
+        self.build()
+
+        self.assertEqual([[], []], self.built_resources())
+
+    def test_run__function_added__builds_everything(self):
+        self.build()
+        self.write_code("Fn4", "v1")
+        self.template["Resources"]["Fn4"] = {
+            "Type": "AWS::Serverless::Function",
+            "Properties": {"CodeUri": "src/Fn4", "Runtime": "py"},
+        }
+        self.write_template()
+
+        self.build()
+
+        self.assertEqual([[], []], self.built_resources())
+
+    def test_run__build_args_changed__builds_everything(self):
+        self.build()
+        self.build({**self.build_args, "use-container": True})
+        self.assertEqual([[], []], self.built_resources())
+
+    def test_run__most_functions_changed__builds_everything(self):
+        self.build()
+        for logical_id in self.function_ids[:3]:
+            self.write_code(logical_id, "v2")
+
+        self.build()
+
+        self.assertEqual([[], []], self.built_resources())
+
+    def test_run__build_directory_removed__builds_everything(self):
+        self.build()
+        shutil.rmtree(self.build_directory)
+
+        self.build()
+
+        self.assertEqual([[], []], self.built_resources())
+
+    def test_run__previous_build_failed__builds_everything(self):
+        self.build()
+        self.write_code("Fn1", "v2")
+        self.invoker.fail = True
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.build()
+        self.invoker.fail = False
+
+        self.build()
+
+        self.assertEqual([[], ["Fn1"], []], self.built_resources())
+
+
+class TestIncrementalBuildWithDependencyStore(IncrementalBuildTestCase):
+    def setUp(self):
+        super().setUp()
+        for logical_id in self.function_ids:
+            self.write_requirements(logical_id, "requests")
+            self.template["Resources"][logical_id]["Properties"][
+                "Runtime"
+            ] = "python3.11"
+        self.write_template()
+        self.store = LocalDependencyStore(self.directory / "store")
+
+    def write_requirements(self, logical_id: str, contents: str):
+        (self.directory / "src" / logical_id / "requirements.txt").write_text(contents)
+
+    def build(self, build_args=None, dependency_store=None):
+        super().build(build_args, dependency_store or self.store)
+
+    def test_run__first_build__publishes_dependencies(self):
+        self.build()
+        self.assertEqual(1, len(list(self.store.directory.iterdir())))
+
+    def test_run__previous_build_removed__restores_dependencies_from_store(self):
+        self.build()
+        shutil.rmtree(self.build_directory.parent)
+
+        self.build()
+
+        # Only one function is built with SAM, to create the built template.
+        self.assertEqual([[], ["Fn0"]], self.built_resources())
+        for logical_id in self.function_ids:
+            function_directory = self.build_directory / logical_id
+            self.assertEqual("v1", (function_directory / "app.py").read_text())
+            self.assertEqual(
+                "requests", (function_directory / "package/__init__.py").read_text()
+            )
+        self.assertEqual(
+            {logical_id: logical_id for logical_id in self.function_ids},
+            {
+                logical_id: resource["Properties"]["CodeUri"]
+                for logical_id, resource in self.built_template()["Resources"].items()
+            },
+        )
+
+    def test_run__restored_from_store__matches_sam_build(self):
+        code_directory = self.directory / "src" / "Fn1"
+        for name in [
+            ".env",
+            "env/bin/python",
+            "lib/util.py",
+            "lib/native.so",
+            "lib/__pycache__/util.cpython-311.pyc",
+            ".coverage",
+            "htmlcov/index.html",
+            ".python-version",
+            ".idea/workspace.xml",
+        ]:
+            path = code_directory / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(name)
+        self.build()
+        sam_build = self.list_files(self.build_directory / "Fn1")
+        shutil.rmtree(self.build_directory.parent)
+
+        self.build()
+
+        self.assertNotIn(["Fn1"], self.built_resources()[1:])
+        self.assertEqual(sam_build, self.list_files(self.build_directory / "Fn1"))
+
+    def list_files(self, directory: Path) -> dict:
+        return {
+            path.relative_to(directory).as_posix(): path.read_text()
+            for path in directory.rglob("*")
+            if path.is_file()
+        }
+
+    def test_run__code_changed_with_same_requirements__does_not_invoke_sam(self):
+        self.build()
+        self.write_code("Fn1", "v2")
+
+        self.build()
+
+        self.assertEqual([[]], self.built_resources())
+        self.assertEqual("v2", (self.build_directory / "Fn1" / "app.py").read_text())
+        self.assertEqual(
+            "requests",
+            (self.build_directory / "Fn1" / "package/__init__.py").read_text(),
+        )
+
+    def test_run__requirements_changed__builds_with_sam(self):
+        self.build()
+        self.write_requirements("Fn1", "boto3")
+
+        self.build()
+
+        self.assertEqual([[], ["Fn1"]], self.built_resources())
+        self.assertEqual(2, len(list(self.store.directory.iterdir())))
+
+    def test_run__most_functions_changed__builds_everything(self):
+        self.build()
+        for logical_id in self.function_ids[:3]:
+            self.write_code(logical_id, "v2")
+
+        self.build()
+
+        # The functions' dependencies are all in the store
+        self.assertEqual([[]], self.built_resources())
+
+
+class TestIsBuildable(TestCase):
+    def test_is_buildable__function__returns_true(self):
+        self.assertTrue(is_buildable({"Type": "AWS::Serverless::Function"}))
+
+    def test_is_buildable__layer_with_build_method__returns_true(self):
+        self.assertTrue(
+            is_buildable(
+                {
+                    "Type": "AWS::Serverless::LayerVersion",
+                    "Metadata": {"BuildMethod": "python3.11"},
+                }
+            )
+        )
+
+    def test_is_buildable__layer_without_build_method__returns_false(self):
+        self.assertFalse(is_buildable({"Type": "AWS::Serverless::LayerVersion"}))
+
+    def test_is_buildable__other_resource__returns_false(self):
+        self.assertFalse(is_buildable({"Type": "AWS::Serverless::Api"}))
@@ -0,0 +1,94 @@
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from sam_handler.limiter import ConcurrencyLimiter, get_available_memory
+
+
+class TestConcurrencyLimiter(TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name, "slots")
+        self.available_memory = 0
+        patcher = patch.object(ConcurrencyLimiter, "POLL_INTERVAL", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_limiter(self, max_concurrent=2, min_available_memory=0):
+        return ConcurrencyLimiter(
+            self.directory,
+            max_concurrent,
+            min_available_memory,
+            get_available_memory=lambda: self.available_memory,
+        )
+
+    def test_slot__free_slot__admits_without_waiting(self):
+        with self.create_limiter().slot() as queue_wait:
+            self.assertLess(queue_wait, 1)
+
+    def test_slot__all_slots_taken__waits_for_one_to_be_released(self):
+        limiter = self.create_limiter(max_concurrent=2)
+        release = threading.Event()
+        admitted = threading.Event()
+
+        def hold_slot():
+            with limiter.slot():
+                release.wait(5)
+
+        holders = [threading.Thread(target=hold_slot) for _ in range(2)]
+        for holder in holders:
+            holder.start()
+
+        def wait_for_slot():
+            with self.create_limiter(max_concurrent=2).slot():
+                admitted.set()
+
+        waiter = threading.Thread(target=wait_for_slot)
+        # Give the holders time to take both slots.
+        time.sleep(0.2)
+        waiter.start()
+
+        self.assertFalse(admitted.wait(0.2))
+        release.set()
+        self.assertTrue(admitted.wait(5))
+        for thread in [*holders, waiter]:
+            thread.join(5)
+
+    def test_slot__released__frees_slot(self):
+        limiter = self.create_limiter(max_concurrent=1)
+        with limiter.slot():
+            pass
+        with limiter.slot() as queue_wait:
+            self.assertLess(queue_wait, 1)
+
+    def test_slot__not_enough_memory_while_others_run__waits_for_memory(self):
+        limiter = self.create_limiter(min_available_memory=100)
+        admitted = threading.Event()
+
+        def wait_for_slot():
+            with limiter.slot():
+                admitted.set()
+
+        with limiter.slot():
+            waiter = threading.Thread(target=wait_for_slot)
+            waiter.start()
+            self.assertFalse(admitted.wait(0.2))
+            self.available_memory = 100
+            self.assertTrue(admitted.wait(5))
+        waiter.join(5)
+
+    def test_slot__not_enough_memory_but_nothing_else_running__admits(self):
+        limiter = self.create_limiter(min_available_memory=100)
+        with limiter.slot() as queue_wait:
+            self.assertLess(queue_wait, 1)
+
+
+class TestGetAvailableMemory(TestCase):
+    def test_get_available_memory__returns_positive_value_or_none(self):
+        available_memory = get_available_memory()
+        self.assertTrue(available_memory is None or available_memory > 0)
@@ -0,0 +1,64 @@
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from sam_handler.locking import FileLock
+
+
+class TestFileLock(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.lock_path = Path(self.directory.name, "locks", "resource.lock")
+
+    def test_acquire__creates_lock_file(self):
+        lock = FileLock(self.lock_path)
+        self.assertTrue(lock.acquire())
+        self.assertTrue(self.lock_path.exists())
+        lock.release()
+
+    def test_acquire__already_locked__times_out(self):
+        with FileLock(self.lock_path):
+            self.assertFalse(FileLock(self.lock_path).acquire(timeout=0))
+
+    def test_acquire__after_release__succeeds(self):
+        with FileLock(self.lock_path):
+            pass
+        lock = FileLock(self.lock_path)
+        self.assertTrue(lock.acquire(timeout=0))
+        lock.release()
+
+    def test_acquire__waits_for_other_thread_to_release(self):
+        events = []
+
+        def hold_lock():
+            with FileLock(self.lock_path):
+                events.append("first acquired")
+                time.sleep(0.2)
+                events.append("first released")
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        while not events:
+            time.sleep(0.01)
+        with FileLock(self.lock_path):
+            events.append("second acquired")
+        thread.join()
+
+        self.assertEqual(
+            ["first acquired", "first released", "second acquired"], events
+        )
+
+    def test_for_resource__same_resource__same_lock_file(self):
+        lock_directory = Path(self.directory.name)
+        self.assertEqual(
+            FileLock.for_resource(Path("/project/.aws-sam"), lock_directory).path,
+            FileLock.for_resource(Path("/project/.aws-sam"), lock_directory).path,
+        )
+        self.assertNotEqual(
+            FileLock.for_resource(Path("/project/.aws-sam"), lock_directory).path,
+            FileLock.for_resource(Path("/other/.aws-sam"), lock_directory).path,
+        )
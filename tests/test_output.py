@@ -0,0 +1,130 @@
+import io
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from sam_handler.output import SamOutputParser, SamOutputStream
+from sam_handler.timing import Tracer
+
+BUILD_OUTPUT = """\
+Starting Build use cache
+Building codeuri: /project/src/a runtime: python3.11 metadata: {} architecture: x86_64 functions: FnA, FnB
+Running PythonPipBuilder:ResolveDependencies
+Building layer 'Deps'
+Build Succeeded
+"""
+
+PACKAGE_OUTPUT = (
+    "\tUploading to prefix/abc  512 / 1024.0  (50.00%)\r"
+    "\tUploading to prefix/abc  1024 / 1024.0  (100.00%)\n"
+    "File with same data already exists at prefix/def, skipping upload\n"
+)
+
+
+class TestSamOutputParser(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.spans = []
+        self.parser = SamOutputParser(Tracer([self.spans.append], {"stack": "s"}))
+
+    def feed(self, output: str):
+        shown = [
+            line
+            for line in output.replace("\r", "\n").splitlines()
+            if self.parser.feed(line)
+        ]
+        self.parser.close()
+        return shown
+
+    def test_feed__build_output__emits_span_per_resource(self):
+        self.feed(BUILD_OUTPUT)
+
+        self.assertEqual(
+            [
+                {
+                    "stack": "s",
+                    "resources": ["FnA", "FnB"],
+                    "codeuri": "/project/src/a",
+                    "runtime": "python3.11",
+                },
+                {"stack": "s", "resources": ["Deps"]},
+            ],
+            [span.attributes for span in self.spans],
+        )
+        self.assertEqual({"sam_build_resource"}, {span.phase for span in self.spans})
+
+    def test_feed__package_output__emits_upload_spans(self):
+        self.feed(PACKAGE_OUTPUT)
+
+        self.assertEqual(
+            [
+                ("prefix/abc", 1024, False),
+                ("prefix/def", 0, True),
+            ],
+            [
+                (
+                    span.attributes["key"],
+                    span.attributes["bytes"],
+                    span.attributes["skipped"],
+                )
+                for span in self.spans
+            ],
+        )
+
+    def test_feed__upload_in_progress__hides_line(self):
+        shown = self.feed(PACKAGE_OUTPUT)
+        self.assertEqual(2, len(shown))
+        self.assertIn("100.00%", shown[0])
+
+
+class TestSamOutputStream(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.spans = []
+        self.output = io.StringIO()
+
+    def stream(self, data: bytes, **kwargs) -> SamOutputStream:
+        with SamOutputStream(
+            SamOutputParser(Tracer([self.spans.append])),
+            output=self.output,
+            **kwargs,
+        ) as stream:
+            os.write(stream.fileno(), data)
+        return stream
+
+    def test_stream__writes_lines_with_prefix(self):
+        self.stream(b"one\ntwo\n", prefix="[stack] ")
+        self.assertEqual("[stack] one\n[stack] two\n", self.output.getvalue())
+
+    def test_stream__parses_progress(self):
+        self.stream(PACKAGE_OUTPUT.encode())
+        self.assertEqual(2, len(self.spans))
+
+    def test_stream__keeps_bounded_tail(self):
+        stream = self.stream(b"".join(b"%d\n" % i for i in range(10)), tail_lines=3)
+        self.assertEqual(["7", "8", "9"], list(stream.tail))
+
+    def test_stream__long_line__splits_it(self):
+        stream = self.stream(b"x" * 20000 + b"\n", tail_lines=10)
+        self.assertEqual([8192, 8192, 3616], [len(line) for line in stream.tail])
+
+    def test_close__pipe_kept_open__ignores_later_output(self):
+        stream = SamOutputStream(
+            SamOutputParser(Tracer([self.spans.append])), output=self.output
+        )
+        with patch("sam_handler.output.READER_TIMEOUT", 0.01):
+            with stream:
+                # Like a background process the command left running, holding the pipe open
+                leaked_fd = os.dup(stream.fileno())
+                os.write(leaked_fd, b"Building layer 'Deps'\n")
+                while not stream.tail:
+                    time.sleep(0.001)
+
+        os.write(leaked_fd, b"Build Succeeded\n")
+        os.close(leaked_fd)
+        stream._reader.join()
+
+        self.assertEqual(["Building layer 'Deps'"], list(stream.tail))
+        self.assertEqual("Building layer 'Deps'\n", self.output.getvalue())
+        self.assertEqual(1, len(self.spans))
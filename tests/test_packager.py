@@ -0,0 +1,371 @@
+import gc
+import tempfile
+import zipfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import Mock
+
+from benchmarks.fake_sam import FakeS3Client
+from sam_handler.packager import (
+    ArtifactIndex,
+    NativePackager,
+    PackagingError,
+    _s3_clients,
+    get_s3_client,
+)
+from sam_handler.template import TaggedValue, dump_template, load_template
+
+
+class TestNativePackager(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.build_dir = Path(self.directory.name, "build")
+        self.output_path = Path(self.directory.name, "packaged.yaml")
+        self.s3_client = FakeS3Client()
+        self.packager = NativePackager(self.s3_client, "bucket", "prefix")
+
+    def write_file(self, relative_path, contents):
+        path = self.build_dir / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+
+    def package(self, template_body):
+        self.write_file("template.yaml", template_body)
+        return load_template(
+            self.packager.package(self.build_dir / "template.yaml", self.output_path)
+        )
+
+    def test_package__zips_and_uploads_function_code_directory(self):
+        self.write_file("Fn/app.py", "print('hi')")
+        self.write_file("Fn/lib/util.py", "x = 1")
+        packaged = self.package(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: Fn\n"
+        )
+
+        code_uri = packaged["Resources"]["Fn"]["Properties"]["CodeUri"]
+        self.assertTrue(code_uri.startswith("s3://bucket/prefix/"))
+        key = code_uri.split("s3://bucket/", 1)[1]
+        archive_path = Path(self.directory.name, "uploaded.zip")
+        archive_path.write_bytes(self.s3_client.objects[("bucket", key)])
+        with zipfile.ZipFile(archive_path) as archive:
+            self.assertEqual(["app.py", "lib/util.py"], sorted(archive.namelist()))
+
+    def test_package__lambda_function_code__rewritten_to_s3_dict(self):
+        self.write_file("Fn/app.py", "print('hi')")
+        packaged = self.package(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Lambda::Function\n"
+            "    Properties:\n"
+            "      Code: Fn\n"
+        )
+
+        code = packaged["Resources"]["Fn"]["Properties"]["Code"]
+        self.assertEqual("bucket", code["S3Bucket"])
+        self.assertTrue(code["S3Key"].startswith("prefix/"))
+
+    def test_package__definition_file__uploaded_as_is(self):
+        self.write_file("api.yaml", "openapi: 3.0.0")
+        packaged = self.package(
+            "Resources:\n"
+            "  Api:\n"
+            "    Type: AWS::Serverless::Api\n"
+            "    Properties:\n"
+            "      DefinitionUri: api.yaml\n"
+        )
+
+        uri = packaged["Resources"]["Api"]["Properties"]["DefinitionUri"]
+        key = uri.split("s3://bucket/", 1)[1]
+        self.assertEqual(b"openapi: 3.0.0", self.s3_client.objects[("bucket", key)])
+
+    def test_package__shared_artifact__uploaded_once(self):
+        self.write_file("shared/app.py", "print('hi')")
+        self.s3_client.upload_file = Mock(wraps=self.s3_client.upload_file)
+        packaged = self.package(
+            "Globals:\n"
+            "  Function:\n"
+            "    CodeUri: shared\n"
+            "Resources:\n"
+            "  One:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "  Two:\n"
+            "    Type: AWS::Serverless::Function\n"
+        )
+
+        self.s3_client.upload_file.assert_called_once()
+        resources = packaged["Resources"]
+        self.assertEqual(
+            resources["One"]["Properties"]["CodeUri"],
+            resources["Two"]["Properties"]["CodeUri"],
+        )
+        self.assertNotIn("CodeUri", packaged["Globals"]["Function"])
+
+    def test_package__preserves_intrinsic_functions_and_writes_output(self):
+        self.write_file("Fn/app.py", "print('hi')")
+        packaged = self.package(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: Fn\n"
+            "      Role: !GetAtt Role.Arn\n"
+        )
+
+        self.assertEqual(
+            TaggedValue("!GetAtt", "Role.Arn"),
+            packaged["Resources"]["Fn"]["Properties"]["Role"],
+        )
+        self.assertEqual(packaged, load_template(self.output_path.read_text()))
+
+    def test_package__s3_code_uri__left_unchanged(self):
+        packaged = self.package(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: s3://other/key.zip\n"
+        )
+        self.assertEqual(
+            "s3://other/key.zip", packaged["Resources"]["Fn"]["Properties"]["CodeUri"]
+        )
+        self.assertEqual({}, self.s3_client.objects)
+
+    def test_package__missing_artifact__raises_packaging_error(self):
+        with self.assertRaises(PackagingError):
+            self.package(
+                "Resources:\n"
+                "  Fn:\n"
+                "    Type: AWS::Serverless::Function\n"
+                "    Properties:\n"
+                "      CodeUri: Missing\n"
+            )
+
+    def test_package__image_function__raises_packaging_error(self):
+        with self.assertRaises(PackagingError):
+            self.package(
+                "Resources:\n"
+                "  Fn:\n"
+                "    Type: AWS::Serverless::Function\n"
+                "    Properties:\n"
+                "      PackageType: Image\n"
+                "      ImageUri: fn:latest\n"
+            )
+
+    def test_package__image_function_from_globals__raises_packaging_error(self):
+        with self.assertRaisesRegex(PackagingError, "container image"):
+            self.package(
+                "Globals:\n"
+                "  Function:\n"
+                "    PackageType: Image\n"
+                "Resources:\n"
+                "  Fn:\n"
+                "    Type: AWS::Serverless::Function\n"
+                "    Properties:\n"
+                "      ImageUri: fn:latest\n"
+            )
+
+    def test_package__local_paths_it_cannot_rewrite__raise_packaging_error(self):
+        templates = {
+            "DefinitionS3Location": (
+                "Resources:\n"
+                "  Machine:\n"
+                "    Type: AWS::StepFunctions::StateMachine\n"
+                "    Properties:\n"
+                "      DefinitionS3Location: machine.json\n"
+            ),
+            "BodyS3Location": (
+                "Resources:\n"
+                "  Api:\n"
+                "    Type: AWS::ApiGateway::RestApi\n"
+                "    Properties:\n"
+                "      BodyS3Location: api.yaml\n"
+            ),
+            "Location": (
+                "Resources:\n"
+                "  Bucket:\n"
+                "    Type: AWS::S3::Bucket\n"
+                "    Properties:\n"
+                "      Fn::Transform:\n"
+                "        Name: AWS::Include\n"
+                "        Parameters:\n"
+                "          Location: snippets/bucket.yaml\n"
+            ),
+        }
+        for property_name, template in templates.items():
+            with self.subTest(property_name):
+                with self.assertRaisesRegex(
+                    PackagingError, f"local {property_name}, which"
+                ):
+                    self.package(template)
+
+    def test_package__artifact_already_in_bucket__skips_upload(self):
+        self.write_file("Fn/app.py", "print('hi')")
+        template = (
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: Fn\n"
+        )
+        self.package(template)
+        self.s3_client.upload_file = Mock(wraps=self.s3_client.upload_file)
+
+        NativePackager(self.s3_client, "bucket", "prefix").package(
+            self.build_dir / "template.yaml", self.output_path
+        )
+
+        self.s3_client.upload_file.assert_not_called()
+
+    def test_package__force_upload__uploads_existing_artifacts(self):
+        self.write_file("Fn/app.py", "print('hi')")
+        self.package(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: Fn\n"
+        )
+        self.s3_client.upload_file = Mock(wraps=self.s3_client.upload_file)
+
+        NativePackager(self.s3_client, "bucket", "prefix", force_upload=True).package(
+            self.build_dir / "template.yaml", self.output_path
+        )
+
+        self.s3_client.upload_file.assert_called_once()
+
+    def test_package__dry_run__rewrites_template_with_same_keys_without_uploading(self):
+        self.write_file("Fn/app.py", "print('hi')")
+        template = (
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: Fn\n"
+        )
+        self.write_file("template.yaml", template)
+        dry_run_template = NativePackager(
+            None, "bucket", "prefix", dry_run=True
+        ).package(self.build_dir / "template.yaml", self.output_path)
+
+        self.assertEqual({}, self.s3_client.objects)
+        self.assertEqual(dry_run_template, dump_template(self.package(template)))
+
+
+class TestArtifactIndex(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.index_directory = Path(self.directory.name)
+        self.s3_client = FakeS3Client()
+        self.s3_client.objects[("bucket", "prefix/exists")] = b""
+
+    def test_find_existing__lists_prefix_once(self):
+        index = ArtifactIndex()
+        self.assertEqual(
+            {"prefix/exists"},
+            index.find_existing(
+                self.s3_client, "bucket", "prefix", ["prefix/exists", "prefix/new"]
+            ),
+        )
+        self.assertEqual(1, self.s3_client.list_calls)
+
+    def test_find_existing__all_keys_known__does_not_list(self):
+        index = ArtifactIndex()
+        index.find_existing(self.s3_client, "bucket", "prefix", ["prefix/exists"])
+        index.find_existing(self.s3_client, "bucket", "prefix", ["prefix/exists"])
+        self.assertEqual(1, self.s3_client.list_calls)
+
+    def test_find_existing__persisted_index__later_index_does_not_list(self):
+        ArtifactIndex(self.index_directory).find_existing(
+            self.s3_client, "bucket", "prefix", ["prefix/exists"]
+        )
+        result = ArtifactIndex(self.index_directory).find_existing(
+            self.s3_client, "bucket", "prefix", ["prefix/exists"]
+        )
+        self.assertEqual({"prefix/exists"}, result)
+        self.assertEqual(1, self.s3_client.list_calls)
+
+    def test_find_existing__index_older_than_max_age__lists_again(self):
+        ArtifactIndex(self.index_directory).find_existing(
+            self.s3_client, "bucket", "prefix", ["prefix/exists"]
+        )
+        ArtifactIndex(self.index_directory, max_age=-1).find_existing(
+            self.s3_client, "bucket", "prefix", ["prefix/exists"]
+        )
+        self.assertEqual(2, self.s3_client.list_calls)
+
+    def test_find_existing__listing_denied__falls_back_to_head_requests(self):
+        self.s3_client.can_list = False
+        result = ArtifactIndex().find_existing(
+            self.s3_client, "bucket", "prefix", ["prefix/exists", "prefix/new"]
+        )
+        self.assertEqual({"prefix/exists"}, result)
+
+    def test_find_existing__listing_denied__persisted_index_skips_head_requests(self):
+        self.s3_client.can_list = False
+        ArtifactIndex(self.index_directory).find_existing(
+            self.s3_client, "bucket", "prefix", ["prefix/exists"]
+        )
+        self.s3_client.head_object = Mock(wraps=self.s3_client.head_object)
+
+        result = ArtifactIndex(self.index_directory).find_existing(
+            self.s3_client, "bucket", "prefix", ["prefix/exists"]
+        )
+
+        self.assertEqual({"prefix/exists"}, result)
+        self.s3_client.head_object.assert_not_called()
+
+    def test_add__persisted_without_listing__later_index_knows_keys(self):
+        ArtifactIndex(self.index_directory).add("bucket", "prefix", ["prefix/uploaded"])
+        self.s3_client.can_list = False
+
+        result = ArtifactIndex(self.index_directory).find_existing(
+            self.s3_client, "bucket", "prefix", ["prefix/uploaded"]
+        )
+
+        self.assertEqual({"prefix/uploaded"}, result)
+
+    def test_add__records_uploaded_keys(self):
+        index = ArtifactIndex()
+        index.find_existing(self.s3_client, "bucket", "prefix", ["prefix/exists"])
+        index.add("bucket", "prefix", ["prefix/uploaded"])
+        self.assertEqual(
+            {"prefix/uploaded"},
+            index.find_existing(
+                self.s3_client, "bucket", "prefix", ["prefix/uploaded"]
+            ),
+        )
+        self.assertEqual(1, self.s3_client.list_calls)
+
+
+class TestGetS3Client(TestCase):
+    def test_get_s3_client__same_session__returns_shared_client(self):
+        session = Mock()
+        connection_manager = Mock(**{"get_session.return_value": session})
+
+        first = get_s3_client(connection_manager, 4)
+        second = get_s3_client(connection_manager, 4)
+
+        self.assertIs(first, second)
+        session.client.assert_called_once()
+
+    def test_get_s3_client__session_released__drops_its_clients(self):
+        class FakeSession:
+            def client(self, *args, **kwargs):
+                return object()
+
+        connection_manager = Mock(**{"get_session.return_value": FakeSession()})
+        get_s3_client(connection_manager, 4)
+        session_count = len(_s3_clients)
+
+        connection_manager.get_session.return_value = None
+        gc.collect()
+
+        self.assertEqual(session_count - 1, len(_s3_clients))
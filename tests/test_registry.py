@@ -0,0 +1,115 @@
+import threading
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sam_handler.registry import BuildRegistry, TemplateMemo
+
+
+class TestBuildRegistry(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = BuildRegistry()
+
+    def test_build_once__same_key__builds_once(self):
+        build = Mock(return_value="result")
+        self.assertEqual("result", self.registry.build_once("key", build))
+        self.assertEqual("result", self.registry.build_once("key", build))
+        build.assert_called_once()
+
+    def test_build_once__different_keys__builds_each(self):
+        build = Mock()
+        self.registry.build_once("one", build)
+        self.registry.build_once("two", build)
+        self.assertEqual(2, build.call_count)
+
+    def test_build_once__build_fails__raises_and_allows_retry(self):
+        build = Mock(side_effect=[ValueError("boom"), "result"])
+        with self.assertRaises(ValueError):
+            self.registry.build_once("key", build)
+        self.assertFalse(self.registry.is_built("key"))
+        self.assertEqual("result", self.registry.build_once("key", build))
+
+    def test_build_once__concurrent_callers__wait_for_build_in_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        build_calls = []
+
+        def build():
+            build_calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        results = []
+        first = threading.Thread(
+            target=lambda: results.append(self.registry.build_once("key", build))
+        )
+        first.start()
+        started.wait(5)
+        second = threading.Thread(
+            target=lambda: results.append(self.registry.build_once("key", build))
+        )
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(["result", "result"], results)
+        self.assertEqual(1, len(build_calls))
+
+    def test_clear__forgets_completed_builds(self):
+        build = Mock()
+        self.registry.build_once("key", build)
+        self.registry.clear()
+        self.registry.build_once("key", build)
+        self.assertEqual(2, build.call_count)
+
+
+class TestTemplateMemo(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.fingerprints = {}
+        self.memo = TemplateMemo(
+            max_entries=2,
+            fingerprint=lambda paths, ignore_patterns: tuple(
+                self.fingerprints.get(p) for p in paths
+            ),
+        )
+
+    def put(self, key, path="template.yaml"):
+        self.memo.put(key, [path], self.memo.fingerprint([path], ()), f"{key} body")
+
+    def test_get__no_entry__returns_none(self):
+        self.assertIsNone(self.memo.get("missing"))
+
+    def test_get__sources_unchanged__returns_template(self):
+        self.put("key")
+        self.assertEqual("key body", self.memo.get("key"))
+
+    def test_get__sources_changed__returns_none_and_forgets_template(self):
+        self.put("key")
+        self.fingerprints["template.yaml"] = "changed"
+        self.assertIsNone(self.memo.get("key"))
+        self.fingerprints.clear()
+        self.assertIsNone(self.memo.get("key"))
+
+    def test_get__fingerprints_sources_with_their_ignore_patterns(self):
+        fingerprint = Mock(return_value="digest")
+        self.memo.fingerprint = fingerprint
+        self.memo.put("key", ["template.yaml"], "digest", "body", ["*.log"])
+
+        self.assertEqual("body", self.memo.get("key"))
+        fingerprint.assert_called_once_with(["template.yaml"], ("*.log",))
+
+    def test_put__over_max_entries__evicts_least_recently_used(self):
+        self.put("old")
+        self.put("used")
+        self.memo.get("old")
+        self.put("new")
+        self.assertIsNone(self.memo.get("used"))
+        self.assertEqual("old body", self.memo.get("old"))
+
+    def test_clear__forgets_templates(self):
+        self.put("key")
+        self.memo.clear()
+        self.assertIsNone(self.memo.get("key"))
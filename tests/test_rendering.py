@@ -0,0 +1,97 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from sam_handler.rendering import (
+    RenderCache,
+    find_template_sources,
+    get_render_key,
+    write_if_changed,
+)
+
+
+class RenderingTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+        self.template_path = self.write("template.yaml.j2", "{% include 'part.j2' %}")
+        self.part_path = self.write("part.j2", "{% import 'macros.j2' as macros %}")
+        self.macros_path = self.write("macros.j2", "{% macro m() %}{% endmacro %}")
+
+    def write(self, name: str, contents: str) -> Path:
+        path = self.directory / name
+        path.write_text(contents)
+        return path
+
+
+class TestFindTemplateSources(RenderingTestCase):
+    def test_find_template_sources__nested_references__returns_every_file(self):
+        self.assertEqual(
+            [self.template_path, self.part_path, self.macros_path],
+            find_template_sources(self.template_path, {}),
+        )
+
+    def test_find_template_sources__dynamic_include__returns_none(self):
+        self.part_path.write_text("{% include sceptre_user_data.name %}")
+        self.assertIsNone(find_template_sources(self.template_path, {}))
+
+    def test_find_template_sources__custom_loader__returns_none(self):
+        self.assertIsNone(find_template_sources(self.template_path, {"loader": "x"}))
+
+    def test_find_template_sources__custom_syntax__parses_with_it(self):
+        self.template_path.write_text("<% include 'part.j2' %>")
+        self.assertIn(
+            self.part_path,
+            find_template_sources(
+                self.template_path,
+                {"block_start_string": "<%", "block_end_string": "%>"},
+            ),
+        )
+
+
+class TestGetRenderKey(RenderingTestCase):
+    def get_key(self, user_data=None, j2_environment=None):
+        return get_render_key(
+            self.template_path, user_data or {"a": 1}, j2_environment or {}
+        )
+
+    def test_get_render_key__nothing_changed__returns_same_key(self):
+        self.assertEqual(self.get_key(), self.get_key())
+
+    def test_get_render_key__included_file_changed__returns_new_key(self):
+        key = self.get_key()
+        self.macros_path.write_text("changed")
+        self.assertNotEqual(key, self.get_key())
+
+    def test_get_render_key__user_data_or_environment_changed__returns_new_key(self):
+        keys = {
+            self.get_key(),
+            self.get_key(user_data={"a": 2}),
+            self.get_key(j2_environment={"trim_blocks": True}),
+        }
+        self.assertEqual(3, len(keys))
+
+
+class TestRenderCache(TestCase):
+    def test_put__over_max_entries__evicts_least_recently_used(self):
+        cache = RenderCache(max_entries=2)
+        cache.put("old", "1")
+        cache.put("used", "2")
+        cache.get("used")
+        cache.put("new", "3")
+
+        self.assertIsNone(cache.get("old"))
+        self.assertEqual("2", cache.get("used"))
+        self.assertEqual("3", cache.get("new"))
+
+
+class TestWriteIfChanged(TestCase):
+    def test_write_if_changed__only_writes_new_contents(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory, "file")
+            self.assertTrue(write_if_changed(path, "a"))
+            self.assertFalse(write_if_changed(path, "a"))
+            self.assertTrue(write_if_changed(path, "b"))
+            self.assertEqual("b", path.read_text())
@@ -0,0 +1,329 @@
+from pathlib import Path
+from unittest import TestCase
+
+from sam_handler.template import (
+    LocalArtifact,
+    TaggedValue,
+    dump_template,
+    iter_local_artifacts,
+    iter_local_inputs,
+    iter_local_paths,
+    load_template,
+    make_local_paths_absolute,
+)
+
+
+class TestTemplate(TestCase):
+    def test_load_template__preserves_intrinsic_function_tags(self):
+        template = load_template(
+            "Outputs:\n"
+            "  Arn:\n"
+            "    Value: !GetAtt Fn.Arn\n"
+            "  Joined:\n"
+            "    Value: !Join ['', [a, !Ref B]]\n"
+        )
+        self.assertEqual(
+            TaggedValue("!GetAtt", "Fn.Arn"), template["Outputs"]["Arn"]["Value"]
+        )
+        self.assertEqual(
+            TaggedValue("!Join", ["", ["a", TaggedValue("!Ref", "B")]]),
+            template["Outputs"]["Joined"]["Value"],
+        )
+
+    def test_dump_template__round_trips_intrinsic_functions(self):
+        body = (
+            "Resources:\n"
+            "  Fn:\n"
+            "    Properties:\n"
+            "      Role: !Sub 'arn:${AWS::Partition}:iam::role'\n"
+            "      Env: !If [IsProd, !Ref Prod, {Key: value}]\n"
+        )
+        template = load_template(body)
+        self.assertEqual(template, load_template(dump_template(template)))
+
+    def test_iter_local_artifacts__yields_local_packageable_properties(self):
+        template = load_template(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src/fn\n"
+            "  Layer:\n"
+            "    Type: AWS::Serverless::LayerVersion\n"
+            "    Properties:\n"
+            "      ContentUri: layer\n"
+            "  Remote:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: s3://bucket/key.zip\n"
+            "  Bucket:\n"
+            "    Type: AWS::S3::Bucket\n"
+        )
+        base = Path("/project")
+        self.assertEqual(
+            [
+                LocalArtifact(
+                    "Fn", "AWS::Serverless::Function", "CodeUri", base / "src/fn"
+                ),
+                LocalArtifact(
+                    "Layer",
+                    "AWS::Serverless::LayerVersion",
+                    "ContentUri",
+                    base / "layer",
+                ),
+            ],
+            list(iter_local_artifacts(template, base)),
+        )
+
+    def test_iter_local_artifacts__inherits_code_uri_from_globals(self):
+        template = load_template(
+            "Globals:\n"
+            "  Function:\n"
+            "    CodeUri: shared\n"
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      Handler: app.handler\n"
+        )
+        artifacts = list(iter_local_artifacts(template, Path("/project")))
+        self.assertEqual([Path("/project/shared")], [a.path for a in artifacts])
+
+    def test_iter_local_artifacts__default_code_uri__yields_base_directory(self):
+        template = load_template(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      Handler: app.handler\n"
+        )
+        artifacts = list(iter_local_artifacts(template, Path("/project")))
+        self.assertEqual(
+            [
+                LocalArtifact(
+                    "Fn", "AWS::Serverless::Function", "CodeUri", Path("/project")
+                )
+            ],
+            artifacts,
+        )
+
+    def test_iter_local_artifacts__skips_intrinsic_function_values(self):
+        template = load_template(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: !Sub 's3://${Bucket}/key.zip'\n"
+        )
+        self.assertEqual([], list(iter_local_artifacts(template, Path("/project"))))
+
+    def test_make_local_paths_absolute__rewrites_relative_paths(self):
+        template = load_template(
+            "Globals:\n"
+            "  Function:\n"
+            "    CodeUri: shared\n"
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src/fn\n"
+            "  Remote:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: s3://bucket/key.zip\n"
+            "  Absolute:\n"
+            "    Type: AWS::Serverless::LayerVersion\n"
+            "    Properties:\n"
+            "      ContentUri: /opt/layer\n"
+            "  Image:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Metadata:\n"
+            "      DockerContext: ./image\n"
+        )
+        make_local_paths_absolute(template, Path("/project"))
+
+        resources = template["Resources"]
+        self.assertEqual("/project/shared", template["Globals"]["Function"]["CodeUri"])
+        self.assertEqual("/project/src/fn", resources["Fn"]["Properties"]["CodeUri"])
+        self.assertEqual(
+            "s3://bucket/key.zip", resources["Remote"]["Properties"]["CodeUri"]
+        )
+        self.assertEqual(
+            "/opt/layer", resources["Absolute"]["Properties"]["ContentUri"]
+        )
+        self.assertEqual(
+            "/project/image", resources["Image"]["Metadata"]["DockerContext"]
+        )
+
+    def test_make_local_paths_absolute__rewrites_other_path_properties(self):
+        template = load_template(
+            "Resources:\n"
+            "  Machine:\n"
+            "    Type: AWS::StepFunctions::StateMachine\n"
+            "    Properties:\n"
+            "      DefinitionS3Location: machine.json\n"
+            "  Api:\n"
+            "    Type: AWS::ApiGateway::RestApi\n"
+            "    Properties:\n"
+            "      BodyS3Location: api.yaml\n"
+            "  Job:\n"
+            "    Type: AWS::Glue::Job\n"
+            "    Properties:\n"
+            "      Command:\n"
+            "        ScriptLocation: jobs/etl.py\n"
+            "  Bucket:\n"
+            "    Type: AWS::S3::Bucket\n"
+            "    Properties:\n"
+            "      Fn::Transform:\n"
+            "        Name: AWS::Include\n"
+            "        Parameters:\n"
+            "          Location: snippets/bucket.yaml\n"
+            "Outputs:\n"
+            "  Included: !Transform\n"
+            "    Name: AWS::Include\n"
+            "    Parameters:\n"
+            "      Location: snippets/output.yaml\n"
+        )
+        make_local_paths_absolute(template, Path("/project"))
+
+        resources = template["Resources"]
+        self.assertEqual(
+            "/project/machine.json",
+            resources["Machine"]["Properties"]["DefinitionS3Location"],
+        )
+        self.assertEqual(
+            "/project/api.yaml", resources["Api"]["Properties"]["BodyS3Location"]
+        )
+        self.assertEqual(
+            "/project/jobs/etl.py",
+            resources["Job"]["Properties"]["Command"]["ScriptLocation"],
+        )
+        self.assertEqual(
+            "/project/snippets/bucket.yaml",
+            resources["Bucket"]["Properties"]["Fn::Transform"]["Parameters"][
+                "Location"
+            ],
+        )
+        self.assertEqual(
+            "/project/snippets/output.yaml",
+            template["Outputs"]["Included"].value["Parameters"]["Location"],
+        )
+
+    def test_make_local_paths_absolute__sets_default_code_uri(self):
+        template = load_template(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      Handler: app.handler\n"
+            "  Layer:\n"
+            "    Type: AWS::Serverless::LayerVersion\n"
+            "    Properties:\n"
+            "      LayerName: layer\n"
+            "  Inline:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      InlineCode: print()\n"
+            "  Image:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      PackageType: Image\n"
+        )
+        make_local_paths_absolute(template, Path("/project"))
+
+        resources = template["Resources"]
+        self.assertEqual("/project", resources["Fn"]["Properties"]["CodeUri"])
+        self.assertEqual("/project", resources["Layer"]["Properties"]["ContentUri"])
+        self.assertNotIn("CodeUri", resources["Inline"]["Properties"])
+        self.assertNotIn("CodeUri", resources["Image"]["Properties"])
+
+    def test_make_local_paths_absolute__code_uri_in_globals__keeps_default_unset(self):
+        template = load_template(
+            "Globals:\n"
+            "  Function:\n"
+            "    CodeUri: src\n"
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      Handler: app.handler\n"
+        )
+        make_local_paths_absolute(template, Path("/project"))
+
+        self.assertEqual("/project/src", template["Globals"]["Function"]["CodeUri"])
+        self.assertNotIn("CodeUri", template["Resources"]["Fn"]["Properties"])
+
+    def test_iter_local_paths__skips_remote_and_intrinsic_values(self):
+        template = load_template(
+            "Resources:\n"
+            "  Machine:\n"
+            "    Type: AWS::StepFunctions::StateMachine\n"
+            "    Properties:\n"
+            "      DefinitionS3Location:\n"
+            "        Bucket: bucket\n"
+            "        Key: machine.json\n"
+            "  Api:\n"
+            "    Type: AWS::ApiGateway::RestApi\n"
+            "    Properties:\n"
+            "      BodyS3Location: s3://bucket/api.yaml\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: !Ref Code\n"
+            "      Fn::Transform:\n"
+            "        Name: AWS::Include\n"
+            "        Parameters:\n"
+            "          Location: s3://bucket/snippet.yaml\n"
+        )
+        self.assertEqual([], list(iter_local_paths(template)))
+
+    def test_iter_local_inputs__yields_every_local_path_once(self):
+        template = load_template(
+            "Globals:\n"
+            "  Function:\n"
+            "    CodeUri: src\n"
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "  Other:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src\n"
+            "  Image:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Metadata:\n"
+            "      DockerContext: image\n"
+            "  Machine:\n"
+            "    Type: AWS::StepFunctions::StateMachine\n"
+            "    Properties:\n"
+            "      DefinitionS3Location: machine.json\n"
+            "      Fn::Transform:\n"
+            "        Name: AWS::Include\n"
+            "        Parameters:\n"
+            "          Location: snippets/machine.yaml\n"
+        )
+        base = Path("/project")
+        self.assertEqual(
+            [
+                base / "src",
+                base / "image",
+                base / "machine.json",
+                base / "snippets/machine.yaml",
+            ],
+            list(iter_local_inputs(template, base)),
+        )
+
+    def test_iter_local_inputs__default_code_uri__yields_base_directory(self):
+        template = load_template(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      Handler: app.handler\n"
+            "  Layer:\n"
+            "    Type: AWS::Serverless::LayerVersion\n"
+            "    Properties:\n"
+            "      LayerName: layer\n"
+        )
+        base = Path("/project")
+        self.assertEqual([base], list(iter_local_inputs(template, base)))
@@ -0,0 +1,118 @@
+import json
+import logging
+import pstats
+import tempfile
+import tracemalloc
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sam_handler.timing import (
+    JsonLinesSink,
+    LoggerSink,
+    Span,
+    Tracer,
+    register_sink,
+    unregister_sink,
+)
+
+
+class TestTracer(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.spans = []
+        self.tracer = Tracer([self.spans.append], {"stack": "stack"})
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+
+    def test_span__emits_span_with_attributes(self):
+        with self.tracer.span("build", extra="value"):
+            pass
+
+        [span] = self.spans
+        self.assertEqual("build", span.phase)
+        self.assertEqual({"stack": "stack", "extra": "value"}, span.attributes)
+        self.assertGreaterEqual(span.duration, 0)
+
+    def test_span__body_adds_attribute__emits_it(self):
+        with self.tracer.span("cache_lookup") as span:
+            span["cache"] = "hit"
+
+        self.assertEqual("hit", self.spans[0].attributes["cache"])
+
+    def test_span__body_raises__still_emits_span(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.span("build"):
+                raise ValueError()
+
+        self.assertEqual(1, len(self.spans))
+
+    def test_span__sink_raises__does_not_fail(self):
+        tracer = Tracer([Mock(side_effect=Exception()), self.spans.append])
+        with tracer.span("build"):
+            pass
+
+        self.assertEqual(1, len(self.spans))
+
+    def test_span__registered_sink__receives_span(self):
+        spans = []
+        register_sink(spans.append)
+        self.addCleanup(unregister_sink, spans.append)
+
+        with Tracer().span("build"):
+            pass
+
+        self.assertEqual(["build"], [span.phase for span in spans])
+
+    def test_span__cprofile__writes_stats_dump(self):
+        tracer = Tracer(profiler="cprofile", profile_path_prefix=self.directory / "t")
+        with tracer.span("build", profile=True):
+            sum(range(100))
+
+        pstats.Stats(str(self.directory / "t.build.cprofile"))
+
+    def test_span__tracemalloc__writes_snapshot_dump(self):
+        tracer = Tracer(
+            profiler="tracemalloc", profile_path_prefix=self.directory / "t"
+        )
+        with tracer.span("build", profile=True):
+            [object() for _ in range(100)]
+
+        tracemalloc.Snapshot.load(str(self.directory / "t.build.tracemalloc"))
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_span__not_profiled__writes_no_dump(self):
+        tracer = Tracer(profiler="cprofile", profile_path_prefix=self.directory / "t")
+        with tracer.span("build"):
+            pass
+
+        self.assertEqual([], list(self.directory.iterdir()))
+
+
+class TestSinks(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.span = Span("build", 1000.0, 1.5, {"stack": "stack"})
+
+    def test_json_lines_sink__appends_span(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory, "nested", "spans.jsonl")
+            sink = JsonLinesSink(path)
+            sink(self.span)
+            sink(self.span)
+
+            lines = path.read_text().splitlines()
+
+        self.assertEqual(2, len(lines))
+        self.assertEqual(
+            {"phase": "build", "start": 1000.0, "duration": 1.5, "stack": "stack"},
+            json.loads(lines[0]),
+        )
+
+    def test_logger_sink__logs_span(self):
+        logger = logging.getLogger("test_timing")
+        with self.assertLogs(logger, logging.DEBUG) as logs:
+            LoggerSink(logger)(self.span)
+
+        self.assertIn("build took 1.500s stack=stack", logs.output[0])
@@ -0,0 +1,164 @@
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from benchmarks.fake_sam import FakeConnectionManager
+from sam_handler.handler import SAM
+from sam_handler.registry import BuildRegistry, ResultRegistry, TemplateMemo
+from sam_handler.rendering import RenderCache
+from sam_handler.watch import Watcher
+from tests.fakes import FakeInvoker
+
+
+class TestWatcher(TestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = Path(temp_dir.name)
+        self.invoker = FakeInvoker()
+        self.build_registry = BuildRegistry()
+        self.template_memo = TemplateMemo()
+        self.template_path = self.directory / "project" / "template.yaml"
+        self.code_path = self.directory / "project" / "src" / "app.py"
+        self.code_path.parent.mkdir(parents=True)
+        self.template_path.write_text(
+            "Resources:\n"
+            "  Fn:\n"
+            "    Type: AWS::Serverless::Function\n"
+            "    Properties:\n"
+            "      CodeUri: src\n"
+        )
+        self.code_path.write_text("v1")
+        self.handler = self.create_handler("group/stack")
+        self.handled = []
+        self.sleeps = []
+        self.changes = []
+        self.watcher = Watcher(
+            [self.handler],
+            on_handled=lambda handler, template: self.handled.append(template),
+            sleep=self.sleep,
+        )
+
+    def create_handler(self, name: str) -> SAM:
+        return SAM(
+            name,
+            arguments={
+                "path": str(self.template_path),
+                "artifact_bucket_name": "bucket",
+                "cache_dir": str(self.directory / "cache"),
+                "incremental_build": False,
+            },
+            connection_manager=FakeConnectionManager(),
+            stack_group_config={},
+            invoker_class=self.invoker,
+            get_temp_dir=lambda: str(self.directory / "temp"),
+            build_registry=self.build_registry,
+            result_registry=ResultRegistry(),
+            render_cache=RenderCache(),
+            template_memo=self.template_memo,
+        )
+
+    def commands(self) -> list:
+        return [command.name for command in self.invoker.commands]
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        if self.changes:
+            self.changes.pop(0)()
+
+    def change_code(self):
+        # Set the modification time explicitly, since it may not change otherwise on fast writes.
+        mtime = self.code_path.stat().st_mtime_ns + 1_000_000_000
+        os.utime(self.code_path, ns=(mtime, mtime))
+
+    def test_init__sets_defaults_without_overriding_configuration(self):
+        self.assertEqual("worker", self.handler.arguments["invoker"])
+        self.assertFalse(self.handler.arguments["incremental_build"])
+
+    def test_run_once__handles_templates(self):
+        errors = self.watcher.run_once([self.handler])
+
+        self.assertEqual({}, errors)
+        self.assertEqual(1, len(self.handled))
+        self.assertTrue(self.handled[0].startswith("packaged"))
+        self.assertEqual(["build", "package"], self.commands())
+
+    def test_run_once__code_unchanged__reuses_shared_build(self):
+        other_handler = self.create_handler("group/other")
+        self.watcher.run_once([self.handler, other_handler])
+        self.template_memo.clear()
+
+        self.watcher.run_once([self.handler, other_handler])
+
+        self.assertEqual(["build"] + ["package"] * 4, self.commands())
+
+    def test_run_once__handle_fails__returns_error_and_watches_sources(self):
+        self.invoker.fail = True
+
+        errors = self.watcher.run_once([self.handler])
+
+        self.assertIsInstance(errors["group/stack"], subprocess.CalledProcessError)
+        self.changes.append(self.change_code)
+        self.assertEqual([self.handler], self.watcher.wait_for_changes())
+
+    def test_wait_for_changes__code_changed__returns_handler(self):
+        self.watcher.run_once([self.handler])
+        self.changes.append(self.change_code)
+
+        self.assertEqual([self.handler], self.watcher.wait_for_changes())
+
+    def test_wait_for_changes__changes_keep_coming__waits_for_them_to_settle(self):
+        self.watcher.run_once([self.handler])
+        self.changes.extend([self.change_code] * 3)
+
+        self.watcher.wait_for_changes()
+
+        self.assertEqual(
+            [self.watcher.poll_interval] + [self.watcher.debounce] * 3, self.sleeps
+        )
+
+    def test_run__code_changed__builds_and_packages_again(self):
+        self.changes.append(self.change_code)
+
+        self.watcher.run(max_runs=2)
+
+        self.assertEqual(["build", "package"] * 2, self.commands())
+        self.assertEqual(2, len(self.handled))
+
+    def test_run__included_file_changed__handles_again(self):
+        snippet_path = self.directory / "project" / "snippets" / "bucket.yaml"
+        snippet_path.parent.mkdir()
+        snippet_path.write_text("BucketName: v1")
+        with self.template_path.open("a") as f:
+            f.write(
+                "  Bucket:\n"
+                "    Type: AWS::S3::Bucket\n"
+                "    Properties:\n"
+                "      Fn::Transform:\n"
+                "        Name: AWS::Include\n"
+                "        Parameters:\n"
+                "          Location: snippets/bucket.yaml\n"
+            )
+
+        def change_snippet():
+            snippet_path.write_text("BucketName: version2")
+
+        self.changes.append(change_snippet)
+
+        self.watcher.run(max_runs=2)
+
+        self.assertEqual(["build", "package"] * 2, self.commands())
+
+    def test_run__unrelated_file_changed__keeps_waiting(self):
+        other_path = self.directory / "project" / "README.md"
+        other_path.write_text("docs")
+        self.changes.extend(
+            [lambda: other_path.write_text("more docs"), self.change_code]
+        )
+
+        self.watcher.run(max_runs=2)
+
+        self.assertEqual(2, self.sleeps.count(self.watcher.poll_interval))
@@ -0,0 +1,172 @@
+import functools
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from sam_handler.worker import (
+    SamWorker,
+    SamWorkerPool,
+    WorkerUnavailableError,
+    find_sam_python,
+)
+
+FAKE_SAM_CLI = """
+import os
+import sys
+
+import click
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--code", type=int, default=0)
+def echo(code):
+    print(f"{os.getcwd()} {os.environ.get('SOME_ENV')}")
+    sys.exit(code)
+"""
+
+
+class TestSamWorker(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = Path(self.directory.name)
+        package = self.root / "site" / "samcli" / "cli"
+        package.mkdir(parents=True)
+        (package.parent / "__init__.py").write_text("")
+        (package / "__init__.py").write_text("")
+        (package / "main.py").write_text(textwrap.dedent(FAKE_SAM_CLI))
+        self.popen = functools.partial(
+            subprocess.Popen,
+            env={**os.environ, "PYTHONPATH": str(self.root / "site")},
+            stderr=subprocess.DEVNULL,
+        )
+
+    def test_run__returns_exit_codes_of_successive_commands(self):
+        worker = SamWorker(sys.executable, popen=self.popen)
+        self.addCleanup(worker.close)
+
+        self.assertEqual(0, worker.run(["echo"], self.root, {"SOME_ENV": "x"}))
+        self.assertEqual(3, worker.run(["echo", "--code", "3"], self.root, {}))
+        self.assertEqual(2, worker.run(["missing"], self.root, {}))
+
+    def test_run__forwards_command_output(self):
+        worker = SamWorker(sys.executable, popen=self.popen)
+        self.addCleanup(worker.close)
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+
+        worker.run(["echo"], self.root, {"SOME_ENV": "x"}, write_fd)
+        worker.run(["echo", "--code", "3"], self.root, {}, write_fd)
+        os.close(write_fd)
+
+        with os.fdopen(os.dup(read_fd)) as pipe:
+            self.assertEqual(
+                [f"{self.root.resolve()} x", f"{self.root.resolve()} None"],
+                pipe.read().splitlines(),
+            )
+
+    def test_init__sam_cli_not_importable__raises_worker_unavailable_error(self):
+        popen = functools.partial(
+            subprocess.Popen,
+            env={**os.environ, "PYTHONPATH": str(self.root)},
+            stderr=subprocess.DEVNULL,
+        )
+        with self.assertRaises(WorkerUnavailableError):
+            SamWorker(sys.executable, popen=popen)
+
+
+class TestSamWorkerPool(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.workers = []
+        self.pool = SamWorkerPool("python", max_workers=2, worker_class=self.new_worker)
+
+    def new_worker(self, python):
+        worker = Mock(spec=SamWorker, is_alive=True)
+        worker.run.return_value = 0
+        self.workers.append(worker)
+        return worker
+
+    def test_run__reuses_idle_worker(self):
+        self.pool.run(["build"], Path("/project"), {})
+        self.pool.run(["package"], Path("/project"), {})
+        self.assertEqual(1, len(self.workers))
+        self.assertEqual(2, self.workers[0].run.call_count)
+
+    def test_run__concurrent_commands__limited_to_max_workers(self):
+        release = threading.Event()
+
+        def new_blocking_worker(python):
+            worker = self.new_worker(python)
+            worker.run.side_effect = lambda *args: release.wait(5) and 0
+            return worker
+
+        self.pool.worker_class = new_blocking_worker
+        threads = [
+            threading.Thread(target=self.pool.run, args=(["build"], Path("/p"), {}))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(2, len(self.workers))
+
+    def test_run__worker_dies__discards_worker(self):
+        self.pool.run(["build"], Path("/project"), {})
+        self.workers[0].run.side_effect = WorkerUnavailableError("died")
+        with self.assertRaises(WorkerUnavailableError):
+            self.pool.run(["build"], Path("/project"), {})
+
+        self.pool.run(["build"], Path("/project"), {})
+        self.assertEqual(2, len(self.workers))
+
+    def test_run__worker_cannot_start__marks_pool_unavailable(self):
+        self.pool.worker_class = Mock(side_effect=WorkerUnavailableError("no sam"))
+        with self.assertRaises(WorkerUnavailableError):
+            self.pool.run(["build"], Path("/project"), {})
+        self.assertFalse(self.pool.is_available)
+
+    def test_close__closes_idle_workers(self):
+        self.pool.run(["build"], Path("/project"), {})
+        self.pool.close()
+        self.workers[0].close.assert_called_once()
+
+
+class TestFindSamPython(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.bin = Path(self.directory.name)
+
+    def write_sam(self, contents):
+        sam = self.bin / "sam"
+        sam.write_text(contents)
+        sam.chmod(0o755)
+
+    def test_find_sam_python__console_script__returns_shebang_interpreter(self):
+        self.write_sam("#!/opt/sam/venv/bin/python3\nimport samcli\n")
+        with patch.dict(os.environ, {"PATH": str(self.bin)}):
+            self.assertEqual("/opt/sam/venv/bin/python3", find_sam_python())
+
+    def test_find_sam_python__native_installer_wrapper__returns_none(self):
+        self.write_sam('#!/bin/sh\nexec /usr/local/aws-sam-cli/dist/sam "$@"\n')
+        with patch.dict(os.environ, {"PATH": str(self.bin)}), patch(
+            "importlib.util.find_spec", return_value=None
+        ):
+            self.assertIsNone(find_sam_python())
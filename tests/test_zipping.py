@@ -0,0 +1,99 @@
+import os
+import stat
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+
+from sam_handler.zipping import FIXED_DATE_TIME, make_zip, make_zips
+
+
+class TestZipping(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = Path(self.directory.name)
+        self.source = self.root / "source"
+        self.write_file("b.py", "b")
+        self.write_file("a/z.py", "z")
+        self.write_file("a/bootstrap", "#!/bin/sh")
+        (self.source / "a/bootstrap").chmod(0o700)
+
+    def write_file(self, relative_path, contents, source=None):
+        path = (source or self.source) / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+        return path
+
+    def test_make_zip__entries_are_sorted(self):
+        make_zip(self.source, self.root / "out.zip")
+        with zipfile.ZipFile(self.root / "out.zip") as archive:
+            self.assertEqual(["a/bootstrap", "a/z.py", "b.py"], archive.namelist())
+
+    def test_make_zip__timestamps_and_permissions_are_normalized(self):
+        make_zip(self.source, self.root / "out.zip")
+        with zipfile.ZipFile(self.root / "out.zip") as archive:
+            infos = {info.filename: info for info in archive.infolist()}
+        self.assertEqual(FIXED_DATE_TIME, infos["b.py"].date_time)
+        self.assertEqual(0o644, stat.S_IMODE(infos["b.py"].external_attr >> 16))
+        self.assertEqual(0o755, stat.S_IMODE(infos["a/bootstrap"].external_attr >> 16))
+
+    def test_make_zip__same_contents_with_different_mtimes__identical_bytes(self):
+        other = self.root / "other"
+        self.write_file("a/z.py", "z", other)
+        self.write_file("a/bootstrap", "#!/bin/sh", other).chmod(0o755)
+        self.write_file("b.py", "b", other)
+        os.utime(other / "b.py", (1000, 1000))
+
+        first_digest = make_zip(self.source, self.root / "first.zip")
+        second_digest = make_zip(other, self.root / "second.zip")
+
+        self.assertEqual(first_digest, second_digest)
+        self.assertEqual(
+            (self.root / "first.zip").read_bytes(),
+            (self.root / "second.zip").read_bytes(),
+        )
+
+    def test_make_zip__contents_changed__digest_changes(self):
+        before = make_zip(self.source, self.root / "out.zip")
+        self.write_file("b.py", "changed")
+        self.assertNotEqual(before, make_zip(self.source, self.root / "out.zip"))
+
+    def test_make_zip__single_file__stored_at_archive_root(self):
+        make_zip(self.source / "a" / "z.py", self.root / "out.zip")
+        with zipfile.ZipFile(self.root / "out.zip") as archive:
+            self.assertEqual(["z.py"], archive.namelist())
+            self.assertEqual(b"z", archive.read("z.py"))
+
+    def test_make_zips__returns_digest_per_destination(self):
+        other = self.root / "other"
+        self.write_file("c.py", "c", other)
+        jobs = [
+            (self.source, self.root / "source.zip"),
+            (other, self.root / "other.zip"),
+        ]
+        with ThreadPoolExecutor() as executor:
+            digests = make_zips(jobs, executor)
+
+        self.assertEqual(
+            {
+                self.root
+                / "source.zip": make_zip(self.source, self.root / "check.zip"),
+                self.root / "other.zip": make_zip(other, self.root / "check.zip"),
+            },
+            digests,
+        )
+
+    def test_make_zips__default_process_pool__creates_archives(self):
+        other = self.root / "other"
+        self.write_file("c.py", "c", other)
+        digests = make_zips(
+            [
+                (self.source, self.root / "source.zip"),
+                (other, self.root / "other.zip"),
+            ]
+        )
+        self.assertEqual(2, len(digests))
+        self.assertTrue((self.root / "other.zip").exists())